@@ -0,0 +1,106 @@
+"""Cold-start import time and per-call client latency for the Python functions.
+
+    python benchmarks/cold_start.py [--runs 15] [--calls 300]
+
+Import time is measured in a fresh interpreter per run, for each function's
+app module as shipped (clients from the shared aws_clients layer, built on
+first use) and for the old pattern of importing boto3 and building a default
+client at module load. Per-call latency is measured against a local HTTP
+stand-in, so no AWS account or network is needed.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "src", "layers", "python")
+FUNCTIONS = ["list_users", "admin_invite", "delete", "backup", "restore", "health_check"]
+
+ENV = {
+    "AWS_DEFAULT_REGION": "eu-central-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "USER_POOL_ID": "eu-central-1_bench",
+    "ALERT_TOPIC_ARN": "arn:aws:sns:eu-central-1:000000000000:bench",
+    "USER_DIRECTORY_TABLE": "bench",
+    "BACKUP_TABLE": "bench",
+}
+
+TIMED_IMPORT = "import time; t = time.perf_counter(); {stmt}; print(time.perf_counter() - t)"
+EAGER = "import boto3; boto3.client('cognito-idp')"
+
+
+def timed(stmt, cwd, runs):
+    env = {**os.environ, **ENV, "PYTHONPATH": os.pathsep.join([cwd, LAYER])}
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", TIMED_IMPORT.format(stmt=stmt)],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True,
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+    return statistics.median(samples)
+
+
+class StandIn(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"Users": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def call_latency(client, calls):
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        client.list_users(UserPoolId=ENV["USER_POOL_ID"])
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--calls", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"Cold import, median of {args.runs} fresh interpreters (ms)")
+    print(f"  {'eager boto3 client':<22}{timed(EAGER, LAYER, args.runs):8.1f}")
+    for name in FUNCTIONS:
+        print(f"  {name:<22}{timed('import app', os.path.join(ROOT, 'src', name), args.runs):8.1f}")
+
+    os.environ.update(ENV)
+    sys.path.insert(0, LAYER)
+    import boto3
+    import aws_clients
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"\nlist_users against a local stand-in, {args.calls} calls (ms, p50 / p99)")
+    for label, client in (
+        ("default client", boto3.client("cognito-idp", endpoint_url=endpoint)),
+        ("aws_clients.client", aws_clients.client("cognito-idp", endpoint)),
+    ):
+        call_latency(client, 10)  # warm the connection pool
+        p50, p99 = call_latency(client, args.calls)
+        print(f"  {label:<22}{p50:8.2f} /{p99:7.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Render time per trigger source for the CustomMessage Lambda.
+
+    python benchmarks/custom_message.py [--iterations 20000]
+
+Calls lambda_handler in-process with a representative event for every
+trigger source and reports p50 / p99 in microseconds.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src", "custom_message"))
+
+TRIGGERS = [
+    "CustomMessage_SignUp",
+    "CustomMessage_AdminCreateUser",
+    "CustomMessage_ForgotPassword",
+    "CustomMessage_VerifyUserAttribute",
+    "CustomMessage_UpdateUserAttribute",
+    "CustomMessage_ResendCode",
+    "CustomMessage_Authentication",
+    "CustomMessage_Unknown",
+]
+
+
+def event(trigger):
+    return {
+        "triggerSource": trigger,
+        "request": {
+            "userAttributes": {"email": "jane.doe+test@example.com", "name": "Jane Doe"},
+            "codeParameter": "{####}",
+        },
+        "response": {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    import app
+    print(f"import (template load + compile): {(time.perf_counter() - started) * 1000:.1f} ms\n")
+
+    print(f"{'trigger':<36}{'p50 us':>10}{'p99 us':>10}")
+    for trigger in TRIGGERS:
+        template = event(trigger)
+        events = [copy.deepcopy(template) for _ in range(args.iterations)]
+        samples = []
+        for e in events:
+            t = time.perf_counter()
+            app.lambda_handler(e, None)
+            samples.append((time.perf_counter() - t) * 1e6)
+        samples.sort()
+        print(f"{trigger:<36}{samples[len(samples) // 2]:10.2f}{samples[int(len(samples) * 0.99) - 1]:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""End-to-end benchmark of every Python lambda_handler against local stand-ins.
+
+    python benchmarks/handlers.py [--sizes 1000,10000,100000] [--handlers backup,restore]
+                                  [--latency-ms 20] [--throttle-rate 0.02] [--quota]
+                                  [--timeout-s 900] [--cold-runs 5] [--no-memory]
+                                  [--output results.json]
+
+Each scenario gets a fresh synthetic pool of the given size (see
+stand_ins.seed_pool) and runs the handler in-process, playing back any
+asynchronous self-invocations (chunked jobs, bulk invite/delete jobs) until
+the work is done. Reported per scenario:
+
+  wall       seconds for the whole run, every chained invocation included
+  inv        number of handler invocations
+  calls      API calls made, with the busiest operations listed
+  throttled  calls the stand-ins rejected with a throttling error
+  peak MB    peak Python heap during a second, traced run (tracemalloc)
+  import ms  cold import of the function's module in a fresh interpreter
+
+--latency-ms adds a fixed delay to every AWS call and --throttle-rate
+throttles that share of Cognito calls. By default the per-API rate limits
+in the functions are lifted, so the numbers show the code's own cost. Pass
+--quota to keep the limits the functions ship with, which is what sizes
+Timeout in template.yaml. --timeout-s is the simulated Lambda timeout.
+Authorisation is bypassed; token verification has its own numbers.
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "src", "layers", "python")
+sys.path.insert(0, LAYER)
+
+POOL_ID = "eu-central-1_bench"
+TABLES = {"backup": "UserPoolBackupTable", "ops": "OpsStateTable", "directory": "UserDirectoryTable"}
+ORIGIN = "https://main.bench.amplifyapp.com"
+ENV = {
+    "AWS_DEFAULT_REGION": "eu-central-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "USER_POOL_ID": POOL_ID,
+    "ALERT_TOPIC_ARN": "arn:aws:sns:eu-central-1:000000000000:bench",
+    "BACKUP_TABLE": TABLES["backup"],
+    "OPS_STATE_TABLE": TABLES["ops"],
+    "USER_DIRECTORY_TABLE": TABLES["directory"],
+    "WRITE_QUEUE_URL": "https://sqs.bench/writes",
+    "AMPLIFY_LOCAL_DOMAIN": "http://localhost:4200",
+    "AMPLIFY_PROD_DOMAIN": ORIGIN,
+}
+# The consumer's event source settings in template.yaml.
+SQS_BATCH_SIZE = 5
+SQS_MAX_RECEIVES = 3
+# Per-API request rates the functions otherwise hold themselves to.
+RATE_LIMITS = ["INVITE_CREATE_RPS", "INVITE_UPDATE_RPS", "DELETE_RPS", "DELETE_READ_RPS",
+               "RESTORE_CREATE_RPS", "RESTORE_UPDATE_RPS"]
+
+FUNCTIONS = {
+    "list_users": ("list_users", "app"),
+    "admin_invite": ("admin_invite", "app"),
+    "delete": ("delete", "app"),
+    "export_users": ("export_users", "app"),
+    "backup": ("backup", "app"),
+    "restore": ("restore", "app"),
+    "health_check": ("health_check", "app"),
+    "custom_message": ("custom_message", "app"),
+    "handle_global_options": ("utils", "handle_global_options"),
+}
+
+
+def load_handler(name):
+    """Import a function's module under its own name, as a fresh copy with empty caches."""
+    directory, module = FUNCTIONS[name]
+    path = os.path.join(ROOT, "src", directory)
+    sys.path.insert(0, path)
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(path, f"{module}.py"))
+        loaded = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(loaded)
+    finally:
+        sys.path.remove(path)
+    return getattr(loaded, "lambda_handler", None) or loaded.handler
+
+
+class World:
+    """A fresh set of stand-ins seeded with `size` users, wired into the shared layer."""
+
+    def __init__(self, size, latency_ms, throttle_rate):
+        import aws_clients
+        import api
+        import governor
+        import idempotency
+        from stand_ins import (FakeCognito, FakeDynamoResource, FakeLambda, FakeS3, FakeSNS, FakeSQS,
+                               FakeTable, Faults, seed_pool)
+
+        self.faults = Faults(0, 0)
+        self.cognito = FakeCognito(self.faults, POOL_ID)
+        seed_pool(self.cognito, size)
+        self.lambda_ = FakeLambda(self.faults)
+        self.sns = FakeSNS(self.faults)
+        self.s3 = FakeS3(self.faults)
+        self.sqs = FakeSQS(self.faults)
+        self.tables = {
+            "backup": FakeTable(TABLES["backup"], "userId", "backupDate", faults=self.faults),
+            "ops": FakeTable(TABLES["ops"], "pk", faults=self.faults),
+            "directory": FakeTable(TABLES["directory"], "pk", faults=self.faults, indexes={
+                "ByEntityIndex": ("entity", "user_id"),
+                "ByRoleIndex": ("role", "user_id"),
+                "ByRegionIndex": ("region", "user_id"),
+                "ByCityIndex": ("city", "user_id"),
+            }),
+        }
+        aws_clients._clients.clear()
+        aws_clients._tables.clear()
+        aws_clients._resources.clear()
+        aws_clients._clients.update({
+            ("cognito-idp", None): self.cognito,
+            ("lambda", None): self.lambda_,
+            ("sns", None): self.sns,
+            ("s3", None): self.s3,
+            ("sqs", None): self.sqs,
+        })
+        aws_clients._resources[("dynamodb", None)] = FakeDynamoResource(self.tables.values())
+        # Layer modules are shared across worlds; their state must not outlive the tables it mirrors.
+        idempotency._cache.clear()
+        governor._buckets.clear()
+        api.is_admin = lambda event: True
+        self.latency_ms, self.throttle_rate = latency_ms, throttle_rate
+
+    def start_faults(self):
+        """Counting and fault injection start here, after any unmeasured setup."""
+        self.faults.calls.clear()
+        self.faults.throttled.clear()
+        self.faults.latency = self.latency_ms / 1000
+        self.faults.throttle_rate = self.throttle_rate
+
+
+def api_event(method, path, body=None, query=None, headers=None):
+    return {
+        "httpMethod": method,
+        "path": path,
+        "headers": {"origin": ORIGIN, "Content-Type": "application/json", **(headers or {})},
+        "queryStringParameters": query,
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+    }
+
+
+def invite_rows(count):
+    return [
+        {"email": f"invitee{i:06d}@example.com", "name": f"Invitee {i}", "region": "North",
+         "city": "City01", "role": "CityOfficial" if i % 10 else "Admin"}
+        for i in range(count)
+    ]
+
+
+def cognito_event(trigger, i):
+    return {
+        "triggerSource": trigger,
+        "request": {"userAttributes": {"email": f"user{i}@example.com", "name": f"User {i}"},
+                    "codeParameter": "{####}"},
+        "response": {},
+    }
+
+
+def run_backup(world, args):
+    """Unmeasured setup: one full backup of the world's pool."""
+    handler = load_handler("backup")
+    drive(handler, [{"mode": "full"}], world, args.timeout_s)
+    world.lambda_.queue.clear()
+
+
+def prepare_restore(world, size, args):
+    run_backup(world, args)
+    usernames = [u for u in world.cognito.order if u]
+    for username in usernames[::20]:  # 5% deleted since the backup
+        world.cognito._remove(username)
+    for username in usernames[1::20]:  # 5% edited since the backup
+        world.cognito.admin_update_user_attributes(
+            POOL_ID, username, [{"Name": "custom:city", "Value": "Elsewhere"}])
+    return [{}]
+
+
+# name -> (function, events(world, size, args)); events may run unmeasured setup first.
+SCENARIOS = {
+    "list_users/directory": ("list_users", lambda w, n, a: [api_event("GET", "/users")]),
+    "list_users/page": ("list_users", lambda w, n, a: [
+        api_event("GET", "/users", query={"limit": "60", "region": "North"}) for _ in range(50)]),
+    "admin_invite": ("admin_invite", lambda w, n, a: [
+        api_event("POST", "/invite", invite_rows(min(max(n // 10, 1), 5000)))]),
+    "admin_invite/queued": ("admin_invite", lambda w, n, a: [
+        api_event("POST", "/invite", invite_rows(min(max(n // 10, 1), 5000)), headers={"Prefer": "respond-async"})]),
+    "delete": ("delete", lambda w, n, a: [
+        api_event("POST", "/delete", {"filter": {"region": "North"}, "backup": True})]),
+    "export_users/csv": ("export_users", lambda w, n, a: [api_event("POST", "/users/export", {"format": "csv"})]),
+    "export_users/ndjson": ("export_users", lambda w, n, a: [
+        api_event("POST", "/users/export", {"format": "ndjson", "region": "North"})]),
+    "backup": ("backup", lambda w, n, a: [{"mode": "full"}]),
+    "restore": ("restore", prepare_restore),
+    "health_check": ("health_check", lambda w, n, a: (run_backup(w, a), [{}] * 20)[1]),
+    "custom_message": ("custom_message", lambda w, n, a: [
+        cognito_event(t, i) for i in range(250)
+        for t in ("CustomMessage_SignUp", "CustomMessage_AdminCreateUser", "CustomMessage_ForgotPassword")]),
+    "handle_global_options": ("handle_global_options", lambda w, n, a: [
+        {"httpMethod": "OPTIONS", "headers": {"origin": ORIGIN if i % 10 else "https://evil.example"}}
+        for i in range(10000)]),
+}
+
+
+def drive(handler, events, world, timeout_s):
+    """Run every event, then every self-invocation they queue, then the SQS batches, in order.
+
+    Messages reported in batchItemFailures are delivered again, up to
+    SQS_MAX_RECEIVES times, like a queue with a redrive policy.
+    """
+    from stand_ins import FakeContext
+
+    invocations, results = 0, Counter()
+    pending = list(events)
+    while pending or world.lambda_.queue or world.sqs.queue:
+        if pending or world.lambda_.queue:
+            event = pending.pop(0) if pending else world.lambda_.queue.pop(0)
+        else:
+            batch, world.sqs.queue = world.sqs.queue[:SQS_BATCH_SIZE], world.sqs.queue[SQS_BATCH_SIZE:]
+            event = {"Records": batch}
+        result = handler(event, FakeContext("bench", timeout_s))
+        invocations += 1
+        if isinstance(result, dict):
+            if "batchItemFailures" in result:
+                failed = {f["itemIdentifier"] for f in result["batchItemFailures"]}
+                for record in event["Records"]:
+                    record["receives"] += 1
+                    if record["messageId"] in failed and record["receives"] < SQS_MAX_RECEIVES:
+                        world.sqs.queue.append(record)
+                results["sqs-failed" if failed else "sqs-ok"] += 1
+            else:
+                results[str(result.get("statusCode", result.get("status", "ok")))] += 1
+    return invocations, results
+
+
+def run_scenario(name, size, args, traced=False):
+    function, make_events = SCENARIOS[name]
+    world = World(size, args.latency_ms, args.throttle_rate)
+    # Handlers print their metrics to stdout; keep the report readable.
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        events = make_events(world, size, args)
+        handler = load_handler(function)
+        world.start_faults()
+
+        if traced:
+            tracemalloc.start()
+        started = time.perf_counter()
+        invocations, results = drive(handler, events, world, args.timeout_s)
+        wall = time.perf_counter() - started
+        peak = None
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    return {
+        "wall_s": round(wall, 3),
+        "invocations": invocations,
+        "results": dict(results),
+        "calls": sum(world.faults.calls.values()),
+        "calls_by_operation": dict(world.faults.calls.most_common()),
+        "throttled": sum(world.faults.throttled.values()),
+        "peak_mb": round(peak, 1) if peak is not None else None,
+    }
+
+
+def cold_imports(runs):
+    from cold_start import timed
+
+    imports = {}
+    for name, (directory, module) in FUNCTIONS.items():
+        imports[name] = round(timed(f"import {module}", os.path.join(ROOT, "src", directory), runs), 1)
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--handlers", default=",".join(SCENARIOS),
+                        help="scenario names or function names, comma separated")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--quota", action="store_true", help="keep the functions' per-API rate limits")
+    parser.add_argument("--timeout-s", type=float, default=900)
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.update(ENV)
+    if not args.quota:
+        os.environ.update({name: "1000000" for name in RATE_LIMITS})
+    logging.getLogger().addHandler(logging.NullHandler())
+    logging.getLogger().setLevel(logging.WARNING)
+
+    wanted = set(args.handlers.split(","))
+    scenarios = [s for s, (f, _) in SCENARIOS.items() if s in wanted or f in wanted]
+    imports = cold_imports(args.cold_runs) if args.cold_runs else {}
+
+    report = {"config": vars(args), "cold_import_ms": imports, "runs": []}
+    print(f"{'scenario':<24}{'users':>8}{'wall s':>9}{'inv':>6}{'calls':>9}{'throttled':>10}"
+          f"{'peak MB':>9}{'import ms':>11}  busiest calls")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for name in scenarios:
+            run = run_scenario(name, size, args)
+            if not args.no_memory:
+                run["peak_mb"] = run_scenario(name, size, args, traced=True)["peak_mb"]
+            run.update(scenario=name, users=size)
+            report["runs"].append(run)
+
+            busiest = ", ".join(f"{op.split('.', 1)[1]} {n}" for op, n in list(run["calls_by_operation"].items())[:3])
+            peak = f"{run['peak_mb']:.1f}" if run["peak_mb"] is not None else "-"
+            imported = imports.get(SCENARIOS[name][0])
+            print(f"{name:<24}{size:>8}{run['wall_s']:>9.2f}{run['invocations']:>6}{run['calls']:>9}"
+                  f"{run['throttled']:>10}{peak:>9}{imported if imported is not None else '-':>11}  {busiest}",
+                  flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,818 @@
+"""In-process stand-ins for the AWS APIs the Python functions call.
+
+Cognito, DynamoDB, S3, SQS, Lambda and SNS are modelled just far enough for the
+handlers to run unchanged: pagination, Cognito's 60-user page cap, GSIs,
+scan segments, Decimal numbers, DynamoDB's 400 KB item limit, S3's 5 MiB
+minimum part size and the error
+classes the code catches. Every call is counted and can be slowed down or
+throttled through Faults, so runs are repeatable without an AWS account.
+"""
+import bisect
+import copy
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+COGNITO_PAGE_SIZE = 60
+DYNAMODB_PAGE_SIZE = 1000  # stands in for the 1 MB response cap
+MAX_ITEM_BYTES = 400 * 1024
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+ROLE_GROUPS = ("Admin", "CityOfficial")
+REGIONS = ["North", "South", "East", "West", "Central", "Coast", "Valley", "Highlands"]
+CITIES = [f"City{i:02d}" for i in range(40)]
+
+
+class Faults:
+    """Shared call counter plus injected latency and throttling."""
+
+    def __init__(self, latency_ms=0.0, throttle_rate=0.0, seed=7):
+        self.latency = latency_ms / 1000
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.lock = threading.Lock()
+
+    def apply(self, service, operation, throttle_code=None):
+        with self.lock:
+            self.calls[f"{service}.{operation}"] += 1
+            throttle = throttle_code and self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled[f"{service}.{operation}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            raise ClientError({"Error": {"Code": throttle_code, "Message": "Rate exceeded"}}, operation)
+
+
+def _error_class(code):
+    return type(code, (ClientError,), {})
+
+
+def _raise(cls, operation, message):
+    raise cls({"Error": {"Code": cls.__name__, "Message": message}}, operation)
+
+
+# ---------------------------------------------------------------- Cognito
+
+
+class FakeCognito:
+    """A user pool held in memory; usernames keep their creation order for paging."""
+
+    exceptions = SimpleNamespace(**{
+        name: _error_class(name)
+        for name in ("UserNotFoundException", "UsernameExistsException", "ResourceNotFoundException",
+                     "TooManyRequestsException", "InvalidParameterException")
+    })
+
+    def __init__(self, faults, pool_id="eu-central-1_bench"):
+        self.faults = faults
+        self.pool_id = pool_id
+        self.users = {}
+        self.order = []  # usernames in creation order; deleted slots become None
+        self.position = {}
+        self.groups = {g: {} for g in ROLE_GROUPS}
+        self.lock = threading.Lock()
+
+    def _call(self, operation):
+        self.faults.apply("cognito-idp", operation, "TooManyRequestsException")
+
+    def _user(self, username, operation):
+        user = self.users.get(username)
+        if user is None:
+            _raise(self.exceptions.UserNotFoundException, operation, "User does not exist.")
+        return user
+
+    def add(self, username, attributes, groups=(), enabled=True, modified=None):
+        now = modified or datetime.now(timezone.utc)
+        with self.lock:
+            self.users[username] = {
+                "Username": username,
+                "Attributes": [{"Name": k, "Value": v} for k, v in attributes.items()],
+                "Enabled": enabled,
+                "UserStatus": "CONFIRMED",
+                "UserCreateDate": now,
+                "UserLastModifiedDate": now,
+            }
+            self.position[username] = len(self.order)
+            self.order.append(username)
+            for group in groups:
+                self.groups.setdefault(group, {})[username] = True
+
+    def _remove(self, username):
+        with self.lock:
+            del self.users[username]
+            self.order[self.position.pop(username)] = None
+            for members in self.groups.values():
+                members.pop(username, None)
+
+    def _page(self, usernames, start, limit):
+        page, index = [], start
+        while index < len(usernames) and len(page) < limit:
+            username = usernames[index]
+            index += 1
+            if username is not None and username in self.users:
+                page.append(username)
+        return page, (str(index) if index < len(usernames) else None)
+
+    def list_users(self, UserPoolId, Limit=COGNITO_PAGE_SIZE, PaginationToken=None, Filter=None, **kwargs):
+        self._call("ListUsers")
+        prefix = None
+        if Filter:
+            prefix = Filter.split("^=", 1)[1].strip().strip('"').replace('\\"', '"')
+        start, users = int(PaginationToken or 0), []
+        while True:
+            usernames, token = self._page(self.order, start, min(Limit, COGNITO_PAGE_SIZE))
+            for username in usernames:
+                user = self.users[username]
+                if prefix is None or self._attribute(user, "email", "").startswith(prefix):
+                    users.append(copy.copy(user))
+            # A filtered page is built from one page's worth of scanned users.
+            if prefix is None or token is None or users:
+                break
+            start = int(token)
+        response = {"Users": users}
+        if token:
+            response["PaginationToken"] = token
+        return response
+
+    @staticmethod
+    def _attribute(user, name, default=None):
+        return next((a["Value"] for a in user["Attributes"] if a["Name"] == name), default)
+
+    def list_users_in_group(self, UserPoolId, GroupName, Limit=COGNITO_PAGE_SIZE, NextToken=None, **kwargs):
+        self._call("ListUsersInGroup")
+        if GroupName not in self.groups:
+            _raise(self.exceptions.ResourceNotFoundException, "ListUsersInGroup", "Group not found.")
+        usernames, token = self._page(list(self.groups[GroupName]), int(NextToken or 0),
+                                      min(Limit, COGNITO_PAGE_SIZE))
+        response = {"Users": [copy.copy(self.users[u]) for u in usernames]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def list_groups(self, UserPoolId, **kwargs):
+        self._call("ListGroups")
+        return {"Groups": [{"GroupName": g, "UserPoolId": UserPoolId} for g in self.groups]}
+
+    def admin_get_user(self, UserPoolId, Username):
+        self._call("AdminGetUser")
+        user = self._user(Username, "AdminGetUser")
+        return {
+            "Username": Username,
+            "UserAttributes": list(user["Attributes"]),
+            "Enabled": user["Enabled"],
+            "UserStatus": user["UserStatus"],
+            "UserCreateDate": user["UserCreateDate"],
+            "UserLastModifiedDate": user["UserLastModifiedDate"],
+            "UserMFASettingList": [],
+        }
+
+    def admin_list_groups_for_user(self, UserPoolId, Username, **kwargs):
+        self._call("AdminListGroupsForUser")
+        self._user(Username, "AdminListGroupsForUser")
+        return {"Groups": [{"GroupName": g} for g, members in self.groups.items() if Username in members]}
+
+    def admin_create_user(self, UserPoolId, Username, UserAttributes=(), **kwargs):
+        self._call("AdminCreateUser")
+        if Username in self.users:
+            _raise(self.exceptions.UsernameExistsException, "AdminCreateUser", "User account already exists.")
+        self.add(Username, {a["Name"]: a["Value"] for a in UserAttributes})
+        return {"User": copy.copy(self.users[Username])}
+
+    def admin_delete_user(self, UserPoolId, Username):
+        self._call("AdminDeleteUser")
+        self._user(Username, "AdminDeleteUser")
+        self._remove(Username)
+        return {}
+
+    def admin_add_user_to_group(self, UserPoolId, Username, GroupName):
+        self._call("AdminAddUserToGroup")
+        self._user(Username, "AdminAddUserToGroup")
+        with self.lock:
+            self.groups.setdefault(GroupName, {})[Username] = True
+        return {}
+
+    def admin_remove_user_from_group(self, UserPoolId, Username, GroupName):
+        self._call("AdminRemoveUserFromGroup")
+        self._user(Username, "AdminRemoveUserFromGroup")
+        with self.lock:
+            self.groups.get(GroupName, {}).pop(Username, None)
+        return {}
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes):
+        self._call("AdminUpdateUserAttributes")
+        user = self._user(Username, "AdminUpdateUserAttributes")
+        attributes = {a["Name"]: a["Value"] for a in user["Attributes"]}
+        attributes.update({a["Name"]: a["Value"] for a in UserAttributes})
+        user["Attributes"] = [{"Name": k, "Value": v} for k, v in attributes.items()]
+        user["UserLastModifiedDate"] = datetime.now(timezone.utc)
+        return {}
+
+    def admin_enable_user(self, UserPoolId, Username):
+        self._call("AdminEnableUser")
+        self._user(Username, "AdminEnableUser")["Enabled"] = True
+        return {}
+
+    def admin_disable_user(self, UserPoolId, Username):
+        self._call("AdminDisableUser")
+        self._user(Username, "AdminDisableUser")["Enabled"] = False
+        return {}
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent=False):
+        self._call("AdminSetUserPassword")
+        self._user(Username, "AdminSetUserPassword")
+        return {}
+
+    def describe_user_pool(self, UserPoolId):
+        self._call("DescribeUserPool")
+        return {"UserPool": {"Id": UserPoolId, "EstimatedNumberOfUsers": len(self.users)}}
+
+
+def seed_pool(cognito, size, seed=11):
+    """Fill a pool with `size` synthetic users: ~1% Admin, ~4% CityOfficial, the rest citizens."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(size):
+        draw = rng.random()
+        groups = ("Admin",) if draw < 0.01 else ("CityOfficial",) if draw < 0.05 else ()
+        cognito.add(
+            f"user-{i:06d}",
+            {
+                "sub": f"00000000-0000-4000-8000-{i:012d}",
+                "email": f"user{i:06d}@example.com",
+                "email_verified": "true",
+                "name": f"User {i}",
+                "custom:region": rng.choice(REGIONS),
+                "custom:city": rng.choice(CITIES),
+            },
+            groups=groups,
+            modified=start + timedelta(minutes=rng.randrange(60 * 24 * 180)),
+        )
+
+
+# ---------------------------------------------------------------- DynamoDB
+
+
+def _to_dynamodb(value):
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        return {k: _to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_dynamodb(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {_to_dynamodb(v) for v in value}
+    raise TypeError(f"Unsupported type {type(value).__name__}")
+
+
+def _item_size(item):
+    return len(json.dumps(item, default=str))
+
+
+_CONDITION_TOKEN = re.compile(r"\s*(<>|<=|>=|[()=<>,]|[:#]?[\w.]+)")
+
+
+def _condition_holds(expression, item, names, values):
+    """Evaluate a DynamoDB condition expression string: AND / OR / NOT, parentheses,
+    comparisons and attribute_exists / attribute_not_exists."""
+    tokens = _CONDITION_TOKEN.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def operand(token):
+        if token.startswith(":"):
+            return values[token]
+        return item.get(names.get(token, token))
+
+    def disjunction():
+        result = conjunction()
+        while peek() and peek().upper() == "OR":
+            take()
+            result = conjunction() or result
+        return result
+
+    def conjunction():
+        result = factor()
+        while peek() and peek().upper() == "AND":
+            take()
+            result = factor() and result
+        return result
+
+    def factor():
+        token = take()
+        if token.upper() == "NOT":
+            return not factor()
+        if token == "(":
+            result = disjunction()
+            take()
+            return result
+        if token in ("attribute_exists", "attribute_not_exists"):
+            take()
+            name = take()
+            take()
+            present = names.get(name, name) in item
+            return present if token == "attribute_exists" else not present
+        left, op, right = operand(token), take(), operand(take())
+        if op == "=":
+            return left == right
+        if op == "<>":
+            return left != right
+        if left is None or right is None:
+            return False
+        return {"<": left < right, "<=": left <= right, ">": left > right, ">=": left >= right}[op]
+
+    return disjunction()
+
+
+def _matches(condition, item):
+    kind = type(condition).__name__
+    values = condition.get_expression()["values"]
+    if kind == "And":
+        return all(_matches(v, item) for v in values)
+    if kind == "Or":
+        return any(_matches(v, item) for v in values)
+    if kind == "Not":
+        return not _matches(values[0], item)
+    name = values[0].name
+    if kind == "AttributeExists":
+        return name in item
+    if kind == "AttributeNotExists":
+        return name not in item
+    if name not in item:
+        return False
+    actual = item[name]
+    if kind == "Equals":
+        return actual == values[1]
+    if kind == "NotEquals":
+        return actual != values[1]
+    if kind == "BeginsWith":
+        return isinstance(actual, str) and actual.startswith(values[1])
+    if kind == "LessThan":
+        return actual < values[1]
+    if kind == "LessThanEquals":
+        return actual <= values[1]
+    if kind == "GreaterThan":
+        return actual > values[1]
+    if kind == "GreaterThanEquals":
+        return actual >= values[1]
+    if kind == "Between":
+        return values[1] <= actual <= values[2]
+    if kind == "In":
+        return actual in values[1]
+    if kind == "Contains":
+        return values[1] in actual
+    raise NotImplementedError(kind)
+
+
+def _equality_on(condition, name):
+    """The value `condition` pins attribute `name` to, found through And clauses."""
+    kind = type(condition).__name__
+    values = condition.get_expression()["values"]
+    if kind == "And":
+        for part in values:
+            found = _equality_on(part, name)
+            if found is not None:
+                return found
+    elif kind == "Equals" and values[0].name == name:
+        return values[1]
+    return None
+
+
+class _BatchWriter:
+    """Buffers writes into BatchWriteItem calls of 25, as boto3's batch_writer does."""
+
+    BATCH_SIZE = 25
+
+    def __init__(self, table, overwrite_by_pkeys=None):
+        self.table = table
+        self.dedupe = bool(overwrite_by_pkeys)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        while self.buffer:
+            self._flush()
+        return False
+
+    def _add(self, action, item):
+        if self.dedupe:
+            key = self.table._key(item)
+            self.buffer = [(a, i) for a, i in self.buffer if self.table._key(i) != key]
+        self.buffer.append((action, item))
+        if len(self.buffer) >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        batch, self.buffer = self.buffer[:self.BATCH_SIZE], self.buffer[self.BATCH_SIZE:]
+        self.table._call("BatchWriteItem")
+        for action, item in batch:
+            if action == "put":
+                self.table._put(item)
+            else:
+                self.table._delete(self.table._key(item))
+
+    def put_item(self, Item):
+        self._add("put", Item)
+
+    def delete_item(self, Key):
+        self._add("delete", Key)
+
+
+class FakeTable:
+    """One DynamoDB table: items grouped into partitions, GSIs evaluated on read."""
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None, faults=None):
+        self.name = name
+        self.hash_key, self.range_key = hash_key, range_key
+        self.indexes = indexes or {}
+        self.faults = faults or Faults()
+        self.partitions = {}
+        self.order = []  # keys in first-write order, the order Scan walks
+        self.position = {}
+        self.version = 0
+        self._index_cache = {}
+        self.lock = threading.RLock()
+
+    def _call(self, operation):
+        self.faults.apply("dynamodb", operation)
+
+    def _key(self, item):
+        return (item[self.hash_key], item[self.range_key]) if self.range_key else (item[self.hash_key],)
+
+    def _key_dict(self, key):
+        names = (self.hash_key, self.range_key) if self.range_key else (self.hash_key,)
+        return dict(zip(names, key))
+
+    def _get(self, key):
+        return self.partitions.get(key[0], {}).get(key)
+
+    def _put(self, item):
+        item = _to_dynamodb(item)
+        if _item_size(item) > MAX_ITEM_BYTES:
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "Item size has exceeded the maximum allowed size"}},
+                "PutItem",
+            )
+        key = self._key(item)
+        with self.lock:
+            partition = self.partitions.setdefault(key[0], {})
+            if key not in partition and key not in self.position:
+                self.position[key] = len(self.order)
+                self.order.append(key)
+            partition[key] = item
+            self.version += 1
+
+    def _delete(self, key):
+        with self.lock:
+            old = self.partitions.get(key[0], {}).pop(key, None)
+            self.version += 1
+            return old
+
+    @staticmethod
+    def _project(item, projection, names):
+        if not projection:
+            return item
+        fields = [names.get(f.strip(), f.strip()) for f in projection.split(",")]
+        return {f: item[f] for f in fields if f in item}
+
+    def _check(self, current, condition, names, values=None):
+        """Raise ConditionalCheckFailedException unless the condition expression holds for `current`."""
+        if isinstance(condition, str) and not _condition_holds(condition, current or {}, names, values or {}):
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException",
+                                         "Message": "The conditional request failed"}}, "ConditionCheck")
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 ReturnValues=None, **kwargs):
+        self._call("PutItem")
+        with self.lock:
+            old = self._get(self._key(Item))
+            self._check(old, ConditionExpression, ExpressionAttributeNames or {},
+                        _to_dynamodb(ExpressionAttributeValues or {}))
+            self._put(Item)
+        return {"Attributes": copy.deepcopy(old)} if ReturnValues == "ALL_OLD" and old is not None else {}
+
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None):
+        self._call("GetItem")
+        item = self._get(self._key(Key))
+        if item is None:
+            return {}
+        return {"Item": self._project(copy.deepcopy(item), ProjectionExpression, ExpressionAttributeNames or {})}
+
+    def delete_item(self, Key, ReturnValues=None, **kwargs):
+        self._call("DeleteItem")
+        with self.lock:
+            old = self._get(self._key(Key))
+            self._delete(self._key(Key))
+        return {"Attributes": copy.deepcopy(old)} if ReturnValues == "ALL_OLD" and old is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+                    ReturnValues=None, ConditionExpression=None, **kwargs):
+        self._call("UpdateItem")
+        names, values = ExpressionAttributeNames or {}, _to_dynamodb(ExpressionAttributeValues or {})
+        with self.lock:
+            self._check(self._get(self._key(Key)), ConditionExpression, names, values)
+            item = copy.deepcopy(self._get(self._key(Key))) or dict(Key)
+            touched = {}
+            action = None
+            for token in UpdateExpression.replace(",", " , ").split():
+                if token in ("SET", "ADD", "REMOVE"):
+                    action, pending = token, []
+                    continue
+                pending.append(token)
+                if action == "REMOVE" and token != ",":
+                    item.pop(names.get(token, token), None)
+                    pending = []
+                elif action == "SET" and len(pending) == 3:
+                    name = names.get(pending[0], pending[0])
+                    item[name] = touched[name] = values[pending[2]]
+                elif action == "ADD" and len(pending) == 2:
+                    name = names.get(pending[0], pending[0])
+                    item[name] = touched[name] = item.get(name, 0) + values[pending[1]]
+                elif token == ",":
+                    pending = []
+            self._put(item)
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": copy.deepcopy(touched)}
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": copy.deepcopy(item)}
+        return {}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self, overwrite_by_pkeys)
+
+    def _paginate(self, items, fields, names, Limit=None, ExclusiveStartKey=None, FilterExpression=None,
+                  ProjectionExpression=None, ScanIndexForward=True, **kwargs):
+        """One page of `items`, which are sorted by `fields`, the way Query returns it."""
+        def sort_key(item):
+            return tuple(item[f] for f in fields)
+
+        if ScanIndexForward:
+            start = bisect.bisect_right(items, sort_key(ExclusiveStartKey), key=sort_key) if ExclusiveStartKey else 0
+        else:
+            start = len(items) - bisect.bisect_left(items, sort_key(ExclusiveStartKey), key=sort_key) \
+                if ExclusiveStartKey else 0
+            items = items[::-1]
+        page = items[start:start + (Limit or DYNAMODB_PAGE_SIZE)]
+        kept = [i for i in page if FilterExpression is None or _matches(FilterExpression, i)]
+        response = {
+            "Items": [self._project(dict(i), ProjectionExpression, names) for i in kept],
+            "Count": len(kept),
+            "ScannedCount": len(page),
+        }
+        if start + len(page) < len(items):
+            response["LastEvaluatedKey"] = {f: page[-1][f] for f in fields}
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, ExpressionAttributeNames=None, **kwargs):
+        self._call("Query")
+        table_fields = [f for f in (self.hash_key, self.range_key) if f]
+        if IndexName:
+            index_hash, index_range = self.indexes[IndexName]
+            fields = list(dict.fromkeys([f for f in (index_hash, index_range) if f] + table_fields))
+            value = _equality_on(KeyConditionExpression, index_hash)
+            with self.lock:
+                cached = self._index_cache.get((IndexName, value))
+                if cached is None or cached[0] != self.version:
+                    members = [
+                        i for p in self.partitions.values() for i in p.values()
+                        if i.get(index_hash) == value and (not index_range or index_range in i)
+                    ]
+                    members.sort(key=lambda i: tuple(i[f] for f in fields))
+                    cached = self._index_cache[(IndexName, value)] = (self.version, members)
+            items = [i for i in cached[1] if _matches(KeyConditionExpression, i)]
+        else:
+            fields = table_fields
+            value = _equality_on(KeyConditionExpression, self.hash_key)
+            with self.lock:
+                partition = list(self.partitions.get(value, {}).values())
+            items = sorted(
+                (i for i in partition if _matches(KeyConditionExpression, i)),
+                key=lambda i: tuple(i[f] for f in fields),
+            )
+        return self._paginate(items, fields, ExpressionAttributeNames or {}, **kwargs)
+
+    def scan(self, Segment=0, TotalSegments=1, Limit=None, ExclusiveStartKey=None, FilterExpression=None,
+             ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call("Scan")
+        start = self.position[self._key(ExclusiveStartKey)] + 1 if ExclusiveStartKey else 0
+        limit = Limit or DYNAMODB_PAGE_SIZE
+        page, index = [], start
+        with self.lock:
+            while index < len(self.order) and len(page) < limit:
+                key = self.order[index]
+                index += 1
+                if hash(key[0]) % TotalSegments != Segment:
+                    continue
+                item = self._get(key)
+                if item is not None:
+                    page.append(item)
+            more = index < len(self.order)
+        kept = [i for i in page if FilterExpression is None or _matches(FilterExpression, i)]
+        response = {
+            "Items": [self._project(dict(i), ProjectionExpression, ExpressionAttributeNames or {}) for i in kept],
+            "Count": len(kept),
+            "ScannedCount": len(page),
+        }
+        if more and page:
+            response["LastEvaluatedKey"] = self._key_dict(self._key(page[-1]))
+        return response
+
+
+class _FakeDynamoClient:
+    """The low-level calls the code reaches through Table.meta.client."""
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def transact_write_items(self, TransactItems):
+        from boto3.dynamodb.types import TypeDeserializer
+
+        deserialize = TypeDeserializer().deserialize
+        plain = lambda values: {k: deserialize(v) for k, v in (values or {}).items()}
+        # Conditions are checked before anything is written; only attribute_not_exists(pk) is modelled.
+        for entry in TransactItems:
+            put = entry.get("Put")
+            if put and put.get("ConditionExpression") == "attribute_not_exists(pk)":
+                table = self.resource.tables[put["TableName"]]
+                if table._get(table._key(plain(put["Item"]))) is not None:
+                    cancelled = ClientError({
+                        "Error": {"Code": "TransactionCanceledException", "Message": "Transaction cancelled"},
+                        "CancellationReasons": [{"Code": "ConditionalCheckFailed"}],
+                    }, "TransactWriteItems")
+                    raise cancelled
+        for entry in TransactItems:
+            if "Put" in entry:
+                self.resource.tables[entry["Put"]["TableName"]].put_item(Item=plain(entry["Put"]["Item"]))
+            elif "Update" in entry:
+                update = entry["Update"]
+                self.resource.tables[update["TableName"]].update_item(
+                    Key=plain(update["Key"]),
+                    UpdateExpression=update["UpdateExpression"],
+                    ExpressionAttributeValues=plain(update.get("ExpressionAttributeValues")),
+                    ExpressionAttributeNames=update.get("ExpressionAttributeNames"),
+                )
+        return {}
+
+
+class FakeDynamoResource:
+    """boto3.resource("dynamodb") stand-in that hands out the registered tables by name."""
+
+    def __init__(self, tables):
+        self.tables = {t.name: t for t in tables}
+        self.meta = SimpleNamespace(client=_FakeDynamoClient(self))
+        for table in self.tables.values():
+            table.meta = self.meta
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+# ---------------------------------------------------------------- S3
+
+
+class FakeS3:
+    """Objects by key, bucket ignored.
+
+    Multipart uploads keep only their part sizes, so a large upload does not
+    count against the handler's heap; single put_object bodies are kept and
+    can be read back.
+    """
+
+    def __init__(self, faults):
+        self.faults = faults
+        self.objects = {}
+        self.sizes = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.faults.apply("s3", "PutObject")
+        self.objects[Key] = bytes(Body)
+        self.sizes[Key] = len(Body)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.faults.apply("s3", "GetObject")
+        if Key not in self.objects:
+            _raise(_error_class("NoSuchKey"), "GetObject", f"{Key} not found")
+        body = self.objects[Key]
+        return {"Body": SimpleNamespace(
+            read=lambda: body,
+            iter_chunks=lambda size: (body[i:i + size] for i in range(0, len(body), size)),
+        )}
+
+    def delete_object(self, Bucket, Key):
+        self.faults.apply("s3", "DeleteObject")
+        self.objects.pop(Key, None)
+        self.sizes.pop(Key, None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.faults.apply("s3", "CreateMultipartUpload")
+        with self.lock:
+            upload_id = f"upload-{len(self.uploads)}"
+            self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.faults.apply("s3", "UploadPart")
+        self.uploads[UploadId][PartNumber] = len(Body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.faults.apply("s3", "CompleteMultipartUpload")
+        sizes = [self.uploads[UploadId][p["PartNumber"]] for p in MultipartUpload["Parts"]]
+        if any(size < MIN_PART_BYTES for size in sizes[:-1]):
+            _raise(_error_class("EntityTooSmall"), "CompleteMultipartUpload", "Part below the minimum size")
+        del self.uploads[UploadId]
+        self.objects.pop(Key, None)
+        self.sizes[Key] = sum(sizes)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.faults.apply("s3", "AbortMultipartUpload")
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f"https://s3.bench/{Params['Key']}?expires={ExpiresIn}"
+
+
+# ---------------------------------------------------------------- Lambda, SQS, SNS
+
+
+class FakeLambda:
+    """Collects asynchronous self-invocations so the runner can play them back in order."""
+
+    def __init__(self, faults):
+        self.faults = faults
+        self.queue = []
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}"):
+        self.faults.apply("lambda", "Invoke")
+        self.queue.append(json.loads(Payload))
+        return {"StatusCode": 202}
+
+
+class FakeSQS:
+    """Holds sent messages until the runner delivers them to the consumer."""
+
+    def __init__(self, faults):
+        self.faults = faults
+        self.queue = []
+        self.sent = 0
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.faults.apply("sqs", "SendMessageBatch")
+        for entry in Entries:
+            self.sent += 1
+            self.queue.append({"messageId": f"m-{self.sent}", "body": entry["MessageBody"],
+                               "eventSource": "aws:sqs", "receives": 0})
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+
+class FakeSNS:
+    def __init__(self, faults):
+        self.faults = faults
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.faults.apply("sns", "Publish")
+        self.messages.append((Subject, Message))
+        return {"MessageId": str(len(self.messages))}
+
+
+class FakeContext:
+    """Lambda context whose deadline is `timeout_s` after it was created."""
+
+    def __init__(self, function_name, timeout_s=900):
+        self.function_name = function_name
+        self.invoked_function_arn = f"arn:aws:lambda:eu-central-1:000000000000:function:{function_name}"
+        self.aws_request_id = "bench"
+        self.deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
@@ -1,55 +1,122 @@
 import os
-import boto3
-import json
-from auth_utils import is_admin
+import re
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
+from api import api_handler, loads
+from idempotency import idempotent
+from aws_clients import LazyClient
+from chunked_job import continue_async, out_of_time
+from throttle import RateLimiter, call_with_backoff
+import metrics
+import governor
+from user_directory import bump_directory_version, put_user
+from write_queue import consume_slices, enqueue_job, is_queue_event, wants_async
+import jobs
 import logging
 import random
 import string
 
 
-cognito_client = boto3.client("cognito-idp")
+cognito_client = LazyClient("cognito-idp")
 USER_POOL_ID = os.environ["USER_POOL_ID"]
+INVITE_WORKERS = int(os.environ.get("INVITE_WORKERS", "8"))
+# Batches up to this size are provisioned inside the API call; bigger ones
+# become a background job polled through GET /jobs/{jobId}.
+INVITE_SYNC_LIMIT = int(os.environ.get("INVITE_SYNC_LIMIT", "50"))
+INVITE_MAX_ROWS = int(os.environ.get("INVITE_MAX_ROWS", "5000"))
+# AdminCreateUser sits in Cognito's UserCreation quota category.
+_create_limiter = RateLimiter(float(os.environ.get("INVITE_CREATE_RPS", "20")))
+_update_limiter = RateLimiter(float(os.environ.get("INVITE_UPDATE_RPS", "20")))
+
+INVITE_ROLES = ["Admin", "CityOfficial"]
+REQUIRED_FIELDS = ["email", "name", "region", "city", "role"]
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-CORS_HEADERS = {
-    "Access-Control-Allow-Methods": "OPTIONS,POST",
-    "Access-Control-Allow-Headers": "Content-Type,Authorization",
-    }
+def parse_rows(request):
+    """Return (rows, batch) from a single JSON invite, a JSON array, or a CSV upload.
 
-def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
-    
-    origin = event['headers'].get('origin')
-    CORS_HEADERS.update({"Access-Control-Allow-Origin": origin})
-        
-    if not is_admin(event):
-        logger.warning("Unauthorized access attempt by non-admin user")
-        
-        return {
-            "statusCode": 403,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({"message": "Forbidden: Admins only"})
-        }
- 
-    
+    Raises ValueError for a body that is none of these.
+    """
+    raw = request.raw_body or "{}"
+
+    if "text/csv" in request.headers.get("content-type", ""):
+        text = raw
+    else:
+        body = loads(raw)
+        if isinstance(body, list):
+            return body, True
+        if not isinstance(body, dict):
+            raise ValueError("expected a JSON object or array")
+        if isinstance(body.get("users"), list):
+            return body["users"], True
+        if "csv" not in body:
+            return [body], False
+        text = body["csv"]
+        if not isinstance(text, str):
+            raise ValueError("csv must be a string")
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    return [{k.strip().lower(): (v or "").strip() for k, v in row.items() if k} for row in reader], True
+
+
+def validate_rows(rows):
+    """Per-row validation errors for the whole batch, empty when every row is usable."""
+    errors, seen = [], set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({"row": index, "error": "Row must be an object"})
+            continue
+        missing = [f for f in REQUIRED_FIELDS if not row.get(f)]
+        not_text = [f for f in REQUIRED_FIELDS if f not in missing and not isinstance(row[f], str)]
+        if missing:
+            errors.append({"row": index, "error": f"Missing {', '.join(missing)}"})
+        elif not_text:
+            errors.append({"row": index, "error": f"{', '.join(not_text)} must be text"})
+        elif row["role"] not in INVITE_ROLES:
+            errors.append({"row": index, "error": "Only Admin or CityOfficial allowed"})
+        elif not EMAIL_PATTERN.match(row["email"]):
+            errors.append({"row": index, "error": "Invalid email"})
+        elif row["email"].lower() in seen:
+            errors.append({"row": index, "error": "Duplicate email in batch"})
+        else:
+            seen.add(row["email"].lower())
+    return errors
+
+
+def limited(limiter, operation, **kwargs):
+    def attempt(**kw):
+        limiter.acquire()
+        return getattr(cognito_client, operation)(**kw)
+
+    return call_with_backoff(attempt, **kwargs)
+
+
+def unfinished_invite(email):
+    """Username of a user an earlier invite created but never added to a group, else None.
+
+    A retried invite (or a retried AdminCreateUser call) finds the user
+    already there; one that has never signed in and has no group is that
+    earlier attempt, which the retry then finishes.
+    """
+    user = call_with_backoff(cognito_client.admin_get_user, UserPoolId=USER_POOL_ID, Username=email)
+    if user["UserStatus"] != "FORCE_CHANGE_PASSWORD":
+        return None
+    groups = call_with_backoff(
+        cognito_client.admin_list_groups_for_user, UserPoolId=USER_POOL_ID, Username=user["Username"]
+    )
+    return None if groups["Groups"] else user["Username"]
+
+
+def invite_user(row, invalidate=True):
+    email, name, region, city, role = (row[f] for f in REQUIRED_FIELDS)
     try:
-        logger.info("Processing user creation request")
-        
-        body = json.loads(event.get("body", "{}"))
-        email = body["email"]
-        name = body["name"]
-        region = body["region"]
-        city = body["city"]
-        telephone = body["telephone"]
-        role = body["role"]
-
-        if role not in ["Admin", "CityOfficial"]:
-            return {"statusCode": 400, "body": json.dumps({"error": "Only Admin or CityOfficial allowed"})}
-
-        response = cognito_client.admin_create_user(
+        response = limited(
+            _create_limiter,
+            "admin_create_user",
             UserPoolId=USER_POOL_ID,
             Username=email,
             TemporaryPassword=generate_password(),
@@ -62,27 +129,150 @@ def lambda_handler(event, context):
                 {"Name": "email_verified", "Value": "true"}
             ]
         )
+        username = response["User"]["Username"]
+    except cognito_client.exceptions.UsernameExistsException:
+        username = unfinished_invite(email)
+        if username is None:
+            raise
+        logger.info(f"Finishing an earlier, incomplete invite for {role} {name}")
 
-        cognito_client.admin_add_user_to_group(
-            UserPoolId=USER_POOL_ID,
-            Username=email,
-            GroupName=role
-        )
-        
-        logger.info(f"User {name} with role {role} created successfully")
-        
-        return {
-            "statusCode": 200,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({
-                "message": f"{role} {name} invited successfully"
-            })
-        }
+    limited(
+        _update_limiter,
+        "admin_add_user_to_group",
+        UserPoolId=USER_POOL_ID,
+        Username=username,
+        GroupName=role
+    )
+    put_user(
+        username,
+        {"email": email, "name": name, "custom:region": region, "custom:city": city},
+        role,
+        invalidate=invalidate,
+    )
 
+
+def invite_row(indexed_row):
+    index, row = indexed_row
+    result = {"row": index, "email": row["email"]}
+    try:
+        invite_user(row, invalidate=False)
+        result["status"] = "invited"
+    except cognito_client.exceptions.UsernameExistsException:
+        result.update(status="failed", error="User already exists")
     except Exception as e:
-        logger.error(f"Error creating user: {str(e)}")
-        
-        return {"statusCode": 500,"headers": CORS_HEADERS, "body": json.dumps({"error": str(e)})}
+        result.update(status="failed", error=str(e))
+    return result
+
+
+def invite_batch(indexed_rows):
+    """Provision rows through the bounded worker pool; one result per row, in order."""
+    with ThreadPoolExecutor(max_workers=INVITE_WORKERS) as pool:
+        results = list(pool.map(invite_row, indexed_rows))
+    failed = sum(r["status"] == "failed" for r in results)
+    metrics.count("UsersInvited", len(results) - failed)
+    metrics.count("InviteFailures", failed)
+    if any(r["status"] == "invited" for r in results):
+        bump_directory_version()
+    return results
+
+
+def run_invite_job(job_id, context):
+    """Work through a queued bulk invite, handing off before the invocation times out."""
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] in jobs.FINISHED:
+        return {"status": "SKIPPED", "job_id": job_id}
+    jobs.update_job(job_id, status=jobs.RUNNING)
+
+    processed, failed = job["processed"], job["failed"]
+    try:
+        while processed < job["total"]:
+            if out_of_time(context):
+                continue_async(context, {"job": job_id})
+                return {"status": "IN_PROGRESS", "job_id": job_id, "processed": processed}
+            count = min(jobs.JOB_SLICE_SIZE, job["total"] - processed)
+            rows = jobs.job_rows(job_id, processed, count)
+            results = invite_batch(list(enumerate(rows, start=processed)))
+            bad = sum(r["status"] == "failed" for r in results)
+            jobs.record_results(job_id, results, len(results) - bad, bad)
+            processed += len(results)
+            failed += bad
+            logger.info(f"Invite job {job_id}: {processed}/{job['total']} rows")
+    except Exception as e:
+        logger.error(f"Invite job {job_id} failed: {str(e)}")
+        jobs.fail_job(job_id, e)
+        return {"status": "FAILED", "job_id": job_id}
+
+    jobs.finish_job(job_id, failed)
+    return {"status": "SUCCESS", "job_id": job_id}
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Invite Admins or City Officials.
+
+    The body is one invite, a JSON array (or {"users": [...]}), or a CSV upload
+    (text/csv, or {"csv": "..."}) with email,name,region,city,role columns.
+    Every row is validated before anything is created. Batches are provisioned
+    by a rate-limited worker pool and answered with per-row results; batches
+    over INVITE_SYNC_LIMIT rows are queued as a job and answered with 202.
+    In async mode (ASYNC_WRITES, or "Prefer: respond-async") every request
+    is answered with 202 and provisioned by the queue consumer.
+    """
+    if is_queue_event(event):
+        with governor.priority(governor.BATCH):
+            return consume_slices(event, lambda job, start, rows: invite_batch(list(enumerate(rows, start=start))))
+    if "job" in event:
+        with governor.priority(governor.BATCH):
+            return run_invite_job(event["job"], context)
+
+    logger.info(f"Received {event.get('httpMethod')} {event.get('path')}")
+    return invite_request(event, context)
+
+
+@api_handler(methods="OPTIONS,POST")
+@idempotent("invite")
+def invite_request(request, context):
+    logger.info("Processing user creation request")
+
+    try:
+        rows, batch = parse_rows(request)
+    except (ValueError, csv.Error) as e:
+        return 400, {"error": f"Unreadable request body: {e}"}
+
+    if len(rows) > INVITE_MAX_ROWS:
+        return 400, {"error": f"At most {INVITE_MAX_ROWS} users per request"}
+    errors = validate_rows(rows)
+    if errors:
+        if not batch:
+            return 400, {"error": errors[0]["error"]}
+        return 400, {"error": "Invalid rows, nothing was invited", "rows": errors}
+
+    if wants_async(request):
+        job_id = jobs.create_job("invite", len(rows), rows=rows, queued=True)
+        enqueue_job(job_id, len(rows))
+        logger.info(f"Queued invite {job_id} for {len(rows)} users")
+        return 202, {"jobId": job_id, "statusUrl": f"/jobs/{job_id}", "total": len(rows)}
+
+    if not batch:
+        row = rows[0]
+        try:
+            invite_user(row)
+        except cognito_client.exceptions.UsernameExistsException:
+            return 409, {"error": "User already exists"}
+        metrics.count("UsersInvited")
+        logger.info(f"User {row['name']} with role {row['role']} created successfully")
+        return 200, {"message": f"{row['role']} {row['name']} invited successfully"}
+
+    if len(rows) > INVITE_SYNC_LIMIT:
+        job_id = jobs.create_job("invite", len(rows), rows=rows)
+        continue_async(context, {"job": job_id})
+        logger.info(f"Queued bulk invite {job_id} for {len(rows)} users")
+        return 202, {"jobId": job_id, "statusUrl": f"/jobs/{job_id}", "total": len(rows)}
+
+    results = invite_batch(list(enumerate(rows)))
+    failed = sum(r["status"] == "failed" for r in results)
+    logger.info(f"Bulk invite: {len(rows) - failed} invited, {failed} failed")
+    return 200, {"invited": len(rows) - failed, "failed": failed, "results": results}
 
 
 def generate_password():    
@@ -100,8 +290,6 @@ def generate_password():
     # Shuffle required + remaining
     random_part = list(uppercase + lowercase + digit + special + "".join(remaining))
     random.shuffle(random_part)
-     
-    logger.info("Generated temporary password")
-     
+
     return "temp" + "".join(random_part)
     
\ No newline at end of file
@@ -1,62 +1,466 @@
-import boto3, os, logging
+import os, json, logging, threading, time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from aws_clients import cognito_for
+from throttle import call_with_backoff
+import metrics
+from chunked_job import continue_async, lease_until, out_of_time
+from snapshot_io import (
+    SNAPSHOT_BUCKET,
+    SNAPSHOT_COMPRESSION,
+    SnapshotWriter,
+    data_key,
+    snapshot_prefix,
+    write_manifest,
+)
+from backup_store import (
+    backup_table,
+    claim_run,
+    clear_checkpoint,
+    delete_items,
+    fingerprint,
+    handoff,
+    load_checkpoint,
+    load_pending_fingerprints,
+    load_state,
+    now_iso,
+    save_checkpoint,
+    save_pending_fingerprints,
+    save_run_report,
+    save_state,
+    select_pools,
+    shard_of,
+    snapshot_item,
+    tombstone_item,
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-cognito = boto3.client("cognito-idp")
-dynamodb = boto3.resource("dynamodb")
-
 USER_POOL_ID = os.environ["USER_POOL_ID"]
-BACKUP_TABLE = os.environ["BACKUP_TABLE"]
-table = dynamodb.Table(BACKUP_TABLE)
+# Worker threads per pool; up to BACKUP_POOL_CONCURRENCY pools are backed up at once.
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS", "8"))
+BACKUP_POOL_CONCURRENCY = int(os.environ.get("BACKUP_POOL_CONCURRENCY", "4"))
+# Page progress is logged every this many pages; metrics carry the exact counts.
+PROGRESS_LOG_PAGES = int(os.environ.get("BACKUP_PROGRESS_LOG_PAGES", "25"))
+# admin_get_user is only needed for MFA settings; list_users already returns
+# every attribute, so the per-user lookup is opt-in.
+BACKUP_INCLUDE_MFA = os.environ.get("BACKUP_INCLUDE_MFA", "false").lower() == "true"
+# Incremental runs only write users whose fingerprint changed; a full run
+# rewrites everyone and re-baselines at least this often.
+FULL_BACKUP_INTERVAL_DAYS = int(os.environ.get("FULL_BACKUP_INTERVAL_DAYS", "7"))
+# With SNAPSHOT_BUCKET set, every user a run lists is also exported there as
+# compressed NDJSON, spread over this many objects per invocation so a
+# restore can stream them in parallel.
+SNAPSHOT_SEGMENTS = int(os.environ.get("SNAPSHOT_SEGMENTS", "4"))
 
+_stats_lock = threading.Lock()
 
-def lambda_handler(event, context):
-    """Backup all Cognito users (full details) into DynamoDB."""
+
+def call(stats, operation, **kwargs):
+    with _stats_lock:
+        stats[operation] += 1
+    return call_with_backoff(getattr(cognito_for(kwargs["UserPoolId"]), operation), **kwargs)
+
+
+def paginate(stats, operation, token_key, items_key, **kwargs):
+    """Yield every item of a Cognito list call, page by page."""
+    while True:
+        page = call(stats, operation, **kwargs)
+        yield from page[items_key]
+        token = page.get(token_key)
+        if not token:
+            return
+        kwargs[token_key] = token
+
+
+def get_group_memberships(stats, pool_id, pool):
+    """Return {username: [group, ...]} with one listing per group instead of per user."""
+    groups = [
+        g["GroupName"]
+        for g in paginate(stats, "list_groups", "NextToken", "Groups", UserPoolId=pool_id)
+    ]
+
+    def members(group):
+        return group, [
+            u["Username"]
+            for u in paginate(stats, "list_users_in_group", "NextToken", "Users",
+                              UserPoolId=pool_id, GroupName=group)
+        ]
+
+    memberships = {}
+    for group, usernames in pool.map(members, groups):
+        for username in usernames:
+            memberships.setdefault(username, []).append(group)
+    return memberships
+
+
+def get_mfa(stats, pool_id, username):
+    try:
+        user_details = call(stats, "admin_get_user", UserPoolId=pool_id, Username=username)
+        return user_details.get("UserMFASettingList", []), user_details.get("PreferredMfaSetting")
+    except ClientError:
+        return [], None
+
+
+def backup_mode(event, state):
+    requested = (event or {}).get("mode")
+    if requested in ("full", "incremental"):
+        return requested
+    last_full = state.get("last_full")
+    if not last_full:
+        return "full"
+    age = datetime.now(timezone.utc) - datetime.strptime(last_full, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return "full" if age >= timedelta(days=FULL_BACKUP_INTERVAL_DAYS) else "incremental"
+
+
+def user_fields(user, memberships):
+    last_modified = user.get("UserLastModifiedDate")
+    return {
+        "username": user["Username"],
+        "attributes": {a["Name"]: a["Value"] for a in user.get("Attributes", [])},
+        "enabled": user["Enabled"],
+        "user_status": user["UserStatus"],
+        "groups": memberships.get(user["Username"], []),
+        "last_modified": last_modified.isoformat() if last_modified else None,
+    }
+
+
+def start_job(pool_id, run):
+    state, _ = load_state(pool_id)
+    return {
+        "job_id": run["run_id"],
+        "pool_id": pool_id,
+        "mode": backup_mode(run, state),
+        "status": "RUNNING",
+        "page_token": None,
+        "pages": 0,
+        "users": 0,
+        "written": 0,
+        "chunks": 0,
+        "elapsed_ms": 0,
+        "api_calls": {},
+    }
+
+
+def resume_job(item):
+    """A checkpoint read back from DynamoDB, with its Decimals turned back into ints."""
+    job = dict(item)
+    for key in ("pages", "users", "written", "chunks", "elapsed_ms"):
+        job[key] = int(job[key])
+    job["api_calls"] = {k: int(v) for k, v in job["api_calls"].items()}
+    job["export_files"] = [
+        {**f, "records": int(f["records"]), "bytes": int(f["bytes"])} for f in job.get("export_files", [])
+    ]
+    return job
+
+
+def open_export(job):
+    """This invocation's snapshot writers, or None when there is no export or it is already incomplete.
+
+    Called once the chunk number is bumped and before it is checkpointed.
+    """
+    if not SNAPSHOT_BUCKET or job.get("export_broken"):
+        return None
+    if job.get("export_open"):
+        # The invocation that held writers open died; pages it checkpointed are missing from them.
+        logger.warning(f"Backup {job['job_id']} of {job['pool_id']} lost part of its export, skipping the snapshot")
+        job["export_broken"] = True
+        return None
+    job["export_open"] = True
+    prefix = snapshot_prefix(job["pool_id"], job["job_id"])
+    first = (job["chunks"] - 1) * SNAPSHOT_SEGMENTS
+    return [SnapshotWriter(data_key(prefix, first + segment)) for segment in range(SNAPSHOT_SEGMENTS)]
+
+
+def close_export(job, writers):
+    if writers is not None:
+        job["export_files"] = job.get("export_files", []) + [writer.close() for writer in writers]
+        job["export_open"] = False
+
+
+def export_user(job, fields, mfa):
+    """A user's snapshot record; MFA settings only when this run looked them up."""
+    record = {"userId": fields["username"], "backupDate": job["job_id"],
+              **{k: v for k, v in fields.items() if k != "username"}}
+    if mfa is not None:
+        record["mfa_settings"], record["preferred_mfa"] = mfa
+    return record
+
+
+def write_snapshot(job):
+    """Write the manifest over the run's exported objects; returns its summary, or None."""
+    if not SNAPSHOT_BUCKET or job.get("export_broken") or not job.get("export_files"):
+        return None
+    prefix = snapshot_prefix(job["pool_id"], job["job_id"])
+    files = job["export_files"]
+    manifest = {
+        "format": "ndjson",
+        "compression": SNAPSHOT_COMPRESSION,
+        "user_pool_id": job["pool_id"],
+        "as_of": job["job_id"],
+        "created_at": now_iso(),
+        "records": sum(f["records"] for f in files),
+        "bytes": sum(f["bytes"] for f in files),
+        "files": files,
+    }
+    write_manifest(prefix, manifest)
+    return {"prefix": prefix, "records": manifest["records"], "bytes": manifest["bytes"]}
+
+
+def backup_page(job, users, memberships, previous, stats, pool, writers=None):
+    """Write the snapshots for one list_users page and return how many changed.
+
+    Every listed user, changed or not, also goes to the snapshot writers.
+    """
+    changed, listed, seen = [], [], {}
+    for user in users:
+        fields = user_fields(user, memberships)
+        listed.append(fields)
+        fp = fingerprint(fields)
+        seen[fields["username"]] = fp
+        if job["mode"] == "full" or previous.get(fields["username"]) != fp:
+            changed.append({**fields, "fingerprint": fp})
+
+    if BACKUP_INCLUDE_MFA:
+        mfa = list(pool.map(lambda f: get_mfa(stats, job["pool_id"], f["username"]), changed))
+    else:
+        mfa = [([], None)] * len(changed)
+
+    if writers:
+        looked_up = {f["username"]: m for f, m in zip(changed, mfa)}
+        for fields in listed:
+            mfa_of_user = looked_up.get(fields["username"]) if BACKUP_INCLUDE_MFA else ([], None)
+            writers[shard_of(fields["username"]) % len(writers)].write(export_user(job, fields, mfa_of_user))
+
+    # batch_writer groups puts into BatchWriteItem calls of 25 and re-queues
+    # any UnprocessedItems; leaving the block flushes the page before the
+    # checkpoint moves past it.
+    with backup_table().batch_writer(overwrite_by_pkeys=["userId", "backupDate"]) as batch:
+        for fields, (mfa_settings, preferred_mfa) in zip(changed, mfa):
+            batch.put_item(Item=snapshot_item(
+                fields.pop("username"),
+                job["job_id"],
+                job["pool_id"],
+                **fields,
+                mfa_settings=mfa_settings,
+                preferred_mfa=preferred_mfa,
+            ))
+    save_pending_fingerprints(job["job_id"], job["pages"], seen, job["pool_id"])
+    return len(changed)
+
+
+def finish_job(job, previous, state):
+    """Tombstone vanished users, promote the job's fingerprints and close it."""
+    pool_id = job["pool_id"]
+    current, pending_keys = load_pending_fingerprints(job["job_id"], pool_id)
+    removed = [u for u in previous if u not in current]
+    with backup_table().batch_writer(overwrite_by_pkeys=["userId", "backupDate"]) as batch:
+        for username in removed:
+            batch.put_item(Item=tombstone_item(username, job["job_id"], pool_id))
+
+    dirty_shards = {shard_of(u) for u, fp in current.items() if previous.get(u) != fp}
+    dirty_shards.update(shard_of(u) for u in removed)
+
+    seconds = job["elapsed_ms"] / 1000
+    report = {
+        "mode": job["mode"],
+        "backup_date": job["job_id"],
+        "users": job["users"],
+        "written": job["written"],
+        "skipped": job["users"] - job["written"],
+        "tombstones": len(removed),
+        "chunks": job["chunks"],
+        "seconds": round(seconds, 2),
+        "users_per_second": round(job["users"] / seconds, 1) if seconds else None,
+        "api_calls": job["api_calls"],
+    }
+    save_state(
+        {
+            "high_water_mark": job["job_id"],
+            "last_full": job["job_id"] if job["mode"] == "full" else state.get("last_full"),
+            "last_report": {k: v for k, v in report.items() if k not in ("seconds", "users_per_second")},
+        },
+        current,
+        shards=None if job["mode"] == "full" else dirty_shards,
+        pool_id=pool_id,
+    )
+    delete_items(pending_keys)
+    clear_checkpoint("backup", pool_id)
+    return report
+
+
+def backup_pool(pool_id, run, context):
+    """Run one chunk of a pool's backup job; returns the pool's result for the run report."""
+    stats = Counter()
+    started = time.monotonic()
+    writers = None
     try:
-        paginator = cognito.get_paginator("list_users")
-
-        for page in paginator.paginate(UserPoolId=USER_POOL_ID):
-            for user in page["Users"]:
-                username = user["Username"]
-
-                # groups
-                groups_resp = cognito.admin_list_groups_for_user(
-                    Username=username, UserPoolId=USER_POOL_ID
-                )
-                groups = [g["GroupName"] for g in groups_resp.get("Groups", [])]
-
-                # MFA + all attributes from admin_get_user
-                try:
-                    user_details = cognito.admin_get_user(
-                        UserPoolId=USER_POOL_ID, Username=username
-                    )
-                    mfa_settings = user_details.get("UserMFASettingList", [])
-                    preferred_mfa = user_details.get("PreferredMfaSetting")
-                    full_attributes = {
-                        attr["Name"]: attr["Value"]
-                        for attr in user_details.get("UserAttributes", [])
-                    }
-                except ClientError:
-                    mfa_settings, preferred_mfa, full_attributes = [], None, {}
-
-                item = {
-                    "username": username,
-                    "attributes": full_attributes,
-                    "enabled": user["Enabled"],
-                    "user_status": user["UserStatus"],
-                    "groups": groups,
-                    "mfa_settings": mfa_settings,
-                    "preferred_mfa": preferred_mfa,
-                }
-
-                table.put_item(Item=item)
-                logger.info(f"✅ Backed up user {username}")
-
-        logger.info("🎉 Backup completed successfully")
-        return {"status": "SUCCESS"}
+        job = load_checkpoint("backup", pool_id)
+        if job:
+            job = resume_job({"pool_id": pool_id, **job})
+            logger.info(f"Resuming {job['mode']} backup {job['job_id']} of {pool_id} at page {job['pages']}")
+        else:
+            job = start_job(pool_id, run)
+            logger.info(f"Starting {job['mode']} backup {job['job_id']} of {pool_id}")
+
+        job["chunks"] += 1
+        job["lease_until"] = lease_until(context)
+        writers = open_export(job)
+        save_checkpoint("backup", job, pool_id)
+        state, previous = load_state(pool_id)
+
+        with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as pool:
+            memberships = get_group_memberships(stats, pool_id, pool)
+
+            while True:
+                if out_of_time(context):
+                    close_export(job, writers)
+                    job["lease_until"] = 0
+                    job["elapsed_ms"] += int((time.monotonic() - started) * 1000)
+                    job["api_calls"] = dict(Counter(job["api_calls"]) + stats)
+                    save_checkpoint("backup", job, pool_id)
+                    return {"status": "IN_PROGRESS", "job_id": job["job_id"], "users": job["users"]}
+
+                kwargs = {"UserPoolId": pool_id}
+                if job["page_token"]:
+                    kwargs["PaginationToken"] = job["page_token"]
+                page = call(stats, "list_users", **kwargs)
+
+                written = backup_page(job, page["Users"], memberships, previous, stats, pool, writers)
+                metrics.count("UsersScanned", len(page["Users"]))
+                metrics.count("SnapshotsWritten", written)
+                job["written"] += written
+                job["users"] += len(page["Users"])
+                job["pages"] += 1
+                job["page_token"] = page.get("PaginationToken")
+                save_checkpoint("backup", job, pool_id)
+                if job["pages"] % PROGRESS_LOG_PAGES == 0:
+                    logger.info(f"Scanned {job['users']} users of {pool_id}, wrote {job['written']}")
+
+                if not job["page_token"]:
+                    break
+
+        close_export(job, writers)
+        job["elapsed_ms"] += int((time.monotonic() - started) * 1000)
+        job["api_calls"] = dict(Counter(job["api_calls"]) + stats)
+        snapshot = write_snapshot(job)
+        report = finish_job(job, previous, state)
+        if snapshot:
+            report["snapshot"] = snapshot
+        logger.info(f"🎉 Backup of {pool_id} completed successfully: {report}")
+        return {"status": "SUCCESS", "report": report}
 
     except ClientError as e:
+        logger.error(f"❌ Backup of {pool_id} failed: {str(e)}")
+        for writer in writers or ():
+            writer.abort()
+        return {"status": "ERROR", "details": str(e)}
+
+
+def start_run(event):
+    return {
+        "run_id": now_iso(),
+        "pools": select_pools(event.get("pools")),
+        "mode": event.get("mode"),
+        "results": {},
+        "chunks": 0,
+    }
+
+
+def save_run(run, only_if_new=False):
+    """Checkpoint the run; the pools' results are kept as JSON, floats and all."""
+    return save_checkpoint("backup_run", {**run, "results": json.dumps(run["results"])}, only_if_new=only_if_new)
+
+
+def run_report(run):
+    """One report for the whole run: every pool's outcome plus totals over the pools that finished."""
+    reports = [r["report"] for r in run["results"].values() if r["status"] == "SUCCESS"]
+    totals = {key: sum(int(r[key]) for r in reports) for key in ("users", "written", "skipped", "tombstones")}
+    return {
+        "run_id": run["run_id"],
+        "pools": run["results"],
+        "succeeded": len(reports),
+        "failed": sum(r["status"] == "ERROR" for r in run["results"].values()),
+        **totals,
+    }
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Back up Cognito users into DynamoDB, writing only what changed since the last run.
+
+    Each run writes snapshot items under its own backupDate, so older point-in-time
+    copies stay readable next to it. Users that vanished get a tombstone.
+
+    A run covers USER_POOL_ID and every pool in BACKUP_POOL_IDS, or the subset
+    given as {"pools": [...]}. Pools are backed up side by side, each with
+    its own BACKUP_WORKERS threads, and their snapshots and state are kept
+    apart in the backup table. The run ends with one report over all pools,
+    stored as a RUN item next to the backup state.
+
+    Each pool's backup is a chunked job: after every page the Cognito
+    PaginationToken and progress are checkpointed, and before the invocation
+    runs out of time it re-invokes itself with {"resume": run_id,
+    "resume_token": ...}. Each chunk claims the run with a conditional
+    update, so only that resume event, or any invocation once the run's lease
+    has lapsed, can take it: a schedule tick or a replayed event arriving
+    meanwhile is skipped. A run that died part-way is picked up from its
+    checkpoints by the next invocation.
+
+    With SNAPSHOT_BUCKET set, every user a run lists is streamed to S3 as
+    compressed NDJSON while the run goes, so the export costs what the pool
+    does rather than what the table's history does. A finished run writes
+    the manifest of record counts and checksums under
+    snapshots/<pool id>/<run id>/. If an invocation dies with its objects
+    open, that run's snapshot is skipped and the next run writes one.
+    """
+    event = event or {}
+    try:
+        lease = lease_until(context)
+        run = load_checkpoint("backup_run")
+        if run:
+            token = event.get("resume_token") if event.get("resume") == run["run_id"] else None
+            fresh = claim_run("backup_run", lease, token)
+            if fresh is None:
+                logger.info(f"Backup run {run['run_id']} is held by another invocation, skipping this one")
+                return {"status": "SKIPPED", "job_id": run["run_id"]}
+            run = {**run, "chunks": int(run["chunks"]), "results": json.loads(run["results"]), "resume_token": fresh}
+        elif event.get("resume"):
+            logger.info(f"Backup run {event['resume']} has already finished, skipping this invocation")
+            return {"status": "SKIPPED", "job_id": event["resume"]}
+        else:
+            run = {**start_run(event), "lease_until": lease}
+            if not save_run(run, only_if_new=True):
+                logger.info("Another backup run started at the same time, skipping this invocation")
+                return {"status": "SKIPPED"}
+            logger.info(f"Starting backup run {run['run_id']} over {len(run['pools'])} pools")
+
+        run["chunks"] += 1
+        run["lease_until"] = lease
+        save_run(run)
+
+        pending = [p for p in run["pools"] if p not in run["results"]]
+        with ThreadPoolExecutor(max_workers=max(1, min(BACKUP_POOL_CONCURRENCY, len(pending)))) as pools:
+            results = dict(zip(pending, pools.map(lambda pool_id: backup_pool(pool_id, run, context), pending)))
+        run["results"].update({p: r for p, r in results.items() if r["status"] != "IN_PROGRESS"})
+
+        if len(run["results"]) < len(run["pools"]):
+            resume = handoff(run)
+            save_run(run)
+            continue_async(context, resume)
+            return {"status": "IN_PROGRESS", "job_id": run["run_id"], "report": run_report(run)}
+
+        report = run_report(run)
+        save_run_report("backup", run["run_id"], report)
+        clear_checkpoint("backup_run")
+        logger.info(f"🎉 Backup run {run['run_id']} completed: {report}")
+        if not report["failed"]:
+            return {"status": "SUCCESS", "report": report}
+        return {"status": "PARTIAL" if report["succeeded"] else "ERROR", "report": report}
+
+    except (ClientError, ValueError) as e:
         logger.error(f"❌ Backup failed: {str(e)}")
         return {"status": "ERROR", "details": str(e)}
@@ -1,157 +1,102 @@
+import os
+import html
 import logging
 import urllib.parse
+from template_engine import Template
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+FRONTEND_BASE_URL = os.environ.get("FRONTEND_BASE_URL", "http://localhost:4200").rstrip("/")
+
+brand_name = "CMRP"
+brand_color = "#1A1A1A"  # Bold minimal dark tone
+accent_color = "#111C43FF" # A striking red accent for buttons or highlights
+
+# Compiled once per container; only per-user values are filled in per message.
+BRAND = {"brand_name": brand_name, "brand_color": brand_color, "accent_color": accent_color}
+LAYOUT = Template.load("layout").bind(**BRAND)
+CODE_BLOCK = Template.load("code_block")
+SIGN_UP_MESSAGE = Template.load("sign_up_message").bind(**BRAND)
+ADMIN_CREATE_USER = Template.load("admin_create_user").bind(**BRAND)
+VERIFY_LINK = Template.compile(f"{FRONTEND_BASE_URL}/verify-otp?otp={{{{code}}}}&email={{{{email}}}}")
+RESET_LINK = Template.compile(f"{FRONTEND_BASE_URL}/reset-password?tempPassword={{{{code}}}}&email={{{{email}}}}")
+
+
+def build_html_email(title, message, code=None):
+    code_block = CODE_BLOCK.render(code=code) if code else ""
+    return LAYOUT.render(title=title, message=message, code_block=code_block)
+
+
+def code_email(subject, title, message):
+    """A trigger whose email is the shared layout with the code highlighted."""
+    message = Template.compile(message).bind(**BRAND)
+
+    def render(name, email, code):
+        return subject, build_html_email(title, message.render(name=name), code)
+
+    return render
+
+
+def sign_up(name, email, code):
+    verify_link = VERIFY_LINK.render(code=code, email=urllib.parse.quote(email))
+    message = SIGN_UP_MESSAGE.render(name=name, code=code, verify_link=verify_link)
+    return f"Welcome to {brand_name}!", build_html_email("Welcome to CMRP - Verify Your Email", message)
+
+
+def admin_create_user(name, email, code):
+    reset_link = RESET_LINK.render(code=urllib.parse.quote(code), email=urllib.parse.quote(email))
+    return f"Welcome to {brand_name} 🎉", ADMIN_CREATE_USER.render(
+        name=name, code=code, email=html.escape(email), reset_link=reset_link
+    )
+
+
+def default_message(name, email, code):
+    return f"{brand_name} Notification", build_html_email("Notification", "This is a default message.")
+
+
+TRIGGERS = {
+    "CustomMessage_SignUp": sign_up,
+    "CustomMessage_AdminCreateUser": admin_create_user,
+    "CustomMessage_ForgotPassword": code_email(
+        f"{brand_name} - Password Reset",
+        "Password Reset Request",
+        "Hello,<br><br>Use this code to reset your password:",
+    ),
+    "CustomMessage_VerifyUserAttribute": code_email(
+        f"{brand_name} - Verify Your Email",
+        "Verify Your Email",
+        "Hi {{name}},<br><br>Please use this code to verify your email address:",
+    ),
+    "CustomMessage_UpdateUserAttribute": code_email(
+        f"{brand_name} - Confirm Your Update",
+        "Confirm Your Update",
+        "Hi {{name}},<br><br>We received a request to update your account information. "
+        "Please use this code to confirm the change:",
+    ),
+    "CustomMessage_ResendCode": code_email(
+        f"{brand_name} - Verification Code",
+        "Verification Code",
+        "Hi {{name}},<br><br>Here’s your requested verification code:",
+    ),
+    "CustomMessage_Authentication": code_email(
+        f"{brand_name} - Authentication Code",
+        "Authentication Required",
+        "Hi {{name}},<br><br>Please use this code to complete your sign-in:",
+    ),
+}
+
 
 def lambda_handler(event, context):
     trigger = event["triggerSource"]
     user_email = event["request"]["userAttributes"].get("email", "Unknown email")
-    name = event["request"]["userAttributes"].get("name", "User")
-
-    brand_name = "CMRP"
-    brand_color = "#1A1A1A"  # Bold minimal dark tone
-    accent_color = "#111C43FF" # A striking red accent for buttons or highlights
-
-    def build_html_email(title, message, code=None):
-        code_block = f"""
-            <div style="text-align: center; margin: 20px 0;">
-                <p style="font-size: 22px; font-weight: bold; color: #4CAF50; margin: 0;">
-                  {code}
-                </p>
-            </div>
-        """ if code else ""
-
-        return f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; background-color: #F9F9F9; padding: 20px;">
-                <div style="max-width: 500px; margin: auto; background: white; padding: 30px; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.05);">
-                    <h1 style="color: {brand_color}; font-size: 28px; margin-bottom: 10px;">{brand_name}</h1>
-                    <h2 style="color: {brand_color}; font-size: 20px; margin-bottom: 20px;">{title}</h2>
-                    <p style="color: #333; font-size: 18px; line-height: 1.5;">{message}</p>
-                    {code_block}
-                    <p style="margin-top: 30px; font-size: 12px; color: #888;">If you did not request this, please ignore this email.</p>
-                </div>
-            </body>
-        </html>
-        """
-
-    if trigger == "CustomMessage_SignUp":
-        logger.info(f"CustomMessage_SignUp triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"Welcome to {brand_name}!"
-        code = event['request']['codeParameter']
-        encoded_email = urllib.parse.quote(user_email)
-
-        verify_link = (
-                f"http://localhost:4200/verify-otp?"
-                f"otp={event['request']['codeParameter']}&email={encoded_email}"
-            )
-
-        
-        message = (
-                f"Hi {name},<br><br>"
-                f"Thanks for signing up. Please use this code to verify your account:"
-                f"<span style='font-weight:bold; color:{accent_color}'>{code}</span><br><br>"
-                f"<a href='{verify_link}' "
-                f"style='display:inline-block; margin-top:20px; padding:12px 20px; background-color:{accent_color}; "
-                f"color:white; text-decoration:none; border-radius:6px; font-size:16px;'>"
-                f"Verify Email</a><br>" )
-        title = "Welcome to CMRP - Verify Your Email"
-        
-        event["response"]["emailMessage"] = f"""
-            <html>
-                <body style="font-family: Arial, sans-serif; background-color: #F9F9F9; padding: 20px;">
-                    <div style="max-width: 500px; margin: auto; background: white; padding: 30px; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.05);">
-                        <h1 style="color: {brand_color}; font-size: 28px; margin-bottom: 10px;">{brand_name}</h1>
-                        <h2 style="color: {brand_color}; font-size: 20px; margin-bottom: 20px;">{title}</h2>
-                        <p style="color: #333; font-size: 18px; line-height: 1.5;">{message}</p>
-                        <p style="margin-top: 30px; font-size: 12px; color: #888;">If you did not request this, please ignore this email.</p>
-                    </div>
-                </body>
-            </html>
-            """
-
-    elif trigger == "CustomMessage_AdminCreateUser":
-        logger.info(f"CustomMessage_AdminCreateUser triggered for {user_email}")
-
-        temp_password = event['request']['codeParameter']
-
-        reset_link = (
-                f"http://localhost:4200/reset-password?"
-                f"tempPassword={urllib.parse.quote(temp_password)}&email={urllib.parse.quote(user_email)}"
-            )
-
-        event["response"]["emailSubject"] = f"Welcome to {brand_name} 🎉"
-
-        event["response"]["emailMessage"] =  f"""
-                <html>
-                    <body>
-                        <h2>Welcome to {brand_name}!</h2>
-                        <p>Hi {name},</p>
-                        <p>Your temporary password is <b>{temp_password}</b> and email is: <b>{user_email}</b></p>
-                        <p>Reset here: <a href="{reset_link}">Reset My Password</a></p>
-                    </body>
-                </html>
-                """
-                
-    elif trigger == "CustomMessage_ForgotPassword":
-        logger.info(f"CustomMessage_ForgotPassword triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"{brand_name} - Password Reset"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Password Reset Request",
-            message="Hello,<br><br>Use this code to reset your password:",
-            code=event['request']['codeParameter']
-        )
-
-    elif trigger == "CustomMessage_VerifyUserAttribute":
-        logger.info(f"CustomMessage_VerifyUserAttribute triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"{brand_name} - Verify Your Email"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Verify Your Email",
-            message=f"Hi {name},<br><br>Please use this code to verify your email address:",
-            code=event['request']['codeParameter']
-        )
-
-    elif trigger == "CustomMessage_UpdateUserAttribute":
-        logger.info(f"CustomMessage_UpdateUserAttribute triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"{brand_name} - Confirm Your Update"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Confirm Your Update",
-            message=f"Hi {name},<br><br>We received a request to update your account information. "
-                    "Please use this code to confirm the change:",
-            code=event['request']['codeParameter']
-        )
-
-    elif trigger == "CustomMessage_ResendCode":
-        logger.info(f"CustomMessage_ResendCode triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"{brand_name} - Verification Code"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Verification Code",
-            message=f"Hi {name},<br><br>Here’s your requested verification code:",
-            code=event['request']['codeParameter']
-        )
-
-    elif trigger == "CustomMessage_Authentication":
-        logger.info(f"CustomMessage_Authentication triggered for {user_email}")
-        
-        event["response"]["emailSubject"] = f"{brand_name} - Authentication Code"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Authentication Required",
-            message=f"Hi {name},<br><br>Please use this code to complete your sign-in:",
-            code=event['request']['codeParameter']
-        )
-
-    else:
-        event["response"]["emailSubject"] = f"{brand_name} Notification"
-        event["response"]["emailMessage"] = build_html_email(
-            title="Notification",
-            message="This is a default message."
-        )
+    name = html.escape(event["request"]["userAttributes"].get("name", "User"))
+
+    render = TRIGGERS.get(trigger, default_message)
+    if render is not default_message:
+        logger.info(f"{trigger} triggered for {user_email}")
 
+    subject, message = render(name, user_email, event["request"].get("codeParameter"))
+    event["response"]["emailSubject"] = subject
+    event["response"]["emailMessage"] = message
     return event
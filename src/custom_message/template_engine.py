@@ -0,0 +1,45 @@
+import os
+import re
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class Template:
+    """A template split once into literal text and {{placeholder}} slots.
+
+    bind() folds values that never change (brand, colours, base URLs) into
+    the literal text, so rendering is a single join over what is left.
+    """
+
+    def __init__(self, parts):
+        # parts alternates literal text and placeholder names: [text, name, text, ...]
+        self.parts = parts
+        self.fields = frozenset(parts[1::2])
+
+    @classmethod
+    def compile(cls, source):
+        return cls(PLACEHOLDER.split(source.strip()))
+
+    @classmethod
+    def load(cls, name):
+        with open(os.path.join(TEMPLATE_DIR, f"{name}.html"), encoding="utf-8") as f:
+            return cls.compile(f.read())
+
+    def bind(self, **values):
+        parts = [self.parts[0]]
+        for i in range(1, len(self.parts), 2):
+            name, text = self.parts[i], self.parts[i + 1]
+            if name in values:
+                parts[-1] += str(values[name]) + text
+            else:
+                parts += [name, text]
+        return Template(parts)
+
+    def render(self, **values):
+        parts = self.parts
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            out.append(values[parts[i]])
+            out.append(parts[i + 1])
+        return "".join(out)
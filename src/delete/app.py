@@ -1,72 +1,361 @@
-import boto3
 import os
 import logging
-import json
-from auth_utils import is_admin
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from api import api_handler
+from idempotency import idempotent
+from aws_clients import LazyClient
+from backup_store import backup_table, now_iso, snapshot_item
+from chunked_job import continue_async, out_of_time
+from throttle import RateLimiter, call_with_backoff
+import metrics
+import governor
+from user_directory import DEFAULT_ROLE, ROLE_GROUPS, bump_directory_version, remove_user
+from write_queue import consume_slices, enqueue_job, is_queue_event, wants_async
+import jobs
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-cognito = boto3.client("cognito-idp")
+cognito = LazyClient("cognito-idp")
 USER_POOL_ID = os.environ.get("USER_POOL_ID")
+DELETE_WORKERS = int(os.environ.get("DELETE_WORKERS", "8"))
+# Explicit lists up to this size are deleted inside the API call; bigger
+# lists and every filter run as a background job polled via GET /jobs/{jobId}.
+DELETE_SYNC_LIMIT = int(os.environ.get("DELETE_SYNC_LIMIT", "25"))
+DELETE_MAX_USERNAMES = int(os.environ.get("DELETE_MAX_USERNAMES", "5000"))
+_delete_limiter = RateLimiter(float(os.environ.get("DELETE_RPS", "20")))
+_read_limiter = RateLimiter(float(os.environ.get("DELETE_READ_RPS", "50")))
 
-CORS_HEADERS = {
-    "Access-Control-Allow-Methods": "OPTIONS,POST,DELETE,GET",
-    "Access-Control-Allow-Headers": "Content-Type,Authorization",
-}
-
-def lambda_handler(event, context): 
-
-    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
-    origin = headers.get('origin')
-    CORS_HEADERS.update({"Access-Control-Allow-Origin": origin})
-
-    if not is_admin(event):
-        logger.warning("Unauthorized access attempt by non-admin user")
-        
-        return {
-            "statusCode": 403,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({"message": "Forbidden: Admins only"})
-        }
-    
-    body = event.get("body")
-    body_json = json.loads(body) if body else {}
+FILTER_FIELDS = ("role", "region", "city", "last_modified_before")
+
+def limited(limiter, operation, **kwargs):
+    def attempt(**kw):
+        limiter.acquire()
+        return getattr(cognito, operation)(**kw)
+
+    return call_with_backoff(attempt, **kwargs)
+
+
+def parse_cutoff(value):
+    """last_modified_before as an aware UTC datetime; a value without an offset is taken as UTC."""
+    if not isinstance(value, str):
+        raise ValueError("last_modified_before must be an ISO 8601 timestamp")
+    cutoff = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if cutoff.tzinfo is None:
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    return cutoff.astimezone(timezone.utc)
+
+
+def paginate(operation, items_key, token_key="NextToken", **kwargs):
+    while True:
+        page = limited(_read_limiter, operation, UserPoolId=USER_POOL_ID, **kwargs)
+        yield from page[items_key]
+        if not page.get(token_key):
+            return
+        kwargs[token_key] = page[token_key]
+
+
+def user_snapshot(user, groups):
+    """A Cognito user in the backup table's snapshot layout."""
+    last_modified = user.get("UserLastModifiedDate")
+    return {
+        "username": user["Username"],
+        "attributes": {a["Name"]: a["Value"] for a in user.get("Attributes", user.get("UserAttributes", []))},
+        "enabled": user["Enabled"],
+        "user_status": user["UserStatus"],
+        "groups": groups,
+        "last_modified": last_modified.isoformat() if last_modified else None,
+    }
+
+
+def resolve_usernames(usernames):
+    """Snapshots of the named users that exist; missing ones are left out."""
+    def lookup(username):
+        try:
+            user = limited(_read_limiter, "admin_get_user", UserPoolId=USER_POOL_ID, Username=username)
+        except cognito.exceptions.UserNotFoundException:
+            return None
+        groups = [g["GroupName"] for g in paginate("admin_list_groups_for_user", "Groups", Username=username)]
+        return user_snapshot(user, groups)
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        return [s for s in pool.map(lookup, usernames) if s]
+
+
+def group_memberships():
+    """{username: [group, ...]} over every group in the pool."""
+    groups = [g["GroupName"] for g in paginate("list_groups", "Groups")]
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        members = dict(pool.map(
+            lambda g: (g, list(paginate("list_users_in_group", "Users", GroupName=g))), groups
+        ))
+    memberships = {}
+    for group, users in members.items():
+        for user in users:
+            memberships.setdefault(user["Username"], []).append(group)
+    return memberships
+
+
+def filter_page(criteria, memberships, token=None):
+    """One page of the users matching role / region / city / last_modified_before.
+
+    Returns their snapshots and the token of the next page, None after the last.
+    """
+    role = criteria.get("role")
+    if role and role != DEFAULT_ROLE:
+        operation, token_key, kwargs = "list_users_in_group", "NextToken", {"GroupName": role}
+    else:
+        operation, token_key, kwargs = "list_users", "PaginationToken", {}
+    if token:
+        kwargs[token_key] = token
+    page = limited(_read_limiter, operation, UserPoolId=USER_POOL_ID, **kwargs)
+
+    cutoff = criteria.get("last_modified_before")
+    cutoff = parse_cutoff(cutoff) if cutoff else None
+    matched = []
+    for user in page["Users"]:
+        snapshot = user_snapshot(user, memberships.get(user["Username"], []))
+        if role == DEFAULT_ROLE and any(g in ROLE_GROUPS for g in snapshot["groups"]):
+            continue
+        if criteria.get("region") and snapshot["attributes"].get("custom:region") != criteria["region"]:
+            continue
+        if criteria.get("city") and snapshot["attributes"].get("custom:city") != criteria["city"]:
+            continue
+        modified = user.get("UserLastModifiedDate")
+        if cutoff and (modified is None or modified >= cutoff):
+            continue
+        matched.append(snapshot)
+    return matched, page.get(token_key)
+
+
+def backup_users(snapshots, backup_date):
+    """Keep a point-in-time copy of the users about to be deleted.
+
+    A restore with {"as_of": backup_date, "usernames": [...]} brings them back.
+    """
+    with backup_table().batch_writer(overwrite_by_pkeys=["userId", "backupDate"]) as batch:
+        for snapshot in snapshots:
+            fields = dict(snapshot)
+            batch.put_item(Item=snapshot_item(fields.pop("username"), backup_date, reason="pre-delete", **fields))
+
+
+def delete_one(username):
+    try:
+        limited(_delete_limiter, "admin_delete_user", UserPoolId=USER_POOL_ID, Username=username)
+        remove_user(username, invalidate=False)
+        return {"username": username, "status": "deleted"}
+    except cognito.exceptions.UserNotFoundException:
+        remove_user(username, invalidate=False)
+        return {"username": username, "status": "not_found"}
+    except Exception as e:
+        return {"username": username, "status": "failed", "error": str(e)}
+
+
+def delete_batch(usernames):
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        results = list(pool.map(delete_one, usernames))
+    for status, total in summary(results).items():
+        metrics.count("UsersDeleted", total, Outcome=status)
+    if any(r["status"] != "failed" for r in results):
+        bump_directory_version()
+    return results
+
+
+def summary(results):
+    return {status: sum(r["status"] == status for r in results) for status in ("deleted", "not_found", "failed")}
+
+
+def resolve_job(job, context):
+    """Find, and back up if asked, a job's users a page at a time; False if time ran out first.
+
+    A filter is listed one Cognito page per step and its matches appended
+    to the job's rows; an explicit list is resolved one slice per step. The
+    position is saved after every step, so the next invocation carries on.
+    """
+    job_id, criteria = job["job_id"], job.get("filter")
+    memberships = group_memberships() if criteria else None
+    jobs.update_job(job_id, status=jobs.RUNNING)
+    while True:
+        if out_of_time(context):
+            return False
+        if criteria:
+            snapshots, token = filter_page(criteria, memberships, job.get("filter_token"))
+            jobs.append_rows(job_id, job["total"], [s["username"] for s in snapshots])
+            job["total"] += len(snapshots)
+            job["filter_token"] = token
+            done = token is None
+        else:
+            start = int(job.get("resolved_count", 0))
+            usernames = jobs.job_rows(job_id, start, jobs.JOB_SLICE_SIZE)
+            snapshots = resolve_usernames(usernames)
+            job["resolved_count"] = start + len(usernames)
+            done = job["resolved_count"] >= job["total"]
+        if job["backup"]:
+            backup_users(snapshots, job["backup_date"])
+        jobs.update_job(job_id, total=job["total"], filter_token=job.get("filter_token"),
+                        resolved_count=job.get("resolved_count", 0))
+        if done:
+            return True
+
+
+def run_delete_job(job_id, context):
+    """Resolve, back up and delete a queued bulk deletion, resuming across invocations."""
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] in jobs.FINISHED:
+        return {"status": "SKIPPED", "job_id": job_id}
+
+    try:
+        if not job.get("resolved"):
+            if (job.get("filter") or job["backup"]) and not resolve_job(job, context):
+                continue_async(context, {"job": job_id})
+                return {"status": "IN_PROGRESS", "job_id": job_id, "resolved": job["total"]}
+            jobs.update_job(job_id, status=jobs.RUNNING, resolved=True, total=job["total"])
+            logger.info(f"Delete job {job_id}: {job['total']} users to delete")
+
+        processed, failed = job["processed"], job["failed"]
+        while processed < job["total"]:
+            if out_of_time(context):
+                continue_async(context, {"job": job_id})
+                return {"status": "IN_PROGRESS", "job_id": job_id, "processed": processed}
+            count = min(jobs.JOB_SLICE_SIZE, job["total"] - processed)
+            results = delete_batch(jobs.job_rows(job_id, processed, count))
+            bad = sum(r["status"] == "failed" for r in results)
+            jobs.record_results(job_id, results, len(results) - bad, bad)
+            processed += len(results)
+            failed += bad
+            logger.info(f"Delete job {job_id}: {processed}/{job['total']} users")
+    except Exception as e:
+        logger.error(f"Delete job {job_id} failed: {str(e)}")
+        jobs.fail_job(job_id, e)
+        return {"status": "FAILED", "job_id": job_id}
+
+    jobs.finish_job(job_id, failed)
+    return {"status": "SUCCESS", "job_id": job_id}
+
+
+def delete_slice(job, start, usernames):
+    """Back up, if asked, and delete one queued slice of a job's usernames."""
+    if job["backup"]:
+        backup_users(resolve_usernames(usernames), job["backup_date"])
+    return delete_batch(usernames)
+
+
+def queue_delete(usernames, backup):
+    backup_date = now_iso()
+    job_id = jobs.create_job(
+        "delete",
+        len(usernames),
+        rows=usernames,
+        backup=backup,
+        backup_date=backup_date,
+        resolved=True,
+        queued=True,
+    )
+    enqueue_job(job_id, len(usernames))
+    logger.info(f"Queued delete {job_id} for {len(usernames)} users")
+    return 202, {"jobId": job_id, "statusUrl": f"/jobs/{job_id}", "total": len(usernames),
+                 "backup_date": backup_date if backup else None}
+
+
+def bulk_delete(body, context, queued=False):
+    """{"usernames": [...]} or {"filter": {...}}, plus optional "backup": true."""
+    backup = bool(body.get("backup"))
+    criteria = body.get("filter")
+    usernames = body.get("usernames")
+    if criteria is not None:
+        if not isinstance(criteria, dict) or not any(criteria.get(f) for f in FILTER_FIELDS):
+            return 400, {"message": f"'filter' needs at least one of {', '.join(FILTER_FIELDS)}"}
+        unknown = set(criteria) - set(FILTER_FIELDS)
+        if unknown:
+            return 400, {"message": f"Unknown filter fields: {', '.join(sorted(unknown))}"}
+        not_text = [f for f in FILTER_FIELDS if criteria.get(f) is not None and not isinstance(criteria[f], str)]
+        if not_text:
+            return 400, {"message": f"Filter fields must be strings: {', '.join(not_text)}"}
+        if criteria.get("last_modified_before"):
+            try:
+                cutoff = parse_cutoff(criteria["last_modified_before"])
+            except ValueError:
+                return 400, {"message": "'last_modified_before' must be an ISO 8601 timestamp"}
+            criteria = {**criteria, "last_modified_before": cutoff.isoformat()}
+    elif not isinstance(usernames, list) or not all(isinstance(u, str) and u for u in usernames):
+        return 400, {"message": "'usernames' must be a list of usernames"}
+    elif len(usernames) > DELETE_MAX_USERNAMES:
+        return 400, {"message": f"At most {DELETE_MAX_USERNAMES} usernames per request"}
+    else:
+        usernames = list(dict.fromkeys(usernames))
+
+    if criteria is None and queued:
+        return queue_delete(usernames, backup)
+
+    backup_date = now_iso()
+    if criteria is None and len(usernames) <= DELETE_SYNC_LIMIT:
+        if backup:
+            backup_users(resolve_usernames(usernames), backup_date)
+        results = delete_batch(usernames)
+        logger.info(f"Bulk delete: {summary(results)}")
+        return 200, {**summary(results), "backup_date": backup_date if backup else None, "results": results}
+
+    job_id = jobs.create_job(
+        "delete",
+        len(usernames) if criteria is None else 0,
+        rows=usernames if criteria is None else None,
+        filter=criteria,
+        backup=backup,
+        backup_date=backup_date,
+        resolved=False,
+    )
+    continue_async(context, {"job": job_id})
+    logger.info(f"Queued bulk delete {job_id}")
+    return 202, {"jobId": job_id, "statusUrl": f"/jobs/{job_id}", "backup_date": backup_date if backup else None}
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Delete one user ({"username"}), a list ({"usernames"}) or everyone matching a filter.
+
+    Bulk deletes run concurrently under a rate limit and report a per-user
+    outcome. Filters, and lists over DELETE_SYNC_LIMIT, become a background
+    job. With "backup": true the affected users are first snapshotted into the
+    backup table; a restore with {"as_of": backup_date, "usernames": [...]}
+    brings them back. Leave out "usernames" and that restore rolls every
+    user in the pool back to backup_date, not just the deleted ones.
+    In async mode (ASYNC_WRITES, or "Prefer: respond-async") single and
+    listed deletes are answered with 202 and carried out by the queue consumer.
+    """
+    if is_queue_event(event):
+        with governor.priority(governor.BATCH):
+            return consume_slices(event, delete_slice)
+    if "job" in event:
+        with governor.priority(governor.BATCH):
+            return run_delete_job(event["job"], context)
+    return delete_request(event, context)
+
+
+@api_handler(methods="OPTIONS,POST,DELETE,GET")
+@idempotent("delete")
+def delete_request(request, context):
+    body_json = request.json()
+    if not isinstance(body_json, dict):
+        return 400, {"message": "Request body must be a JSON object"}
+
+    if "usernames" in body_json or "filter" in body_json:
+        return bulk_delete(body_json, context, queued=wants_async(request))
 
     username = body_json.get("username")
     try:
         if not username:
-            return {
-                "statusCode": 400,
-                "headers": CORS_HEADERS,
-                "body": json.dumps({"message": "'username' must be provided"})
-            }
+            return 400, {"message": "'username' must be provided"}
+        if wants_async(request):
+            return queue_delete([username], False)
         logger.info(f"Deleting user {username} from user pool {USER_POOL_ID}")
 
-        response = cognito.admin_delete_user(
-            UserPoolId=USER_POOL_ID,
-            Username=username
-        )
+        call_with_backoff(cognito.admin_delete_user, UserPoolId=USER_POOL_ID, Username=username)
+        remove_user(username)
 
-        return {
-            "statusCode": 200,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({"message": f"User {username} deleted successfully"})
-        }
+        return 200, {"message": f"User {username} deleted successfully"}
 
     except cognito.exceptions.UserNotFoundException:
         logger.warning(f"User {username} not found in pool {USER_POOL_ID}")
-        return {
-            "statusCode": 404,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({"message": f"User {username} not found"})
-        }
-
-    except Exception as e:
-        logger.error(f"Error deleting user {username}: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": CORS_HEADERS,
-            "body": json.dumps({"message": f"Error deleting user: {str(e)}"})
-        }
+        return 404, {"message": f"User {username} not found"}
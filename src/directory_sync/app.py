@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+import urllib.request
+from botocore.exceptions import ClientError
+from aws_clients import LazyClient
+from throttle import call_with_backoff
+import metrics
+from user_directory import ROLE_GROUPS, rebuild, role_from_groups, user_record
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+cognito = LazyClient("cognito-idp")
+USER_POOL_ID = os.environ["USER_POOL_ID"]
+
+
+def get_groups_by_user():
+    groups = {}
+    for group in ROLE_GROUPS:
+        token = None
+        while True:
+            kwargs = {"UserPoolId": USER_POOL_ID, "GroupName": group}
+            if token:
+                kwargs["NextToken"] = token
+            page = call_with_backoff(cognito.list_users_in_group, **kwargs)
+            for user in page["Users"]:
+                groups.setdefault(user["Username"], set()).add(group)
+            token = page.get("NextToken")
+            if not token:
+                break
+    return groups
+
+
+def send_cfn_response(event, context, status, data):
+    """Answer a CloudFormation custom resource request (what cfn-response does)."""
+    body = json.dumps({
+        "Status": status,
+        "Reason": f"See CloudWatch log stream {context.log_stream_name}",
+        "PhysicalResourceId": event.get("PhysicalResourceId") or "user-directory-backfill",
+        "StackId": event["StackId"],
+        "RequestId": event["RequestId"],
+        "LogicalResourceId": event["LogicalResourceId"],
+        "Data": data,
+    }).encode()
+    request = urllib.request.Request(
+        event["ResponseURL"], data=body, method="PUT", headers={"Content-Type": "", "Content-Length": str(len(body))}
+    )
+    with urllib.request.urlopen(request, timeout=10):
+        pass
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Rebuild the user directory index and role counts from Cognito.
+
+    Runs daily, and once at deploy time as the UserDirectoryBackfill custom
+    resource so the index is built before list_users reads from it. A failed
+    backfill is reported to CloudFormation as success, leaving the deploy
+    alone; until a rebuild succeeds list_users keeps reading Cognito.
+    """
+    if (event or {}).get("RequestType"):
+        result = {"status": "SKIPPED"}
+        if event["RequestType"] in ("Create", "Update"):
+            try:
+                result = sync()
+            except Exception as e:
+                # CloudFormation must hear back either way, or the stack hangs for an hour.
+                logger.error(f"Directory backfill failed: {str(e)}")
+                result = {"status": "ERROR", "details": str(e)}
+        send_cfn_response(event, context, "SUCCESS", {"Status": result["status"]})
+        return result
+    return sync()
+
+
+def sync():
+    try:
+        groups = get_groups_by_user()
+        records, token = [], None
+        while True:
+            kwargs = {"UserPoolId": USER_POOL_ID}
+            if token:
+                kwargs["PaginationToken"] = token
+            page = call_with_backoff(cognito.list_users, **kwargs)
+            for user in page["Users"]:
+                attributes = {a["Name"]: a["Value"] for a in user["Attributes"]}
+                role = role_from_groups(groups.get(user["Username"], ()))
+                records.append(user_record(user["Username"], attributes, role))
+            token = page.get("PaginationToken")
+            if not token:
+                break
+
+        result = rebuild(records)
+        logger.info(f"Directory index rebuilt: {result}")
+        return {"status": "SUCCESS", **result}
+
+    except ClientError as e:
+        logger.error(f"Directory sync failed: {str(e)}")
+        return {"status": "ERROR", "details": str(e)}
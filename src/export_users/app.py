@@ -0,0 +1,220 @@
+import os
+import csv
+import io
+import logging
+from datetime import datetime, timezone
+from api import ApiError, api_handler
+from aws_clients import LazyClient
+from chunked_job import continue_async, out_of_time
+from snapshot_io import SnapshotWriter
+from throttle import call_with_backoff
+import metrics
+import governor
+from user_directory import DEFAULT_ROLE, ROLE_GROUPS, ROLES, USER_FIELDS, user_record
+import jobs
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+cognito = LazyClient("cognito-idp")
+USER_POOL_ID = os.environ["USER_POOL_ID"]
+EXPORT_PREFIX = os.environ.get("EXPORT_PREFIX", "exports")
+# Progress is written to the job item every this many Cognito pages.
+EXPORT_PROGRESS_PAGES = int(os.environ.get("EXPORT_PROGRESS_PAGES", "50"))
+
+MAX_PAGE_SIZE = 60  # Cognito's own Limit cap for ListUsers / ListUsersInGroup
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+FILTER_FIELDS = ("role", "region", "city")
+# Spreadsheet apps run cells starting with these as formulas.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def parse_export(request):
+    body = request.json()
+    if not isinstance(body, dict):
+        raise ApiError(400, {"error": "Body must be a JSON object"})
+    export_format = (body.get("format") or request.query.get("format") or "csv").lower()
+    if export_format not in CONTENT_TYPES:
+        raise ApiError(400, {"error": f"'format' must be one of {', '.join(CONTENT_TYPES)}"})
+    filters = {f: body[f] for f in FILTER_FIELDS if body.get(f)}
+    if filters.get("role") and filters["role"] not in ROLES:
+        raise ApiError(400, {"error": f"'role' must be one of {', '.join(ROLES)}"})
+    return export_format, filters
+
+
+def get_users_in_group(group_name):
+    users, token = set(), None
+    while True:
+        kwargs = {"UserPoolId": USER_POOL_ID, "GroupName": group_name}
+        if token:
+            kwargs["NextToken"] = token
+        page = call_with_backoff(cognito.list_users_in_group, **kwargs)
+        users.update(u["Username"] for u in page["Users"])
+        token = page.get("NextToken")
+        if not token:
+            return users
+
+
+def resolve_role(username, members):
+    for group in ROLE_GROUPS:
+        if username in members[group]:
+            return group
+    return DEFAULT_ROLE
+
+
+def matches(record, filters):
+    return all(record[f] == v for f, v in filters.items())
+
+
+def get_page(filters, members, token):
+    """One Cognito page as (records, next_token).
+
+    A role group is listed straight from the group, so exporting officials
+    never walks the citizens. Region and city are custom attributes Cognito
+    cannot filter on, so they are applied to the page.
+    """
+    role = filters.get("role")
+    if role in ROLE_GROUPS:
+        kwargs = {"UserPoolId": USER_POOL_ID, "GroupName": role, "Limit": MAX_PAGE_SIZE}
+        if token:
+            kwargs["NextToken"] = token
+        page = call_with_backoff(cognito.list_users_in_group, **kwargs)
+        next_token = page.get("NextToken")
+    else:
+        kwargs = {"UserPoolId": USER_POOL_ID, "Limit": MAX_PAGE_SIZE}
+        if token:
+            kwargs["PaginationToken"] = token
+        page = call_with_backoff(cognito.list_users, **kwargs)
+        next_token = page.get("PaginationToken")
+
+    records = []
+    for user in page["Users"]:
+        attributes = {a["Name"]: a["Value"] for a in user["Attributes"]}
+        record = user_record(user["Username"], attributes, resolve_role(user["Username"], members))
+        if matches(record, filters):
+            records.append(record)
+    return records, next_token
+
+
+def csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows):
+    out = io.StringIO()
+    csv.writer(out).writerows(rows)
+    return out.getvalue().encode()
+
+
+def write_records(writer, export_format, records):
+    if export_format == "csv":
+        writer.write_lines(csv_lines([csv_cell(r[f]) for f in USER_FIELDS] for r in records), len(records))
+    else:
+        for record in records:
+            writer.write(record)
+
+
+def export_key(job):
+    return f"{EXPORT_PREFIX}/{job['job_id']}.{job['format']}"
+
+
+def start_export(job):
+    """Open the object for a job's first invocation and record the pool size."""
+    writer = SnapshotWriter(export_key(job), compression="none", content_type=CONTENT_TYPES[job["format"]])
+    if job["format"] == "csv":
+        writer.write_lines(csv_lines([USER_FIELDS]), records=0)
+    pool = call_with_backoff(cognito.describe_user_pool, UserPoolId=USER_POOL_ID)["UserPool"]
+    estimate = pool.get("EstimatedNumberOfUsers", 0)
+    jobs.update_job(job["job_id"], status=jobs.RUNNING, total=estimate, key=export_key(job))
+    return writer
+
+
+def run_export_job(job_id, context):
+    """Stream the pool into the job's object a page at a time.
+
+    Memory holds one page, the role group memberships and at most one
+    upload part. Before the invocation times out the upload is suspended
+    and the next invocation resumes it from the saved pagination token.
+    """
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] in jobs.FINISHED:
+        return {"status": "SKIPPED", "job_id": job_id}
+
+    filters = job.get("filters") or {}
+    token = job.get("next_token")
+    writer = None
+
+    try:
+        content_type = CONTENT_TYPES[job["format"]]
+        if job.get("upload"):
+            writer = SnapshotWriter.resume(export_key(job), job["upload"], content_type=content_type)
+        else:
+            writer = start_export(job)
+        members = {g: get_users_in_group(g) for g in ROLE_GROUPS}
+        pages = 0
+        while True:
+            if out_of_time(context):
+                jobs.update_job(job_id, upload=writer.suspend(), next_token=token, processed=writer.records)
+                continue_async(context, {"job": job_id})
+                return {"status": "IN_PROGRESS", "job_id": job_id, "processed": writer.records}
+
+            records, token = get_page(filters, members, token)
+            write_records(writer, job["format"], records)
+            metrics.count("UsersExported", len(records))
+            pages += 1
+            if not token:
+                break
+            if pages % EXPORT_PROGRESS_PAGES == 0:
+                jobs.update_job(job_id, processed=writer.records)
+                logger.info(f"Export job {job_id}: {writer.records} users written")
+
+        entry = writer.close()
+    except Exception as e:
+        logger.error(f"Export job {job_id} failed: {str(e)}")
+        if writer is not None:
+            try:
+                writer.abort()
+            except Exception as abort_error:
+                logger.warning(f"Could not abort the upload of export job {job_id}: {abort_error}")
+        jobs.fail_job(job_id, e)
+        return {"status": "FAILED", "job_id": job_id}
+
+    jobs.update_job(job_id, processed=entry["records"], bytes=entry["bytes"], upload=None, next_token=None)
+    jobs.finish_job(job_id, 0)
+    logger.info(f"✅ Export job {job_id}: {entry['records']} users, {entry['bytes']} bytes")
+    return {"status": "SUCCESS", "job_id": job_id}
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """POST /users/export: start an export of the user directory.
+
+    The body may set "format" ("csv" or "ndjson") and role / region / city
+    filters. The export runs as a background job; GET /jobs/{jobId} reports
+    its progress and, once it has finished, a presigned download URL.
+    """
+    if "job" in event:
+        with governor.priority(governor.BATCH):
+            return run_export_job(event["job"], context)
+
+    return export_request(event, context)
+
+
+@api_handler(methods="OPTIONS,POST")
+def export_request(request, context):
+    export_format, filters = parse_export(request)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    job_id = jobs.create_job(
+        "export",
+        0,
+        format=export_format,
+        filters=filters,
+        file_name=f"users-{stamp}.{export_format}",
+    )
+    continue_async(context, {"job": job_id})
+    logger.info(f"Queued {export_format} export {job_id} with filters {filters}")
+    return 202, {"jobId": job_id, "statusUrl": f"/jobs/{job_id}", "format": export_format}
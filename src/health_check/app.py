@@ -1,53 +1,201 @@
-import boto3
 import os
-import json
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from botocore.exceptions import ClientError
+from aws_clients import LazyClient, table
+from backup_store import STATE_KEY
+import governor
+import metrics
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # AWS clients
-cognito = boto3.client("cognito-idp")
-sns = boto3.client("sns")
+cognito = LazyClient("cognito-idp")
+sns = LazyClient("sns")
 
 # Environment variables
 USER_POOL_ID = os.environ["USER_POOL_ID"]
 SNS_TOPIC_ARN = os.environ["ALERT_TOPIC_ARN"]
+BACKUP_TABLE = os.environ.get("BACKUP_TABLE")
+OPS_STATE_TABLE = os.environ.get("OPS_STATE_TABLE")
+
+# Latency budget per probe; a slower answer counts as a failed probe.
+LATENCY_THRESHOLDS_MS = {
+    "describe_user_pool": float(os.environ.get("HEALTH_DESCRIBE_POOL_MAX_MS", "1000")),
+    "list_users": float(os.environ.get("HEALTH_LIST_USERS_MAX_MS", "1500")),
+    "backup_table": float(os.environ.get("HEALTH_BACKUP_READ_MAX_MS", "500")),
+}
+# The backup runs hourly; a newest snapshot older than this means it is stuck.
+BACKUP_MAX_AGE_HOURS = float(os.environ.get("HEALTH_BACKUP_MAX_AGE_HOURS", "3"))
+# Alert only after this many failing runs in a row, then at most once per cooldown.
+FAILURE_THRESHOLD = int(os.environ.get("HEALTH_FAILURE_THRESHOLD", "2"))
+ALERT_COOLDOWN_SECONDS = int(os.environ.get("HEALTH_ALERT_COOLDOWN_MINUTES", "360")) * 60
+
+ALERT_STATE_KEY = {"pk": f"HEALTH#{USER_POOL_ID}"}
+
+
+def probe_describe_user_pool():
+    response = cognito.describe_user_pool(UserPoolId=USER_POOL_ID)
+    if not response.get("UserPool"):
+        raise RuntimeError("User pool not found or inaccessible")
+
+
+def probe_list_users():
+    cognito.list_users(UserPoolId=USER_POOL_ID, Limit=1)
+
+
+def probe_backup_table():
+    table(BACKUP_TABLE).get_item(Key=STATE_KEY, ProjectionExpression="userId")
 
-def lambda_handler(event, context):
-    logger.info(f"Health check started at {datetime.now(timezone.utc).isoformat()}")
 
+def probe_backup_freshness():
+    state = table(BACKUP_TABLE).get_item(Key=STATE_KEY, ProjectionExpression="high_water_mark").get("Item")
+    if not state or not state.get("high_water_mark"):
+        raise RuntimeError("No completed backup found")
+    newest = datetime.strptime(state["high_water_mark"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    age_hours = (datetime.now(timezone.utc) - newest).total_seconds() / 3600
+    metrics.count("BackupAge", round(age_hours * 3600), unit="Seconds")
+    if age_hours > BACKUP_MAX_AGE_HOURS:
+        raise RuntimeError(f"Newest backup {state['high_water_mark']} is {age_hours:.1f}h old")
+
+
+PROBES = {
+    "describe_user_pool": probe_describe_user_pool,
+    "list_users": probe_list_users,
+    "backup_table": probe_backup_table,
+    "backup_freshness": probe_backup_freshness,
+}
+
+
+def run_probe(name):
+    # Time the service, not the quota: a wait for governor tokens is
+    # contention between our own functions, not a slow Cognito.
+    started, waited = time.perf_counter(), governor.wait_seconds()
     try:
-        response = cognito.describe_user_pool(UserPoolId=USER_POOL_ID)
-        user_pool = response.get("UserPool")
+        PROBES[name]()
+        error = None
+    except Exception as e:
+        error = str(e)
+    elapsed = time.perf_counter() - started - (governor.wait_seconds() - waited)
+    latency_ms = round(max(elapsed, 0.0) * 1000, 1)
+    threshold = LATENCY_THRESHOLDS_MS.get(name)
+    if error is None and threshold is not None and latency_ms > threshold:
+        error = f"{latency_ms:.0f} ms exceeds the {threshold:.0f} ms threshold"
+
+    metrics.observe("ProbeLatency", latency_ms, Probe=name)
+    if error:
+        metrics.count("ProbeFailures", Probe=name)
+    return {"probe": name, "healthy": error is None, "latency_ms": latency_ms, "error": error}
+
+
+def run_probes():
+    with ThreadPoolExecutor(max_workers=len(PROBES)) as pool:
+        return list(pool.map(run_probe, PROBES))
+
 
-        if not user_pool:
-            message = f"⚠️ Cognito User Pool {USER_POOL_ID} not found or inaccessible."
-            publish_alert(message)
-            return {"status": "ALERT", "details": message}
+def load_alert_state():
+    item = table(OPS_STATE_TABLE).get_item(Key=ALERT_STATE_KEY, ConsistentRead=True).get("Item") or {}
+    return {
+        "consecutive_failures": int(item.get("consecutive_failures", 0)),
+        "alerting": bool(item.get("alerting", False)),
+        "last_alert_at": int(item.get("last_alert_at", 0)),
+        "failing_since": item.get("failing_since"),
+    }
 
+
+def save_alert_state(state):
+    table(OPS_STATE_TABLE).put_item(Item={**ALERT_STATE_KEY, **state})
+
+
+def next_alert(state, failures, now):
+    """Advance the alert state for this run's failures; return the notice to send, if any.
+
+    One incident produces one alert: it opens after FAILURE_THRESHOLD
+    failing runs in a row, repeats at most once per cooldown while it lasts,
+    and is closed by a single recovery notice.
+    """
+    if not failures:
+        notice = "recovered" if state["alerting"] else None
+        state.update(consecutive_failures=0, alerting=False, failing_since=None)
+        return notice
+
+    state["consecutive_failures"] += 1
+    state["failing_since"] = state["failing_since"] or datetime.now(timezone.utc).isoformat()
+    if state["consecutive_failures"] < FAILURE_THRESHOLD:
+        return None
+    if state["alerting"] and now - state["last_alert_at"] < ALERT_COOLDOWN_SECONDS:
+        return None
+    notice = "reminder" if state["alerting"] else "alert"
+    state.update(alerting=True, last_alert_at=now)
+    return notice
+
+
+def describe(results):
+    return "\n".join(
+        f"{'✅' if r['healthy'] else '❌'} {r['probe']}: {r['latency_ms']} ms"
+        + (f" - {r['error']}" if r["error"] else "")
+        for r in results
+    )
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    logger.info(f"Health check started at {datetime.now(timezone.utc).isoformat()}")
+
+    results = run_probes()
+    failures = [r for r in results if not r["healthy"]]
+    details = describe(results)
+    if failures:
+        logger.error(f"Health check failed for Cognito User Pool {USER_POOL_ID}:\n{details}")
+    else:
         logger.info("✅ Cognito User Pool is healthy")
-        return {"status": "HEALTHY", "details": f"User pool {USER_POOL_ID} is accessible"}
 
-    except ClientError as e:
-        error_message = (
-            f"❌ Health check failed for Cognito User Pool {USER_POOL_ID}. "
-            f"Error: {str(e)}"
+    try:
+        state = load_alert_state()
+    except Exception as e:
+        # Without the alert state every failing run alerts rather than none.
+        logger.error(f"Alert state unavailable: {str(e)}")
+        notice = "alert" if failures else None
+        if notice:
+            publish_alert(f"❌ Health check failed for Cognito User Pool {USER_POOL_ID}.\n\n{details}")
+        return {"status": "UNHEALTHY" if failures else "HEALTHY", "notice": notice, "probes": results}
+
+    previous = dict(state)
+    notice = next_alert(state, failures, int(time.time()))
+    if notice == "recovered":
+        sent = publish_alert(f"✅ Cognito User Pool {USER_POOL_ID} has recovered.\n\n{details}", recovered=True)
+    elif notice:
+        sent = publish_alert(
+            f"❌ Cognito User Pool {USER_POOL_ID} is unhealthy since {state['failing_since']} "
+            f"({state['consecutive_failures']} failing checks in a row).\n\n{details}"
         )
-        logger.error(error_message)
-        publish_alert(error_message)
-        return {"status": "ERROR", "details": error_message}
+    if notice and not sent:
+        # Leave the incident as it was so the next run tries the notice again.
+        state.update(alerting=previous["alerting"], last_alert_at=previous["last_alert_at"])
+    try:
+        save_alert_state(state)
+    except Exception as e:
+        logger.error(f"Could not save alert state: {str(e)}")
+
+    return {
+        "status": "UNHEALTHY" if failures else "HEALTHY",
+        "notice": notice,
+        "probes": results,
+    }
+
 
-def publish_alert(message: str):
+def publish_alert(message: str, recovered=False):
     try:
         sns.publish(
             TopicArn=SNS_TOPIC_ARN,
-            Subject=f"[ALERT] Cognito User Pool {USER_POOL_ID} Health Issue",
+            Subject=f"[{'RESOLVED' if recovered else 'ALERT'}] Cognito User Pool {USER_POOL_ID} Health Issue",
             Message=message,
         )
         logger.info("SNS alert sent successfully")
+        return True
     except Exception as e:
         logger.error(f"Failed to send SNS alert: {str(e)}")
+        return False
@@ -0,0 +1,35 @@
+import os
+import logging
+from api import api_handler
+import metrics
+from snapshot_io import presigned_url
+import jobs
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Internal bookkeeping that callers have no use for.
+HIDDEN_FIELDS = {"pk", "ttl", "result_slices", "key", "upload", "next_token"}
+EXPORT_URL_TTL_SECONDS = int(os.environ.get("EXPORT_URL_TTL_SECONDS", "3600"))
+
+
+@metrics.metered
+@api_handler(methods="OPTIONS,GET")
+def lambda_handler(request, context):
+    """GET /jobs/{jobId}: progress of a background job, with per-row results once finished.
+
+    A finished export also gets a presigned download URL for its file.
+    """
+    job_id = request.path_params.get("jobId")
+    job = jobs.get_job(job_id) if job_id else None
+    if job is None:
+        return 404, {"message": f"Job {job_id} not found"}
+
+    body = {k: v for k, v in job.items() if k not in HIDDEN_FIELDS}
+    if job["status"] in jobs.FINISHED:
+        body["results"] = jobs.job_results(job_id, job.get("result_slices", 0))
+    if job["status"] == jobs.SUCCEEDED and job.get("type") == "export":
+        body["downloadUrl"] = presigned_url(job["key"], EXPORT_URL_TTL_SECONDS, file_name=job.get("file_name"))
+        body["downloadExpiresIn"] = EXPORT_URL_TTL_SECONDS
+
+    return 200, body
@@ -0,0 +1,131 @@
+import os
+import gzip
+import json
+import base64
+import logging
+import functools
+from decimal import Decimal
+from auth_utils import is_admin
+from cors import cors_headers
+
+try:
+    import orjson
+except ImportError:  # optional faster backend; the standard library is the fallback
+    orjson = None
+
+logger = logging.getLogger()
+
+# Bodies at least this large are gzipped for clients that accept it; 0 turns
+# compression off. REST API stages only pass the compressed bytes through when
+# the response's media type is listed in BinaryMediaTypes.
+API_GZIP_MIN_BYTES = int(os.environ.get("API_GZIP_MIN_BYTES", "0"))
+
+
+class ApiError(Exception):
+    """Raise from a handler to answer with `status` and a JSON `body`."""
+
+    def __init__(self, status, body):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=_default).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(value):
+        return json.dumps(value, default=_default)
+
+    loads = json.loads
+
+
+class Request:
+    """One API Gateway proxy event, with headers normalised and the body parsed once."""
+
+    def __init__(self, event):
+        self.event = event
+        self.headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+        self.origin = self.headers.get("origin")
+        self.query = event.get("queryStringParameters") or {}
+        self.path_params = event.get("pathParameters") or {}
+        self._json = None
+
+    @functools.cached_property
+    def raw_body(self):
+        body = self.event.get("body") or ""
+        if self.event.get("isBase64Encoded"):
+            body = base64.b64decode(body).decode("utf-8")
+        return body
+
+    def json(self, default=None):
+        """The body parsed as JSON; a malformed body answers 400."""
+        if self._json is None:
+            if not self.raw_body:
+                return {} if default is None else default
+            try:
+                self._json = loads(self.raw_body)
+            except ValueError:
+                raise ApiError(400, {"message": "Request body is not valid JSON"})
+        return self._json
+
+
+def respond(request, methods, status, body):
+    headers = cors_headers(request.origin, methods)
+    headers["Content-Type"] = "application/json"
+    payload = dumps(body)
+    if (
+        API_GZIP_MIN_BYTES
+        and len(payload) >= API_GZIP_MIN_BYTES
+        and "gzip" in request.headers.get("accept-encoding", "")
+    ):
+        headers["Content-Encoding"] = "gzip"
+        return {
+            "statusCode": status,
+            "headers": headers,
+            "body": base64.b64encode(gzip.compress(payload.encode(), compresslevel=5)).decode(),
+            "isBase64Encoded": True,
+        }
+    return {"statusCode": status, "headers": headers, "body": payload}
+
+
+def api_handler(methods, admin_only=True):
+    """Wrap `fn(request, context) -> (status, body)` as an API Gateway proxy handler.
+
+    Every response gets its own CORS headers, echoing the origin only when it
+    is on the shared allow-list. Admin-only routes answer 403 before the
+    handler runs. ApiError becomes its status and body. Any other exception
+    is logged with its traceback and answered with a generic 500 carrying the
+    request id, so internal error text never reaches the client.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def handler(event, context):
+            request = Request(event)
+            if admin_only and not is_admin(event):
+                logger.warning("Unauthorized access attempt by non-admin user")
+                return respond(request, methods, 403, {"message": "Forbidden: Admins only"})
+            try:
+                status, body = fn(request, context)
+            except ApiError as e:
+                status, body = e.status, e.body
+            except Exception:
+                logger.exception(f"Unhandled error in {fn.__name__}")
+                status, body = 500, {"error": "Internal server error",
+                                     "requestId": getattr(context, "aws_request_id", None)}
+            return respond(request, methods, status, body)
+
+        return handler
+
+    return decorate
@@ -1,33 +1,194 @@
+import os
+import time
+import hmac
 import logging
 import json
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 
 logger = logging.getLogger()
 
+USER_POOL_ID = os.environ.get("USER_POOL_ID", "")
+USER_POOL_CLIENT_IDS = {c for c in os.environ.get("USER_POOL_CLIENT_ID", "").split(",") if c}
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", "256"))
+JWT_LEEWAY_SECONDS = int(os.environ.get("JWT_LEEWAY_SECONDS", "30"))
+# An unknown kid triggers a JWKS refetch at most this often, so garbage
+# tokens cannot turn every request into an outbound call.
+JWKS_REFRESH_INTERVAL_SECONDS = int(os.environ.get("JWKS_REFRESH_INTERVAL_SECONDS", "60"))
+
+# DER prefix of the DigestInfo for SHA-256 in an RSASSA-PKCS1-v1_5 signature.
+SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+
+
+class InvalidToken(Exception):
+    pass
+
+
 def base64url_decode(data: str) -> bytes:
     # Add padding if necessary
     padding = '=' * (-len(data) % 4)
     return base64.urlsafe_b64decode(data + padding)
 
-def is_admin(event):
+
+def _b64_int(data):
+    return int.from_bytes(base64url_decode(data), "big")
+
+
+def rs256_verify(message: bytes, signature: bytes, n: int, e: int) -> bool:
+    """Check an RSASSA-PKCS1-v1_5 SHA-256 signature with the public key (n, e)."""
+    size = (n.bit_length() + 7) // 8
+    if len(signature) != size:
+        return False
+    encoded = pow(int.from_bytes(signature, "big"), e, n).to_bytes(size, "big")
+    digest = SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    expected = b"\x00\x01" + b"\xff" * (size - len(digest) - 3) + b"\x00" + digest
+    return hmac.compare_digest(encoded, expected)
+
+
+def fetch_jwks(url):
+    import urllib.request
+
+    with urllib.request.urlopen(url, timeout=3) as response:
+        return json.loads(response.read())
+
+
+class TokenVerifier:
+    """Verify Cognito-issued RS256 JWTs.
+
+    The pool's JWKS is fetched once and refetched only when a token names a
+    kid it does not hold. Verified claims are kept in a bounded LRU keyed by
+    the token's hash until the token expires, so repeat calls from the same
+    session skip both parsing and the signature check.
+    """
+
+    def __init__(self, issuer, client_ids=(), jwks_loader=None, cache_size=JWT_CACHE_SIZE):
+        self.issuer = issuer
+        self.client_ids = set(client_ids)
+        self.jwks_loader = jwks_loader or (lambda: fetch_jwks(f"{issuer}/.well-known/jwks.json"))
+        self.cache_size = cache_size
+        self.keys = {}
+        self.keys_loaded_at = None
+        self.verified = OrderedDict()
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def _key(self, kid):
+        with self.lock:
+            if kid in self.keys:
+                return self.keys[kid]
+        # The JWKS fetch runs under its own lock, not the cache lock, so a
+        # slow fetch only holds up other tokens with an unknown kid.
+        with self.refresh_lock:
+            with self.lock:
+                stale = kid not in self.keys and (
+                    self.keys_loaded_at is None
+                    or time.monotonic() - self.keys_loaded_at >= JWKS_REFRESH_INTERVAL_SECONDS
+                )
+            if stale:
+                jwks = self.jwks_loader()
+                keys = {
+                    k["kid"]: (_b64_int(k["n"]), _b64_int(k["e"]))
+                    for k in jwks.get("keys", [])
+                    if k.get("kty") == "RSA"
+                }
+                with self.lock:
+                    self.keys = keys
+                    self.keys_loaded_at = time.monotonic()
+        with self.lock:
+            if kid not in self.keys:
+                raise InvalidToken(f"Unknown signing key {kid}")
+            return self.keys[kid]
+
+    def _check_claims(self, claims, now):
+        if claims.get("iss") != self.issuer:
+            raise InvalidToken("Wrong issuer")
+        if claims.get("exp", 0) + JWT_LEEWAY_SECONDS < now:
+            raise InvalidToken("Token expired")
+        token_use = claims.get("token_use")
+        if token_use == "id":
+            audience = claims.get("aud")
+        elif token_use == "access":
+            audience = claims.get("client_id")
+        else:
+            raise InvalidToken(f"Unexpected token_use {token_use}")
+        if self.client_ids and audience not in self.client_ids:
+            raise InvalidToken("Token issued for another client")
+
+    def verify(self, token):
+        """Return the token's claims, raising InvalidToken if it does not check out."""
+        now = time.time()
+        cache_key = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            cached = self.verified.get(cache_key)
+            if cached is not None:
+                if cached["exp"] + JWT_LEEWAY_SECONDS >= now:
+                    self.verified.move_to_end(cache_key)
+                    return cached
+                del self.verified[cache_key]
+
+        try:
+            header_b64, payload_b64, signature_b64 = token.split(".")
+            header = json.loads(base64url_decode(header_b64))
+            claims = json.loads(base64url_decode(payload_b64))
+            signature = base64url_decode(signature_b64)
+        except ValueError as e:
+            raise InvalidToken(f"Malformed token: {e}")
+        if header.get("alg") != "RS256":
+            raise InvalidToken(f"Unsupported alg {header.get('alg')}")
+
+        n, e = self._key(header.get("kid"))
+        if not rs256_verify(f"{header_b64}.{payload_b64}".encode(), signature, n, e):
+            raise InvalidToken("Bad signature")
+        self._check_claims(claims, now)
+
+        with self.lock:
+            self.verified[cache_key] = claims
+            if len(self.verified) > self.cache_size:
+                self.verified.popitem(last=False)
+        return claims
+
+
+_verifier = None
+
+
+def get_verifier():
+    global _verifier
+    if _verifier is None:
+        region = USER_POOL_ID.split("_")[0] or os.environ.get("AWS_REGION")
+        _verifier = TokenVerifier(
+            f"https://cognito-idp.{region}.amazonaws.com/{USER_POOL_ID}",
+            USER_POOL_CLIENT_IDS,
+        )
+    return _verifier
+
+
+def get_claims(event):
+    """Verified claims of the request's bearer token, or None."""
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    auth_header = headers.get("authorization")
+
+    if not auth_header:
+        logger.warning("No Authorization header found")
+        return None
+
+    # Get the token from the header
+    token = auth_header.split(" ")[-1]
     try:
-        headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
-        auth_header = headers.get("authorization")
+        return get_verifier().verify(token)
+    except InvalidToken as e:
+        logger.warning(f"Rejected token: {e}")
+        return None
 
-        if not auth_header:
-            logger.warning("No Authorization header found")
-            return False
 
-        # Get the token from the header
-        token = auth_header.split(" ")[-1]
-        parts = token.split(".")
+def is_admin(event):
+    try:
+        claims = get_claims(event)
+        if claims is None:
+            return False
 
-        # Decode the payload (second part of JWT)
-        payload_bytes = base64url_decode(parts[1])
-        payload = json.loads(payload_bytes.decode("utf-8"))
-        
-        groups = payload.get("cognito:groups", "")
-        logger.warning(f"User groups from token: {groups}")
+        groups = claims.get("cognito:groups", "")
         if isinstance(groups, str):
             groups = groups.split(",")
         return "Admin" in groups
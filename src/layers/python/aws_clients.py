@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+import metrics
+
+# boto3 is imported on first use rather than at module load, so handler paths
+# that never reach AWS (403s, validation errors) don't pay for it on a cold start.
+
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT_SECONDS", "2"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT_SECONDS", "10"))
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+AWS_RETRY_ATTEMPTS = int(os.environ.get("AWS_RETRY_ATTEMPTS", "3"))
+# Calls to these services are retried by throttle.call_with_backoff, one
+# rate-limited and governed attempt at a time; botocore retrying underneath
+# would multiply every throttle into attempts no budget accounts for.
+OUTER_RETRY_SERVICES = {"cognito-idp"}
+
+_clients = {}
+_resources = {}
+_tables = {}
+_lock = threading.Lock()
+
+
+def client_config(service=None):
+    from botocore.config import Config
+
+    if service in OUTER_RETRY_SERVICES:
+        retries = {"mode": "standard", "total_max_attempts": 1}
+    else:
+        retries = {"mode": AWS_RETRY_MODE, "max_attempts": AWS_RETRY_ATTEMPTS}
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=AWS_READ_TIMEOUT,
+        retries=retries,
+        tcp_keepalive=True,
+    )
+
+
+def _dimensions(model):
+    return {"Service": model.service_model.service_name, "Operation": model.name}
+
+
+def _before_call(model, context, **kwargs):
+    context["metrics_dimensions"] = _dimensions(model)
+    context["metrics_started"] = time.perf_counter()
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    dimensions = _dimensions(model)
+    started = context.get("metrics_started")
+    if started is not None:
+        metrics.observe("Latency", (time.perf_counter() - started) * 1000, **dimensions)
+    metrics.count("Calls", **dimensions)
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        metrics.count("Retries", retries, **dimensions)
+    if http_response.status_code >= 300:
+        metrics.count("Errors", **dimensions)
+
+
+def _after_call_error(context, **kwargs):
+    """Connection errors and timeouts that never produced a response."""
+    dimensions = context.get("metrics_dimensions")
+    if dimensions is not None:
+        metrics.count("Calls", **dimensions)
+        metrics.count("Errors", **dimensions)
+
+
+def _needs_retry(operation, response=None, **kwargs):
+    """Runs once per attempt, so throttles that botocore retried away are counted too."""
+    from throttle import THROTTLE_ERROR_CODES
+
+    if response is not None and response[1].get("Error", {}).get("Code") in THROTTLE_ERROR_CODES:
+        metrics.count("Throttles", **_dimensions(operation))
+
+
+def _govern(model, params, **kwargs):
+    """Hold Cognito calls to the pool's shared quota (layer governor.py)."""
+    import governor
+
+    governor.acquire(params.get("UserPoolId"), model.name)
+
+
+def instrument(api_client):
+    """Record latency, calls, retries, throttles and errors for every call the client makes.
+
+    Cognito clients also wait for the quota governor first, outside the
+    measured latency.
+    """
+    events = api_client.meta.events
+    if api_client.meta.service_model.service_name == "cognito-idp":
+        events.register("before-parameter-build", _govern)
+    if metrics.METRICS_ENABLED:
+        events.register("before-call", _before_call)
+        events.register("after-call", _after_call)
+        events.register("after-call-error", _after_call_error)
+        events.register("needs-retry", _needs_retry)
+    return api_client
+
+
+def client(service, endpoint_url=None, region_name=None):
+    """Process-wide boto3 client for a service, created on first use."""
+    key = (service, endpoint_url) if region_name is None else (service, endpoint_url, region_name)
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                import boto3
+
+                _clients[key] = instrument(boto3.client(
+                    service, endpoint_url=endpoint_url, region_name=region_name, config=client_config(service)
+                ))
+    return _clients[key]
+
+
+def cognito_for(user_pool_id):
+    """Cognito client for the region a user pool lives in; pool ids start with it."""
+    region = user_pool_id.split("_", 1)[0]
+    if region == os.environ.get("AWS_REGION", region):
+        return client("cognito-idp")
+    return client("cognito-idp", region_name=region)
+
+
+def resource(service, endpoint_url=None):
+    key = (service, endpoint_url)
+    if key not in _resources:
+        with _lock:
+            if key not in _resources:
+                import boto3
+
+                _resources[key] = boto3.resource(service, endpoint_url=endpoint_url, config=client_config())
+                instrument(_resources[key].meta.client)
+    return _resources[key]
+
+
+def table(name):
+    """DynamoDB Table handle, shared by every caller in the process."""
+    if name not in _tables:
+        _tables[name] = resource("dynamodb").Table(name)
+    return _tables[name]
+
+
+class LazyClient:
+    """Module-level stand-in for a client that is only built when first used.
+
+    `cognito = LazyClient("cognito-idp")` keeps call sites such as
+    `cognito.list_users(...)` and `cognito.exceptions.UserNotFoundException`
+    unchanged while deferring the boto3 import and client construction.
+    """
+
+    def __init__(self, service, endpoint_url=None):
+        self._service = service
+        self._endpoint_url = endpoint_url
+
+    def __getattr__(self, name):
+        return getattr(client(self._service, self._endpoint_url), name)
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timezone
+from aws_clients import table
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+BACKUP_TABLE = os.environ.get("BACKUP_TABLE")
+BACKUP_RETENTION_DAYS = int(os.environ.get("BACKUP_RETENTION_DAYS", "35"))
+
+# Snapshots are keyed userId + backupDate, so every run's copy of a user lives
+# beside the older ones until its ttl expires. Bookkeeping items share the
+# table under userIds starting with RESERVED_PREFIX. Cognito usernames may
+# start with it too, so user_key stores such a home pool user under the
+# "<pool id>#<username>" form other pools use, never the bare username.
+RESERVED_PREFIX = "__"
+STATE_USER_ID = "__backup_state__"
+STATE_KEY = {"userId": STATE_USER_ID, "backupDate": "STATE"}
+FINGERPRINT_SHARDS = 64
+# One in-flight checkpoint per job type ("backup", "restore") and pool.
+CHECKPOINT_SORT_KEY = "CHECKPOINT"
+# A chunk that hands off keeps its run leased this long, so only the resume
+# event it sent can pick the run up until the next chunk has claimed it.
+HANDOFF_GRACE_SECONDS = int(os.environ.get("HANDOFF_GRACE_SECONDS", "300"))
+
+# Backup and restore runs cover the function's own pool and any listed in
+# BACKUP_POOL_IDS (comma separated). The home pool keeps the unprefixed keys
+# it always had; every other pool's snapshots are keyed "<pool id>#<username>"
+# and its bookkeeping items get a "#<pool id>" suffix, so pools never share
+# fingerprints, checkpoints or snapshots.
+HOME_POOL_ID = os.environ.get("USER_POOL_ID")
+POOL_IDS = list(dict.fromkeys(
+    p.strip() for p in [HOME_POOL_ID or "", *os.environ.get("BACKUP_POOL_IDS", "").split(",")] if p.strip()
+))
+# Usernames may contain "#" (john_doe#1@example.com), so a key prefix counts
+# as a pool only if it is a configured pool or has the "<region>_<id>" shape
+# of a real pool id. The latter keeps snapshots of a pool since dropped from
+# BACKUP_POOL_IDS out of the home pool's restores.
+REGION_POOL_ID_PATTERN = re.compile(r"^[a-z]{2}(-[a-z]+)+-\d+_[0-9a-zA-Z]+$")
+
+def backup_table():
+    return table(BACKUP_TABLE)
+
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def is_reserved(user_id):
+    return user_id.startswith(RESERVED_PREFIX)
+
+
+def is_home(pool_id):
+    return pool_id is None or pool_id == HOME_POOL_ID
+
+
+def select_pools(requested=None):
+    """The pools a run covers: all configured ones, or the requested subset of them."""
+    if not requested:
+        return list(POOL_IDS)
+    unknown = [p for p in requested if p not in POOL_IDS]
+    if unknown:
+        raise ValueError(f"Pools not configured for backup: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested))
+
+
+def user_key(username, pool_id=None):
+    if is_home(pool_id) and not is_reserved(username):
+        return username
+    return f"{pool_id or HOME_POOL_ID}#{username}"
+
+
+def split_user_key(user_id):
+    """Return (pool_id, username) for a snapshot's userId."""
+    pool_id, separator, username = user_id.partition("#")
+    if separator and pool_id == HOME_POOL_ID and is_reserved(username):
+        return pool_id, username
+    if separator and pool_id != HOME_POOL_ID and (pool_id in POOL_IDS or REGION_POOL_ID_PATTERN.match(pool_id)):
+        return pool_id, username
+    return HOME_POOL_ID, user_id
+
+
+def _state_user_id(job_type, pool_id=None):
+    return f"__{job_type}_state__" + ("" if is_home(pool_id) else f"#{pool_id}")
+
+
+def fingerprint(item):
+    """Stable hash of everything a restore would need to reproduce the user."""
+    material = {
+        "attributes": item.get("attributes", {}),
+        "groups": sorted(item.get("groups", [])),
+        "enabled": item.get("enabled"),
+        "user_status": item.get("user_status"),
+        "last_modified": item.get("last_modified"),
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def shard_of(username):
+    return int(hashlib.sha1(username.encode()).hexdigest()[:8], 16) % FINGERPRINT_SHARDS
+
+
+def _shard_key(shard, pool_id=None):
+    return {"userId": _state_user_id("backup", pool_id), "backupDate": f"FP#{shard:02d}"}
+
+
+def _query_state(prefix, pool_id=None):
+    from boto3.dynamodb.conditions import Key
+
+    kwargs = {
+        "KeyConditionExpression": (
+            Key("userId").eq(_state_user_id("backup", pool_id)) & Key("backupDate").begins_with(prefix)
+        ),
+        "ConsistentRead": True,
+    }
+    while True:
+        response = backup_table().query(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _state_key(pool_id=None):
+    return {"userId": _state_user_id("backup", pool_id), "backupDate": STATE_KEY["backupDate"]}
+
+
+def load_state(pool_id=None):
+    """Return (state, fingerprints) from the pool's last completed run, empty if none."""
+    state = backup_table().get_item(Key=_state_key(pool_id), ConsistentRead=True).get("Item", {})
+    fingerprints = {}
+    for item in _query_state("FP#", pool_id):
+        fingerprints.update(item.get("fingerprints", {}))
+    return state, fingerprints
+
+
+def save_state(state, fingerprints, shards=None, pool_id=None):
+    """Persist the run state and the fingerprint shards (only `shards` if given)."""
+    by_shard = {shard: {} for shard in range(FINGERPRINT_SHARDS)}
+    for username, fp in fingerprints.items():
+        by_shard[shard_of(username)][username] = fp
+
+    with backup_table().batch_writer(overwrite_by_pkeys=["userId", "backupDate"]) as batch:
+        for shard, members in by_shard.items():
+            if shards is None or shard in shards:
+                batch.put_item(Item={**_shard_key(shard, pool_id), "fingerprints": members})
+        batch.put_item(Item={**state, **_state_key(pool_id)})
+
+
+def save_pending_fingerprints(job_id, page, fingerprints, pool_id=None):
+    """Record the fingerprints seen by one page of an unfinished backup job."""
+    backup_table().put_item(Item={
+        "userId": _state_user_id("backup", pool_id),
+        "backupDate": f"PENDING#{job_id}#{page:06d}",
+        "fingerprints": fingerprints,
+    })
+
+
+def load_pending_fingerprints(job_id, pool_id=None):
+    fingerprints, keys = {}, []
+    for item in _query_state(f"PENDING#{job_id}#", pool_id):
+        fingerprints.update(item.get("fingerprints", {}))
+        keys.append({"userId": item["userId"], "backupDate": item["backupDate"]})
+    return fingerprints, keys
+
+
+def delete_items(keys):
+    with backup_table().batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+
+
+def _checkpoint_key(job_type, pool_id=None):
+    return {"userId": _state_user_id(job_type, pool_id), "backupDate": CHECKPOINT_SORT_KEY}
+
+
+def load_checkpoint(job_type, pool_id=None):
+    return backup_table().get_item(Key=_checkpoint_key(job_type, pool_id), ConsistentRead=True).get("Item")
+
+
+def _condition_failed(error):
+    return error.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+def save_checkpoint(job_type, checkpoint, pool_id=None, only_if_new=False):
+    """Write the checkpoint; with only_if_new, return False instead if one already exists."""
+    kwargs = {"ConditionExpression": "attribute_not_exists(userId)"} if only_if_new else {}
+    try:
+        backup_table().put_item(Item={**checkpoint, **_checkpoint_key(job_type, pool_id)}, **kwargs)
+    except ClientError as e:
+        if not only_if_new or not _condition_failed(e):
+            raise
+        return False
+    return True
+
+
+def claim_run(job_type, lease, token=None):
+    """Take a run's checkpoint for one chunk; return its new resume token, or None if it is held.
+
+    A run is free once its lease has lapsed. Until then only the holder of
+    the token from the latest handoff may take it, and taking it rotates the
+    token, so a duplicated or replayed resume event is turned away.
+    """
+    fresh = uuid.uuid4().hex
+    try:
+        backup_table().update_item(
+            Key=_checkpoint_key(job_type),
+            UpdateExpression="SET lease_until = :lease, resume_token = :fresh",
+            ConditionExpression=(
+                "attribute_exists(userId) AND "
+                "(attribute_not_exists(lease_until) OR lease_until < :now OR resume_token = :token)"
+            ),
+            ExpressionAttributeValues={":lease": lease, ":fresh": fresh, ":now": int(time.time()), ":token": token or "-"},
+        )
+    except ClientError as e:
+        if not _condition_failed(e):
+            raise
+        return None
+    return fresh
+
+
+def handoff(run):
+    """Lease the run to the next chunk for HANDOFF_GRACE_SECONDS; returns the resume event to send it."""
+    token = uuid.uuid4().hex
+    run.update(lease_until=int(time.time()) + HANDOFF_GRACE_SECONDS, resume_token=token)
+    return {"resume": run["run_id"], "resume_token": token}
+
+
+def clear_checkpoint(job_type, pool_id=None):
+    backup_table().delete_item(Key=_checkpoint_key(job_type, pool_id))
+
+
+def save_report(job_type, job_id, part, results, pool_id=None):
+    """Store one slice of a job's per-user results ({username: outcome})."""
+    backup_table().put_item(Item={
+        "userId": _state_user_id(job_type, pool_id),
+        "backupDate": f"REPORT#{job_id}#{part}",
+        "results": results,
+        "ttl": int(time.time()) + BACKUP_RETENTION_DAYS * 86400,
+    })
+
+
+def save_run_report(job_type, run_id, report):
+    """Store the consolidated report of a run over several pools, as JSON."""
+    backup_table().put_item(Item={
+        "userId": _state_user_id(job_type),
+        "backupDate": f"RUN#{run_id}",
+        "report": json.dumps(report, default=str),
+        "ttl": int(time.time()) + BACKUP_RETENTION_DAYS * 86400,
+    })
+
+
+def snapshot_item(username, backup_date, pool_id=None, **fields):
+    return {
+        "userId": user_key(username, pool_id),
+        "backupDate": backup_date,
+        **fields,
+        "ttl": int(time.time()) + BACKUP_RETENTION_DAYS * 86400,
+    }
+
+
+def tombstone_item(username, backup_date, pool_id=None):
+    return snapshot_item(username, backup_date, pool_id, deleted=True)
+
+
+def reduce_snapshots(items, as_of=None, pending=None, pool_id=None):
+    """Stream one pool's snapshot items down to the newest one per user at or before as_of.
+
+    A scan returns all of a user's snapshots next to each other, so only the
+    user currently being read has to be held back. Returns (ready, pending):
+    the finished users' snapshots, tombstones left out and userId set to the
+    plain username, and the carry-over to pass with the next page (or to
+    finish_snapshots after the last one).
+    """
+    ready = []
+    home = is_home(pool_id)
+    for item in items:
+        if is_reserved(item["userId"]):
+            continue
+        owner, username = split_user_key(item["userId"])
+        if owner != (HOME_POOL_ID if home else pool_id):
+            continue
+        if username != item["userId"]:
+            item = {**item, "userId": username}
+        if pending is None or pending["userId"] != item["userId"]:
+            ready.extend(finish_snapshots(pending))
+            pending = {"userId": item["userId"], "item": None}
+        if as_of and item["backupDate"] > as_of:
+            continue
+        if pending["item"] is None or item["backupDate"] > pending["item"]["backupDate"]:
+            pending["item"] = item
+    return ready, pending
+
+
+def finish_snapshots(pending):
+    if pending is None or pending["item"] is None or pending["item"].get("deleted"):
+        return []
+    return [pending["item"]]
+
+
+def latest_snapshot(username, as_of=None, pool_id=None):
+    """The user's newest snapshot at or before as_of as a one-item list, empty if none or a tombstone."""
+    from boto3.dynamodb.conditions import Key
+
+    condition = Key("userId").eq(user_key(username, pool_id))
+    if as_of:
+        condition = condition & Key("backupDate").lte(as_of)
+    items = backup_table().query(KeyConditionExpression=condition, ScanIndexForward=False, Limit=1).get("Items", [])
+    return finish_snapshots({"userId": username, "item": {**items[0], "userId": username} if items else None})
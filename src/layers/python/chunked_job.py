@@ -0,0 +1,31 @@
+import os
+import json
+import time
+import logging
+from aws_clients import client
+
+logger = logging.getLogger()
+
+# Stop taking new work once less than this is left of the invocation, leaving
+# room to flush, checkpoint and hand off.
+CHUNK_RESERVE_MS = int(os.environ.get("CHUNK_RESERVE_MS", "60000"))
+
+def out_of_time(context):
+    return context is not None and context.get_remaining_time_in_millis() < CHUNK_RESERVE_MS
+
+
+def lease_until(context):
+    """Epoch second until which the current invocation may still be working."""
+    if context is None:
+        return int(time.time()) + 900
+    return int(time.time() + context.get_remaining_time_in_millis() / 1000)
+
+
+def continue_async(context, payload):
+    """Re-invoke this function asynchronously to pick up the next chunk."""
+    client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(payload).encode(),
+    )
+    logger.info(f"Handed off to next chunk: {payload}")
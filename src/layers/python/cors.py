@@ -0,0 +1,52 @@
+import os
+import re
+
+# Frontend origins allowed to call the API: the local dev server and the two
+# Amplify branches, plus comma-separated CORS_EXTRA_ORIGINS where "*" matches
+# within a host, e.g. https://*.example.com.
+ORIGINS = [
+    o.strip()
+    for o in (
+        os.environ.get("AMPLIFY_LOCAL_DOMAIN", ""),
+        os.environ.get("AMPLIFY_DEV_DOMAIN", ""),
+        os.environ.get("AMPLIFY_PROD_DOMAIN", ""),
+        *os.environ.get("CORS_EXTRA_ORIGINS", "").split(","),
+    )
+    if o.strip()
+]
+ALLOWED_ORIGINS = frozenset(o for o in ORIGINS if "*" not in o)
+ORIGIN_PATTERNS = [
+    re.compile("^" + re.escape(o).replace(r"\*", r"[^/.:]+(?:\.[^/.:]+)*") + "$")
+    for o in ORIGINS
+    if "*" in o
+]
+# How long browsers may reuse a preflight answer (Chromium caps this at 7200).
+CORS_MAX_AGE_SECONDS = os.environ.get("CORS_MAX_AGE_SECONDS", "7200")
+MAX_CACHED_ORIGINS = 256
+
+_pattern_matches = {}
+
+
+def is_allowed(origin):
+    if not origin:
+        return False
+    if origin in ALLOWED_ORIGINS:
+        return True
+    allowed = _pattern_matches.get(origin)
+    if allowed is None:
+        allowed = any(p.match(origin) for p in ORIGIN_PATTERNS)
+        if len(_pattern_matches) < MAX_CACHED_ORIGINS:
+            _pattern_matches[origin] = allowed
+    return allowed
+
+
+def cors_headers(origin, methods, allow_headers="Content-Type,Authorization,Idempotency-Key"):
+    """A fresh header dict for one response; the origin is echoed only if allowed."""
+    headers = {
+        "Access-Control-Allow-Methods": methods,
+        "Access-Control-Allow-Headers": allow_headers,
+        "Vary": "Origin",
+    }
+    if is_allowed(origin):
+        headers["Access-Control-Allow-Origin"] = origin
+    return headers
@@ -0,0 +1,233 @@
+import os
+import time
+import logging
+import threading
+from decimal import Decimal
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger()
+
+# Cognito's quotas are per user pool and API category, and every function
+# that calls the pool draws on them. Each (pool, category) has a token
+# bucket in one DynamoDB item; a container takes tokens from it a lease at a
+# time with a conditional update and spends the lease locally, so most
+# Cognito calls cost no extra round trip. Batch callers cannot take the last
+# BATCH_RESERVE of a bucket, which stays free for interactive requests.
+
+GOVERNOR_ENABLED = os.environ.get("GOVERNOR_ENABLED", "true").lower() != "false"
+OPS_STATE_TABLE = os.environ.get("OPS_STATE_TABLE")
+
+INTERACTIVE, BATCH = "interactive", "batch"
+DEFAULT_PRIORITY = os.environ.get("GOVERNOR_PRIORITY", INTERACTIVE)
+
+# Share of Cognito's default quota (requests per second) the functions allow themselves.
+QUOTA_SHARE = float(os.environ.get("GOVERNOR_QUOTA_SHARE", "0.8"))
+# Seconds of a category's rate one lease takes; unspent tokens lapse after twice that.
+LEASE_SECONDS = float(os.environ.get("GOVERNOR_LEASE_SECONDS", "0.5"))
+BATCH_RESERVE = float(os.environ.get("GOVERNOR_BATCH_RESERVE", "0.3"))
+# A call waits at most this long for tokens, then goes ahead and relies on backoff.
+MAX_WAIT_SECONDS = {
+    INTERACTIVE: float(os.environ.get("GOVERNOR_MAX_WAIT_SECONDS", "5")),
+    BATCH: float(os.environ.get("GOVERNOR_BATCH_MAX_WAIT_SECONDS", "30")),
+}
+MAX_CONFLICTS = 5
+STATE_RETENTION_SECONDS = 86400
+
+CATEGORIES = {
+    "UserList": ("ListUsers", "ListUsersInGroup"),
+    "UserRead": ("AdminGetUser", "AdminListGroupsForUser"),
+    "UserCreation": ("AdminCreateUser",),
+    "UserUpdate": (
+        "AdminAddUserToGroup",
+        "AdminRemoveUserFromGroup",
+        "AdminUpdateUserAttributes",
+        "AdminSetUserPassword",
+        "AdminEnableUser",
+        "AdminDisableUser",
+        "AdminDeleteUser",
+    ),
+    "UserPoolRead": ("DescribeUserPool",),
+    "UserPoolResourceRead": ("ListGroups",),
+}
+DEFAULT_QUOTAS = {
+    "UserList": 30,
+    "UserRead": 120,
+    "UserCreation": 50,
+    "UserUpdate": 25,
+    "UserPoolRead": 15,
+    "UserPoolResourceRead": 20,
+}
+CATEGORY_OF = {operation: category for category, operations in CATEGORIES.items() for operation in operations}
+
+
+def _rates():
+    """Requests per second per category; GOVERNOR_RATES="UserList=20,UserUpdate=10" overrides."""
+    rates = {c: q * QUOTA_SHARE for c, q in DEFAULT_QUOTAS.items()}
+    for entry in os.environ.get("GOVERNOR_RATES", "").split(","):
+        if "=" in entry:
+            category, rate = entry.split("=", 1)
+            rates[category.strip()] = float(rate)
+    return rates
+
+
+RATES = _rates()
+
+_priority = DEFAULT_PRIORITY
+_buckets = {}
+_buckets_lock = threading.Lock()
+_waits = threading.local()
+
+
+@contextmanager
+def priority(level):
+    """Run a block, and the worker threads it starts, at the given priority."""
+    global _priority
+    previous, _priority = _priority, level
+    try:
+        yield
+    finally:
+        _priority = previous
+
+
+def _number(value):
+    return Decimal(str(round(value, 3)))
+
+
+class Bucket:
+    """This container's lease on one shared (pool, category) bucket."""
+
+    def __init__(self, pool_id, category):
+        self.key = {"pk": f"QUOTA#{pool_id}#{category}"}
+        self.category = category
+        self.rate = RATES[category]
+        self.capacity = max(1.0, self.rate)
+        self.lease_size = max(1, int(self.rate * LEASE_SECONDS))
+        self.tokens = 0
+        self.expires = 0.0
+        self.seen = None
+        self.local_until = 0.0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Spend one leased token; False when the lease is empty or has lapsed."""
+        if self.tokens >= 1 and self.expires > time.monotonic():
+            self.tokens -= 1
+            return True
+        return False
+
+    def lease(self, level):
+        """Lease tokens from the shared bucket; return seconds to wait when there are none.
+
+        If the bucket cannot be reached the lease is granted anyway, which
+        still holds this container to the category's rate.
+        """
+        try:
+            granted, wait = self._take_shared(level)
+        except Exception as e:
+            metrics.count("GovernorErrors", Category=self.category)
+            if metrics.sampled():
+                logger.warning(f"Quota bucket {self.key['pk']} unavailable, leasing locally (sampled): {e}")
+            self.seen = None
+            wait = self.local_until - time.monotonic()
+            if wait > 0:
+                return wait
+            self.local_until = time.monotonic() + self.lease_size / self.rate
+            granted, wait = self.lease_size, 0
+        if granted:
+            metrics.count("GovernorLeases", Category=self.category)
+            self.tokens = granted
+            self.expires = time.monotonic() + 2 * LEASE_SECONDS
+        return wait
+
+    def _read(self):
+        from aws_clients import table
+
+        item = table(OPS_STATE_TABLE).get_item(Key=self.key, ConsistentRead=True).get("Item")
+        return {"tokens": item["tokens"], "stamp": item["stamp"]} if item else None
+
+    def _take_shared(self, level):
+        from aws_clients import table
+        from botocore.exceptions import ClientError
+
+        floor = self.capacity * BATCH_RESERVE if level == BATCH else 0
+        for _ in range(MAX_CONFLICTS):
+            if self.seen is None:
+                self.seen = self._read() or {}
+            now = time.time()
+            if self.seen:
+                elapsed = max(0.0, now - float(self.seen["stamp"]))
+                available = min(self.capacity, float(self.seen["tokens"]) + elapsed * self.rate)
+                condition, values = "stamp = :seen", {":seen": self.seen["stamp"]}
+            else:
+                available = self.capacity
+                condition, values = "attribute_not_exists(pk)", {}
+
+            granted = min(self.lease_size, int(available - floor))
+            if granted < 1:
+                return 0, (floor + 1 - available) / self.rate
+
+            state = {"tokens": _number(available - granted), "stamp": _number(now)}
+            try:
+                table(OPS_STATE_TABLE).update_item(
+                    Key=self.key,
+                    UpdateExpression="SET tokens = :tokens, stamp = :stamp, #ttl = :ttl",
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={"#ttl": "ttl"},
+                    ExpressionAttributeValues={
+                        **values,
+                        ":tokens": state["tokens"],
+                        ":stamp": state["stamp"],
+                        ":ttl": int(now) + STATE_RETENTION_SECONDS,
+                    },
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                # Another container took tokens since this one last looked.
+                metrics.count("GovernorConflicts", Category=self.category)
+                self.seen = None
+                continue
+            self.seen = state
+            return granted, 0
+        return 0, LEASE_SECONDS / 2
+
+
+def _bucket(pool_id, category):
+    key = (pool_id, category)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(key, Bucket(pool_id, category))
+    return bucket
+
+
+def wait_seconds():
+    """Seconds this thread has spent waiting for tokens, so callers can leave them out of a timing."""
+    return getattr(_waits, "seconds", 0.0)
+
+
+def acquire(pool_id, operation):
+    """Block until the pool's quota for `operation` has room for one more call."""
+    category = CATEGORY_OF.get(operation)
+    if not GOVERNOR_ENABLED or not OPS_STATE_TABLE or not pool_id or category is None:
+        return
+    bucket = _bucket(pool_id, category)
+    level = _priority
+    started = time.monotonic()
+    while True:
+        with bucket.lock:
+            if bucket.take():
+                break
+            wait = bucket.lease(level)
+            if not wait and bucket.take():
+                break
+        if time.monotonic() + wait - started > MAX_WAIT_SECONDS.get(level, MAX_WAIT_SECONDS[INTERACTIVE]):
+            metrics.count("GovernorTimeouts", Category=category, Priority=level)
+            break
+        time.sleep(wait)
+
+    waited = time.monotonic() - started
+    _waits.seconds = wait_seconds() + waited
+    if waited > 0.001:
+        metrics.observe("GovernorWait", waited * 1000, Category=category, Priority=level)
@@ -0,0 +1,210 @@
+import os
+import time
+import hashlib
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from api import ApiError, dumps, loads
+from aws_clients import table
+from chunked_job import lease_until
+import metrics
+
+logger = logging.getLogger()
+
+OPS_STATE_TABLE = os.environ.get("OPS_STATE_TABLE")
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() != "false"
+# How long a response is replayed for a client-supplied Idempotency-Key.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "256"))
+# Larger responses are not stored; a retry then runs the request again.
+MAX_STORED_BODY_BYTES = 300 * 1024
+MAX_KEY_LENGTH = 255
+
+HEADER = "idempotency-key"
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IN_PROGRESS, COMPLETED = "IN_PROGRESS", "COMPLETED"
+
+# Completed responses recently stored or replayed by this container, so a
+# retry that lands on it is answered without a DynamoDB read.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(key, record):
+    with _cache_lock:
+        _cache[key] = record
+        _cache.move_to_end(key)
+        while len(_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _recall(key):
+    with _cache_lock:
+        record = _cache.get(key)
+        if record is None:
+            return None
+        if record["expires_at"] <= time.time():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return record
+
+
+def _caller(request):
+    authorizer = (request.event.get("requestContext") or {}).get("authorizer") or {}
+    return (authorizer.get("claims") or {}).get("sub", "")
+
+
+def request_key(scope, request):
+    """Return (pk, fingerprint, replay) identifying this request.
+
+    Keys are per caller, so two admins cannot collide on a key. The
+    fingerprint is the request itself, to catch a key reused for a
+    different request. Without an Idempotency-Key the payload hash stands in,
+    but only to catch a duplicate while the first is running (replay False):
+    repeating the same payload later, e.g. inviting a user again after
+    deleting them, is a new request and must run.
+    """
+    method = request.event.get("httpMethod", "")
+    fingerprint = hashlib.sha256(
+        "\n".join((method, request.event.get("path") or "", request.raw_body)).encode()
+    ).hexdigest()
+    supplied = request.headers.get(HEADER)
+    if supplied:
+        if len(supplied) > MAX_KEY_LENGTH:
+            raise ApiError(400, {"message": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"})
+        source = f"key:{supplied}"
+    else:
+        source = f"payload:{fingerprint}"
+    digest = hashlib.sha256(f"{scope}\n{_caller(request)}\n{source}".encode()).hexdigest()
+    return f"IDEMPOTENCY#{scope}#{digest}", fingerprint, bool(supplied)
+
+
+def _claim(key, fingerprint, context):
+    """Mark the request in progress; return the existing record if another request holds it."""
+    now = int(time.time())
+    try:
+        table(OPS_STATE_TABLE).put_item(
+            Item={
+                "pk": key,
+                "state": IN_PROGRESS,
+                "fingerprint": fingerprint,
+                "locked_until": lease_until(context),
+                "ttl": now + IDEMPOTENCY_TTL_SECONDS,
+            },
+            # Expired records may linger until DynamoDB's TTL sweep removes them,
+            # and a claim whose invocation died is released by its lock expiring.
+            ConditionExpression="attribute_not_exists(pk) OR #ttl < :now OR (#state = :progress AND locked_until < :now)",
+            ExpressionAttributeNames={"#ttl": "ttl", "#state": "state"},
+            ExpressionAttributeValues={":now": now, ":progress": IN_PROGRESS},
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+        return None
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+        item = e.response.get("Item")
+        if item is None:
+            return table(OPS_STATE_TABLE).get_item(Key={"pk": key}, ConsistentRead=True).get("Item") or {}
+        # The error response is not deserialised by the resource layer.
+        from boto3.dynamodb.types import TypeDeserializer
+
+        deserializer = TypeDeserializer()
+        return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+
+def _release(key):
+    try:
+        table(OPS_STATE_TABLE).delete_item(Key={"pk": key})
+    except ClientError as e:
+        logger.warning(f"Could not release idempotency key: {e}")
+
+
+def _complete(key, fingerprint, status, body):
+    payload = dumps(body)
+    if status >= 500 or len(payload) > MAX_STORED_BODY_BYTES:
+        # Nothing worth replaying: let the next attempt run the request again.
+        _release(key)
+        return
+    expires_at = int(time.time()) + IDEMPOTENCY_TTL_SECONDS
+    table(OPS_STATE_TABLE).put_item(Item={
+        "pk": key,
+        "state": COMPLETED,
+        "fingerprint": fingerprint,
+        "status": status,
+        "body": payload,
+        "ttl": expires_at,
+    })
+    _remember(key, {"fingerprint": fingerprint, "status": status, "body": payload, "expires_at": expires_at})
+
+
+def _replay(record, fingerprint):
+    if record["fingerprint"] != fingerprint:
+        metrics.count("IdempotencyConflicts")
+        return 422, {"message": "Idempotency-Key was already used for a different request"}
+    metrics.count("IdempotentReplays")
+    return int(record["status"]), loads(record["body"])
+
+
+def idempotent(scope):
+    """Wrap `fn(request, context) -> (status, body)` so a retried mutation is answered once.
+
+    The first request with a given Idempotency-Key header claims the key in
+    OPS_STATE_TABLE. Its response is stored and replayed to every retry; a
+    retry that arrives while it is still running gets 409. Server errors are
+    not stored, so the client can retry them. A request without the header
+    is only guarded against an identical one running at the same time
+    (409); once it finishes the same payload runs again. Should the table be
+    unreachable the request simply runs.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def handler(request, context):
+            if (
+                not IDEMPOTENCY_ENABLED
+                or not OPS_STATE_TABLE
+                or request.event.get("httpMethod") not in MUTATING_METHODS
+            ):
+                return fn(request, context)
+
+            key, fingerprint, replay = request_key(scope, request)
+            cached = _recall(key)
+            if cached is not None:
+                return _replay(cached, fingerprint)
+            try:
+                existing = _claim(key, fingerprint, context)
+            except ClientError as e:
+                logger.warning(f"Idempotency store unavailable, running request unguarded: {e}")
+                metrics.count("IdempotencyErrors")
+                return fn(request, context)
+            if existing is not None:
+                if existing.get("state") == COMPLETED:
+                    record = {**existing, "expires_at": int(existing["ttl"])}
+                    _remember(key, record)
+                    return _replay(record, fingerprint)
+                metrics.count("IdempotencyConflicts")
+                return 409, {"message": "The same request is still in progress, retry shortly"}
+
+            try:
+                status, body = fn(request, context)
+            except ApiError as e:
+                status, body = e.status, e.body
+            except Exception:
+                _release(key)
+                raise
+            if not replay:
+                _release(key)
+                return status, body
+            try:
+                _complete(key, fingerprint, status, body)
+            except ClientError as e:
+                logger.warning(f"Could not store idempotent response: {e}")
+                metrics.count("IdempotencyErrors")
+            return status, body
+
+        return handler
+
+    return decorate
@@ -0,0 +1,193 @@
+import os
+import time
+import uuid
+import logging
+from datetime import datetime, timezone
+from aws_clients import table
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+OPS_STATE_TABLE = os.environ.get("OPS_STATE_TABLE")
+JOB_RETENTION_DAYS = int(os.environ.get("JOB_RETENTION_DAYS", "7"))
+# Rows and results are stored in slices so no item nears DynamoDB's 400 KB limit.
+JOB_SLICE_SIZE = 200
+
+QUEUED, RUNNING, SUCCEEDED, PARTIAL, FAILED = "QUEUED", "RUNNING", "SUCCEEDED", "PARTIAL", "FAILED"
+FINISHED = {SUCCEEDED, PARTIAL, FAILED}
+
+# Everything about job <id> lives under pk "JOB#<id>" and "JOB#<id>#...".
+
+
+def _ops_table():
+    return table(OPS_STATE_TABLE)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _expiry():
+    return int(time.time()) + JOB_RETENTION_DAYS * 86400
+
+
+def create_job(job_type, total, rows=None, **fields):
+    """Register a background job; rows, if given, are stored for the worker to read back."""
+    job_id = uuid.uuid4().hex
+    if rows:
+        store_rows(job_id, rows)
+    _ops_table().put_item(Item={
+        "pk": f"JOB#{job_id}",
+        "job_id": job_id,
+        "type": job_type,
+        "status": QUEUED,
+        "total": total,
+        "processed": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "result_slices": 0,
+        "created_at": _now(),
+        "updated_at": _now(),
+        "ttl": _expiry(),
+        **fields,
+    })
+    return job_id
+
+
+def store_rows(job_id, rows):
+    """Store the rows a job's worker will read back with job_rows."""
+    append_rows(job_id, 0, rows)
+
+
+def append_rows(job_id, start, rows):
+    """Store rows as the job's rows from `start` on, after the `start` rows already stored."""
+    offset = start % JOB_SLICE_SIZE
+    if offset:
+        # Fill up the partly written last slice first.
+        rows = job_rows(job_id, start - offset, offset) + list(rows)
+    first = start // JOB_SLICE_SIZE
+    with _ops_table().batch_writer() as batch:
+        for index, position in enumerate(range(0, len(rows), JOB_SLICE_SIZE), start=first):
+            batch.put_item(Item={
+                "pk": f"JOB#{job_id}#ROWS#{index:05d}",
+                "rows": rows[position:position + JOB_SLICE_SIZE],
+                "ttl": _expiry(),
+            })
+
+
+def get_job(job_id):
+    item = _ops_table().get_item(Key={"pk": f"JOB#{job_id}"}, ConsistentRead=True).get("Item")
+    if item is None:
+        return None
+    for key in ("total", "processed", "succeeded", "failed", "result_slices"):
+        if key in item:
+            item[key] = int(item[key])
+    return item
+
+
+def job_rows(job_id, start, count):
+    """Rows start .. start+count of a job, read from their stored slices."""
+    rows = []
+    first, last = start // JOB_SLICE_SIZE, (start + count - 1) // JOB_SLICE_SIZE
+    for index in range(first, last + 1):
+        item = _ops_table().get_item(Key={"pk": f"JOB#{job_id}#ROWS#{index:05d}"}).get("Item")
+        if item:
+            rows.extend(item["rows"])
+    offset = start - first * JOB_SLICE_SIZE
+    return rows[offset:offset + count]
+
+
+def update_job(job_id, **fields):
+    fields["updated_at"] = _now()
+    names = {f"#f{i}": k for i, k in enumerate(fields)}
+    values = {f":f{i}": v for i, v in enumerate(fields.values())}
+    _ops_table().update_item(
+        Key={"pk": f"JOB#{job_id}"},
+        UpdateExpression="SET " + ", ".join(f"#f{i} = :f{i}" for i in range(len(fields))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def record_results(job_id, results, succeeded, failed):
+    """Store one slice of per-row results and add it to the job's progress."""
+    response = _ops_table().update_item(
+        Key={"pk": f"JOB#{job_id}"},
+        UpdateExpression="ADD processed :n, succeeded :ok, failed :bad, result_slices :one SET updated_at = :now",
+        ExpressionAttributeValues={
+            ":n": len(results), ":ok": succeeded, ":bad": failed, ":one": 1, ":now": _now(),
+        },
+        ReturnValues="UPDATED_NEW",
+    )
+    index = int(response["Attributes"]["result_slices"]) - 1
+    _ops_table().put_item(Item={
+        "pk": f"JOB#{job_id}#RESULTS#{index:05d}",
+        "results": results,
+        "ttl": _expiry(),
+    })
+
+
+def record_slice(job_id, index, results, succeeded, failed):
+    """Store the results of slice `index` and add them to the job's progress, once.
+
+    Queue consumers may see a slice more than once, so the results item and
+    the progress update are one transaction that only goes through while
+    the slice is unrecorded. Returns False for a slice already recorded.
+    """
+    from boto3.dynamodb.types import TypeSerializer
+
+    serialize = TypeSerializer().serialize
+    values = {":n": len(results), ":ok": succeeded, ":bad": failed, ":one": 1, ":now": _now()}
+    item = {"pk": f"JOB#{job_id}#RESULTS#{index:05d}", "results": results, "ttl": _expiry()}
+    try:
+        _ops_table().meta.client.transact_write_items(TransactItems=[
+            {"Put": {
+                "TableName": OPS_STATE_TABLE,
+                "Item": {k: serialize(v) for k, v in item.items()},
+                "ConditionExpression": "attribute_not_exists(pk)",
+            }},
+            {"Update": {
+                "TableName": OPS_STATE_TABLE,
+                "Key": {"pk": {"S": f"JOB#{job_id}"}},
+                "UpdateExpression": "ADD processed :n, succeeded :ok, failed :bad, result_slices :one SET updated_at = :now",
+                "ExpressionAttributeValues": {k: serialize(v) for k, v in values.items()},
+            }},
+        ])
+    except ClientError as e:
+        reasons = e.response.get("CancellationReasons") or [{}]
+        if reasons[0].get("Code") == "ConditionalCheckFailed":
+            return False
+        raise
+    return True
+
+
+def slice_recorded(job_id, index):
+    key = {"pk": f"JOB#{job_id}#RESULTS#{index:05d}"}
+    return "Item" in _ops_table().get_item(Key=key, ProjectionExpression="pk")
+
+
+def finish_if_done(job_id):
+    """Mark a job finished once every row has been processed; True when it is."""
+    job = get_job(job_id)
+    if job is None or job["processed"] < job["total"]:
+        return False
+    if job["status"] not in FINISHED:
+        finish_job(job_id, job["failed"])
+    return True
+
+
+def job_results(job_id, slices):
+    results = []
+    for index in range(slices):
+        item = _ops_table().get_item(Key={"pk": f"JOB#{job_id}#RESULTS#{index:05d}"}).get("Item")
+        if item:
+            results.extend(item["results"])
+    return results
+
+
+def finish_job(job_id, failed):
+    update_job(job_id, status=PARTIAL if failed else SUCCEEDED, finished_at=_now())
+
+
+def fail_job(job_id, error):
+    update_job(job_id, status=FAILED, error=str(error), finished_at=_now())
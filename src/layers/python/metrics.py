@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import threading
+import functools
+from contextlib import contextmanager
+
+# Metrics are aggregated in memory and written once per invocation as
+# CloudWatch Embedded Metric Format: one log line per dimension set, which
+# CloudWatch turns into metrics without any PutMetricData calls.
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "CMRP")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+# Fraction of routine per-item log lines that are still written.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+# Latencies are kept as a histogram of ~12% wide buckets. EMF takes at most
+# 100 distinct values per metric and line, so wider histograms are written
+# over several lines.
+BUCKETS_PER_DECADE = 20
+MAX_HISTOGRAM_VALUES = 100
+
+_lock = threading.Lock()
+_metrics = {}
+_cold_start = True
+
+
+def _bucket(ms):
+    if ms <= 0.1:
+        return 0.1
+    return round(10 ** (math.floor(math.log10(ms) * BUCKETS_PER_DECADE) / BUCKETS_PER_DECADE), 2)
+
+
+def _group(dimensions):
+    key = tuple(sorted(dimensions.items()))
+    group = _metrics.get(key)
+    if group is None:
+        group = _metrics[key] = {"counts": {}, "timings": {}, "units": {}}
+    return group
+
+
+def count(name, value=1, unit="Count", **dimensions):
+    """Add to a counter, optionally under extra low-cardinality dimensions."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        group = _group(dimensions)
+        group["counts"][name] = group["counts"].get(name, 0) + value
+        group["units"][name] = unit
+
+
+def observe(name, ms, **dimensions):
+    """Record one latency sample in milliseconds."""
+    if not METRICS_ENABLED:
+        return
+    bucket = _bucket(ms)
+    with _lock:
+        histogram = _group(dimensions)["timings"].setdefault(name, {})
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+@contextmanager
+def timer(name, **dimensions):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - started) * 1000, **dimensions)
+
+
+def sampled(rate=None):
+    """True for the share of calls whose routine log line should be written."""
+    return random.random() < (LOG_SAMPLE_RATE if rate is None else rate)
+
+
+def _document(dimensions, counts, units, histograms, timestamp):
+    document = {"FunctionName": FUNCTION_NAME, **dict(dimensions)}
+    definitions = []
+    for name, value in counts.items():
+        document[name] = value
+        definitions.append({"Name": name, "Unit": units[name]})
+    for name, values in histograms.items():
+        document[name] = values
+        definitions.append({"Name": name, "Unit": "Milliseconds"})
+    document["_aws"] = {
+        "Timestamp": timestamp,
+        "CloudWatchMetrics": [{
+            "Namespace": METRICS_NAMESPACE,
+            "Dimensions": [["FunctionName", *(k for k, _ in dimensions)]],
+            "Metrics": definitions,
+        }],
+    }
+    return json.dumps(document, separators=(",", ":"))
+
+
+def _documents(dimensions, group, timestamp):
+    """One EMF line for the group, plus one more per further MAX_HISTOGRAM_VALUES buckets.
+
+    CloudWatch adds up every line's values for a metric, so a histogram too
+    wide for one line is split across several rather than truncated.
+    """
+    parts = {
+        name: [sorted(histogram)[i:i + MAX_HISTOGRAM_VALUES] for i in range(0, len(histogram), MAX_HISTOGRAM_VALUES)]
+        for name, histogram in group["timings"].items()
+    }
+    pages = max((len(p) for p in parts.values()), default=1)
+    for page in range(pages):
+        histograms = {
+            name: {"Values": p[page], "Counts": [group["timings"][name][v] for v in p[page]]}
+            for name, p in parts.items() if page < len(p)
+        }
+        counts = group["counts"] if page == 0 else {}
+        yield _document(dimensions, counts, group["units"], histograms, timestamp)
+
+
+def flush():
+    """Write everything recorded since the last flush and start over."""
+    global _metrics
+    with _lock:
+        pending, _metrics = _metrics, {}
+    if not pending:
+        return
+    timestamp = int(time.time() * 1000)
+    sys.stdout.write("".join(line + "\n" for d, g in pending.items() for line in _documents(d, g, timestamp)))
+    sys.stdout.flush()
+
+
+def metered(handler):
+    """Decorate a lambda_handler so its metrics are flushed once, however it exits."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        if _cold_start:
+            _cold_start = False
+            count("ColdStart")
+        try:
+            return handler(event, context)
+        finally:
+            flush()
+
+    return wrapper
+
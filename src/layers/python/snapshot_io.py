@@ -0,0 +1,262 @@
+import os
+import json
+import zlib
+import hashlib
+import logging
+from decimal import Decimal
+from aws_clients import client
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip needs only the standard library
+    zstandard = None
+
+logger = logging.getLogger()
+
+SNAPSHOT_BUCKET = os.environ.get("SNAPSHOT_BUCKET")
+SNAPSHOT_COMPRESSION = os.environ.get("SNAPSHOT_COMPRESSION", "gzip")
+# Point at a local S3 stand-in (MinIO, LocalStack, moto server) when set.
+SNAPSHOT_S3_ENDPOINT_URL = os.environ.get("SNAPSHOT_S3_ENDPOINT_URL") or None
+# S3 requires every part but the last to be at least 5 MiB.
+PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("SNAPSHOT_PART_SIZE", str(8 * 1024 * 1024))))
+READ_CHUNK_SIZE = 1024 * 1024
+
+EXTENSIONS = {"gzip": "gz", "zstd": "zst", "none": None}
+
+def s3_client():
+    return client("s3", SNAPSHOT_S3_ENDPOINT_URL)
+
+
+def snapshot_prefix(user_pool_id, snapshot_id):
+    return f"snapshots/{user_pool_id}/{snapshot_id}"
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+class _Uncompressed:
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _compressor(compression):
+    if compression == "none":
+        return _Uncompressed()
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd snapshots need the 'zstandard' package")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unknown snapshot compression: {compression}")
+
+
+def _decompressor(compression):
+    if compression == "none":
+        return _Uncompressed()
+    if compression == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd snapshots need the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unknown snapshot compression: {compression}")
+
+
+class SnapshotWriter:
+    """Stream records into one compressed NDJSON object.
+
+    Compressed output is buffered up to PART_SIZE and shipped as a multipart
+    upload part, so memory stays flat however many records are written. An
+    object that never fills a part goes up with a single put_object. Use as a
+    context manager; leaving the block finishes the object and sets `entry`
+    to its manifest entry, an exception aborts the upload. write_lines takes
+    pre-encoded lines for other formats, and compression "none" writes them
+    as they are.
+    """
+
+    def __init__(self, key, bucket=None, compression=None, content_type=None):
+        self.bucket = bucket or SNAPSHOT_BUCKET
+        self.key = key
+        self.compression = compression or SNAPSHOT_COMPRESSION
+        self.extra_args = {"ContentType": content_type} if content_type else {}
+        self.compressor = _compressor(self.compression)
+        self.digest = hashlib.sha256()
+        self.buffer = bytearray()
+        self.records = 0
+        self.size = 0
+        self.upload_id = None
+        self.parts = []
+        self.entry = None
+        self.resumed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+            return False
+        self.close()
+        return False
+
+    def write(self, record):
+        self.write_lines((json.dumps(record, separators=(",", ":"), default=_json_default) + "\n").encode())
+
+    def write_lines(self, data, records=1):
+        """Append already encoded lines, e.g. a block of CSV rows."""
+        if self.digest is not None:
+            self.digest.update(data)
+        self.records += records
+        self.buffer += self.compressor.compress(data)
+        if len(self.buffer) >= PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = s3_client().create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = s3_client().upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.size += len(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        """Finish the object and return its manifest entry."""
+        self.buffer += self.compressor.flush()
+        if self.upload_id is None:
+            s3_client().put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.extra_args)
+            self.size += len(self.buffer)
+        else:
+            self._upload_part()
+            s3_client().complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        self.entry = {
+            "key": self.key,
+            "records": self.records,
+            "bytes": self.size,
+            "sha256": self.digest.hexdigest() if self.digest is not None else None,
+        }
+        if self.resumed:
+            s3_client().delete_object(Bucket=self.bucket, Key=self._pending_key())
+        return self.entry
+
+    def abort(self):
+        if self.upload_id is not None:
+            s3_client().abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            logger.warning(f"Aborted snapshot upload {self.key}")
+        if self.resumed:
+            s3_client().delete_object(Bucket=self.bucket, Key=self._pending_key())
+
+    def _pending_key(self):
+        return f"{self.key}.pending"
+
+    def suspend(self):
+        """Park an uncompressed upload so a later invocation can finish it.
+
+        The bytes not yet shipped as a part are stored beside the object, and
+        the returned state (small enough for a job item) is what resume()
+        takes. A compressor's state cannot be carried over, so only
+        compression "none" can be suspended.
+        """
+        if self.compression != "none":
+            raise ValueError("Only uncompressed uploads can be suspended")
+        s3_client().put_object(Bucket=self.bucket, Key=self._pending_key(), Body=bytes(self.buffer))
+        return {"upload_id": self.upload_id, "parts": self.parts, "records": self.records, "bytes": self.size}
+
+    @classmethod
+    def resume(cls, key, state, bucket=None, content_type=None):
+        """Pick up an upload parked by suspend(); its checksum is not carried over."""
+        writer = cls(key, bucket, "none", content_type)
+        writer.upload_id = state["upload_id"]
+        writer.parts = [{"ETag": p["ETag"], "PartNumber": int(p["PartNumber"])} for p in state["parts"]]
+        writer.records = int(state["records"])
+        writer.size = int(state["bytes"])
+        writer.digest = None
+        writer.resumed = True
+        pending = s3_client().get_object(Bucket=writer.bucket, Key=writer._pending_key())["Body"]
+        writer.buffer = bytearray(pending.read())
+        return writer
+
+
+def presigned_url(key, expires_in, file_name=None, bucket=None):
+    """A time-limited GET link to one object, downloaded as `file_name` if given."""
+    params = {"Bucket": bucket or SNAPSHOT_BUCKET, "Key": key}
+    if file_name:
+        params["ResponseContentDisposition"] = f'attachment; filename="{file_name}"'
+    return s3_client().generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+
+def data_key(prefix, part, compression=None):
+    compression = compression or SNAPSHOT_COMPRESSION
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown snapshot compression: {compression}")
+    extension = EXTENSIONS[compression]
+    return f"{prefix}/part-{part:02d}.ndjson" + (f".{extension}" if extension else "")
+
+
+def write_manifest(prefix, manifest, bucket=None):
+    s3_client().put_object(
+        Bucket=bucket or SNAPSHOT_BUCKET,
+        Key=f"{prefix}/manifest.json",
+        Body=json.dumps(manifest, indent=2, default=_json_default).encode(),
+        ContentType="application/json",
+    )
+
+
+def read_manifest(prefix, bucket=None):
+    body = s3_client().get_object(Bucket=bucket or SNAPSHOT_BUCKET, Key=f"{prefix}/manifest.json")["Body"]
+    return json.loads(body.read())
+
+
+def _decompressed(body, decompressor):
+    for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def read_records(entry, compression, bucket=None):
+    """Yield the records of one snapshot object as they are downloaded.
+
+    The object is decompressed chunk by chunk; once it has been read to the
+    end its record count and checksum are checked against the manifest entry.
+    """
+    body = s3_client().get_object(Bucket=bucket or SNAPSHOT_BUCKET, Key=entry["key"])["Body"]
+    decompressor = _decompressor(compression)
+    digest = hashlib.sha256()
+    records = 0
+    tail = b""
+    for chunk in _decompressed(body, decompressor):
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            digest.update(line + b"\n")
+            records += 1
+            yield json.loads(line)
+    if tail:
+        raise ValueError(f"Snapshot {entry['key']} ends in a partial record")
+    if records != entry["records"] or digest.hexdigest() != entry["sha256"]:
+        raise ValueError(f"Snapshot {entry['key']} does not match its manifest")
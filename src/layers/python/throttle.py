@@ -0,0 +1,85 @@
+import os
+import time
+import random
+import logging
+import threading
+import metrics
+from botocore.exceptions import ClientError, ConnectionError
+
+logger = logging.getLogger()
+
+MAX_ATTEMPTS = int(os.environ.get("THROTTLE_MAX_ATTEMPTS", "6"))
+BASE_DELAY = float(os.environ.get("THROTTLE_BASE_DELAY_SECONDS", "0.2"))
+MAX_DELAY = float(os.environ.get("THROTTLE_MAX_DELAY_SECONDS", "5"))
+
+THROTTLE_ERROR_CODES = {
+    "TooManyRequestsException",
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+}
+
+
+def is_throttled(error):
+    return (
+        isinstance(error, ClientError)
+        and error.response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES
+    )
+
+
+def is_transient(error):
+    """Server errors and failed connections, which Cognito clients no longer retry themselves."""
+    if isinstance(error, ConnectionError):
+        return True
+    return (
+        isinstance(error, ClientError)
+        and error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+    )
+
+
+def call_with_backoff(fn, *args, **kwargs):
+    """Call fn, retrying throttling and transient errors with full-jitter exponential backoff.
+
+    Every attempt goes through fn again, so a rate limiter or the quota
+    governor in it is charged per attempt. Any other error, or a retryable
+    one on the last attempt, is raised unchanged.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return fn(*args, **kwargs)
+        except (ClientError, ConnectionError) as e:
+            if not (is_throttled(e) or is_transient(e)) or attempt == MAX_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+            metrics.count("BackoffRetries")
+            if metrics.sampled():
+                logger.warning(f"{type(e).__name__} on attempt {attempt}, retrying in {delay:.2f}s (sampled)")
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """Token bucket shared by the threads of one process.
+
+    acquire() blocks until a call is allowed, keeping a worker pool under a
+    per-API requests-per-second quota.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            metrics.count("RateLimitWait", wait * 1000, unit="Milliseconds")
+            time.sleep(wait)
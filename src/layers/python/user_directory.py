@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import base64
+import logging
+from datetime import datetime, timezone
+from aws_clients import table
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+USER_DIRECTORY_TABLE = os.environ.get("USER_DIRECTORY_TABLE")
+
+# Role groups in precedence order; a user in several takes the first one.
+ROLE_GROUPS = [g.strip() for g in os.environ.get("ROLE_GROUPS", "Admin,CityOfficial").split(",") if g.strip()]
+DEFAULT_ROLE = "Citizen"
+ROLES = (*ROLE_GROUPS, DEFAULT_ROLE)
+
+USER_FIELDS = ("user_id", "name", "email", "region", "city", "role")
+
+# Single item holding a counter that every user-pool writer bumps, so warm
+# list_users containers can tell their cached directory is out of date.
+VERSION_KEY = {"pk": "META#version"}
+# Per-role user counts, written with a built_at stamp by rebuild() and kept
+# up to date by put_user / remove_user once it exists. Until the index has
+# been built, readers fall back to Cognito.
+COUNTS_KEY = {"pk": "META#counts"}
+
+# The index to query for each filter, in order of preference.
+FILTER_INDEXES = (("role", "ByRoleIndex"), ("region", "ByRegionIndex"), ("city", "ByCityIndex"))
+USER_ENTITY = "USER"
+
+def _directory_table():
+    return table(USER_DIRECTORY_TABLE)
+
+
+def get_directory_version():
+    """Return the current directory version, or None if it cannot be read."""
+    if not USER_DIRECTORY_TABLE:
+        return None
+    try:
+        item = _directory_table().get_item(Key=VERSION_KEY, ConsistentRead=True).get("Item")
+    except ClientError as e:
+        logger.warning(f"Could not read directory version: {e}")
+        return None
+    return int(item["version"]) if item else 0
+
+
+def bump_directory_version():
+    """Invalidate every cached copy of the user directory.
+
+    Best effort: a failure is logged and the readers fall back to their TTL.
+    """
+    if not USER_DIRECTORY_TABLE:
+        return
+    try:
+        _directory_table().update_item(
+            Key=VERSION_KEY,
+            UpdateExpression="ADD version :one",
+            ExpressionAttributeValues={":one": 1},
+        )
+    except ClientError as e:
+        logger.warning(f"Could not bump directory version: {e}")
+
+
+def role_from_groups(groups):
+    for group in ROLE_GROUPS:
+        if group in groups:
+            return group
+    return DEFAULT_ROLE
+
+
+def count_key(role):
+    """'CityOfficial' -> 'city_official'; keeps the existing 'citizens' key."""
+    if role == DEFAULT_ROLE:
+        return "citizens"
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", role).lower()
+
+
+def user_record(username, attributes, role):
+    """The API shape of a user, from a {name: value} Cognito attribute map."""
+    return {
+        "user_id": username,
+        "name": attributes.get("name"),
+        "email": attributes.get("email"),
+        # "phone_number": attributes.get("phone_number"),
+        "region": attributes.get("custom:region"),
+        "city": attributes.get("custom:city"),
+        "role": role,
+    }
+
+
+def _user_key(username):
+    return {"pk": f"USER#{username}"}
+
+
+def _user_item(record):
+    item = {**_user_key(record["user_id"]), "entity": USER_ENTITY}
+    # GSI key attributes cannot be empty, so missing values are left out and
+    # the user simply does not appear in that index.
+    item.update({k: v for k, v in record.items() if v})
+    item["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return item
+
+
+def _adjust_counts(deltas):
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    names = {f"#c{i}": k for i, k in enumerate(deltas)}
+    values = {f":c{i}": v for i, v in enumerate(deltas.values())}
+    try:
+        _directory_table().update_item(
+            Key=COUNTS_KEY,
+            UpdateExpression="ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(deltas))),
+            # Counting from nothing would make a partial index look built.
+            ConditionExpression="attribute_exists(built_at)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+
+
+def put_user(username, attributes, role, invalidate=True):
+    """Write a user into the directory index and keep the role counts in step.
+
+    Bulk writers pass invalidate=False and bump the version once at the end.
+    """
+    if not USER_DIRECTORY_TABLE:
+        return
+    try:
+        item = _user_item(user_record(username, attributes, role))
+        old = _directory_table().put_item(Item=item, ReturnValues="ALL_OLD").get("Attributes")
+        if old is None:
+            _adjust_counts({"total_users": 1, count_key(role): 1})
+        elif old.get("role") != role:
+            _adjust_counts({count_key(old.get("role", DEFAULT_ROLE)): -1, count_key(role): 1})
+    except ClientError as e:
+        logger.warning(f"Could not index user {username}: {e}")
+    if invalidate:
+        bump_directory_version()
+
+
+def remove_user(username, invalidate=True):
+    """Drop a user from the directory index and keep the role counts in step."""
+    if not USER_DIRECTORY_TABLE:
+        return
+    try:
+        old = _directory_table().delete_item(Key=_user_key(username), ReturnValues="ALL_OLD").get("Attributes")
+        if old is not None:
+            _adjust_counts({"total_users": -1, count_key(old.get("role", DEFAULT_ROLE)): -1})
+    except ClientError as e:
+        logger.warning(f"Could not remove user {username} from index: {e}")
+    if invalidate:
+        bump_directory_version()
+
+
+def get_counts():
+    """Return the precomputed role counts, or None if the index was never built."""
+    item = _directory_table().get_item(Key=COUNTS_KEY).get("Item")
+    if item is None or "built_at" not in item:
+        return None
+    counts = {"total_users": int(item.get("total_users", 0))}
+    counts.update({count_key(r): int(item.get(count_key(r), 0)) for r in ROLES})
+    return counts
+
+
+def encode_cursor(last_key):
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; ValueError for a token it could not have produced."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError as e:  # covers bad base64, bad UTF-8 and bad JSON
+        raise ValueError("invalid cursor") from e
+    if not isinstance(key, dict) or not key or not all(
+        isinstance(k, str) and isinstance(v, str) for k, v in key.items()
+    ):
+        raise ValueError("invalid cursor")
+    return key
+
+
+def query_users(role=None, region=None, city=None, email=None, limit=None, next_token=None):
+    """Query one page of the directory index and return (records, next_token).
+
+    The most selective equality filter picks the GSI; the rest are applied as
+    a FilterExpression, so a page may come back short with a next_token.
+    """
+    from boto3.dynamodb.conditions import Key, Attr
+
+    filters = {"role": role, "region": region, "city": city}
+    index, key_condition = "ByEntityIndex", Key("entity").eq(USER_ENTITY)
+    for attr, index_name in FILTER_INDEXES:
+        if filters[attr]:
+            index, key_condition = index_name, Key(attr).eq(filters.pop(attr))
+            break
+
+    filter_expression = None
+    for attr, value in filters.items():
+        if value:
+            condition = Attr(attr).eq(value)
+            filter_expression = condition if filter_expression is None else filter_expression & condition
+    if email:
+        condition = Attr("email").begins_with(email)
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    kwargs = {"IndexName": index, "KeyConditionExpression": key_condition}
+    if filter_expression is not None:
+        kwargs["FilterExpression"] = filter_expression
+    if limit:
+        kwargs["Limit"] = limit
+    if next_token:
+        kwargs["ExclusiveStartKey"] = decode_cursor(next_token)
+
+    response = _directory_table().query(**kwargs)
+    records = [{f: item.get(f) for f in USER_FIELDS} for item in response.get("Items", [])]
+    return records, encode_cursor(response.get("LastEvaluatedKey"))
+
+
+def scan_user_keys():
+    """Yield the username of every user item currently in the index."""
+    from boto3.dynamodb.conditions import Key
+
+    kwargs = {"IndexName": "ByEntityIndex", "KeyConditionExpression": Key("entity").eq(USER_ENTITY),
+              "ProjectionExpression": "user_id"}
+    while True:
+        response = _directory_table().query(**kwargs)
+        for item in response.get("Items", []):
+            yield item["user_id"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def rebuild(records):
+    """Replace the whole index with the given records and recount the roles.
+
+    Used by the directory sync job to backfill and to repair any drift left by
+    best-effort writes.
+    """
+    table = _directory_table()
+    live = {r["user_id"] for r in records}
+    stale = [u for u in scan_user_keys() if u not in live]
+
+    counts = {"total_users": len(records), **{count_key(r): 0 for r in ROLES}}
+    with table.batch_writer() as batch:
+        for record in records:
+            counts[count_key(record["role"])] += 1
+            batch.put_item(Item=_user_item(record))
+        for username in stale:
+            batch.delete_item(Key=_user_key(username))
+
+    table.put_item(Item={**COUNTS_KEY, **counts, "built_at": datetime.now(timezone.utc).isoformat()})
+    bump_directory_version()
+    return {"indexed": len(records), "removed": len(stale), "counts": counts}
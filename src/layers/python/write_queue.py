@@ -0,0 +1,90 @@
+import os
+import json
+import math
+import logging
+from aws_clients import client
+from throttle import call_with_backoff
+import metrics
+import jobs
+
+logger = logging.getLogger()
+
+# Queue the function's own writes go to, and its consumer drains. Point
+# SQS_ENDPOINT_URL at ElasticMQ to run the queue locally.
+WRITE_QUEUE_URL = os.environ.get("WRITE_QUEUE_URL")
+SQS_ENDPOINT_URL = os.environ.get("SQS_ENDPOINT_URL") or None
+# Queue every write, rather than only requests sent with "Prefer: respond-async".
+ASYNC_WRITES = os.environ.get("ASYNC_WRITES", "false").lower() == "true"
+SEND_BATCH_SIZE = 10  # SendMessageBatch limit
+
+
+def sqs_client():
+    return client("sqs", SQS_ENDPOINT_URL)
+
+
+def wants_async(request):
+    if not WRITE_QUEUE_URL:
+        return False
+    return ASYNC_WRITES or "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def is_queue_event(event):
+    records = event.get("Records") or []
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def enqueue_job(job_id, total):
+    """Queue one message per JOB_SLICE_SIZE rows of a stored job.
+
+    If the queue rejects any message the job is marked failed, so slices
+    that did get through are skipped by the consumer, and the error is raised.
+    """
+    messages = [{"job": job_id, "slice": i} for i in range(math.ceil(total / jobs.JOB_SLICE_SIZE))]
+    try:
+        for start in range(0, len(messages), SEND_BATCH_SIZE):
+            entries = [
+                {"Id": str(i), "MessageBody": json.dumps(m)}
+                for i, m in enumerate(messages[start:start + SEND_BATCH_SIZE])
+            ]
+            response = call_with_backoff(sqs_client().send_message_batch, QueueUrl=WRITE_QUEUE_URL, Entries=entries)
+            if response.get("Failed"):
+                raise RuntimeError(f"Queue rejected {len(response['Failed'])} messages: {response['Failed'][0].get('Message')}")
+    except Exception as e:
+        jobs.update_job(job_id, status=jobs.FAILED, error=f"Could not queue: {e}")
+        raise
+    metrics.count("SlicesQueued", len(messages))
+
+
+def process_slice(message, work):
+    """Run work(job, start, rows) -> per-row results for one queued slice, and record it once."""
+    job_id, index = message["job"], message["slice"]
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] in jobs.FINISHED or jobs.slice_recorded(job_id, index):
+        return
+    if job["status"] == jobs.QUEUED:
+        jobs.update_job(job_id, status=jobs.RUNNING)
+    start = index * jobs.JOB_SLICE_SIZE
+    rows = jobs.job_rows(job_id, start, min(jobs.JOB_SLICE_SIZE, job["total"] - start))
+    results = work(job, start, rows)
+    failed = sum(r["status"] == "failed" for r in results)
+    if jobs.record_slice(job_id, index, results, len(results) - failed, failed):
+        jobs.finish_if_done(job_id)
+
+
+def consume_slices(event, work):
+    """Process every job slice in an SQS batch.
+
+    Slices whose processing raised are reported back as batchItemFailures
+    (the event source needs ReportBatchItemFailures), so only they are
+    delivered again, and after maxReceiveCount end up in the dead-letter queue.
+    """
+    failures = []
+    for record in event["Records"]:
+        try:
+            process_slice(json.loads(record["body"]), work)
+        except Exception as e:
+            logger.error(f"Queued message {record['messageId']} failed: {str(e)}")
+            failures.append({"itemIdentifier": record["messageId"]})
+    metrics.count("QueueMessages", len(event["Records"]))
+    metrics.count("QueueMessageFailures", len(failures))
+    return {"batchItemFailures": failures}
@@ -1,91 +1,309 @@
-import boto3
 import os
-import json
 import logging
-from auth_utils import is_admin
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from api import ApiError, api_handler
+from aws_clients import LazyClient
+import metrics
+from throttle import call_with_backoff
+from user_directory import (
+    DEFAULT_ROLE,
+    ROLE_GROUPS,
+    ROLES,
+    USER_FIELDS,
+    count_key,
+    get_counts,
+    get_directory_version,
+    query_users,
+    user_record,
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-cognito = boto3.client("cognito-idp")
+cognito = LazyClient("cognito-idp")
 USER_POOL_ID = os.environ["USER_POOL_ID"]
+DIRECTORY_CACHE_TTL = int(os.environ.get("DIRECTORY_CACHE_TTL_SECONDS", "300"))
+DIRECTORY_CACHE_MAX_USERS = int(os.environ.get("DIRECTORY_CACHE_MAX_USERS", "20000"))
+FETCH_CONCURRENCY = int(os.environ.get("DIRECTORY_FETCH_CONCURRENCY", "4"))
+# "index" reads the DynamoDB directory projection, "cognito" scans the pool.
+DIRECTORY_SOURCE = os.environ.get("DIRECTORY_SOURCE", "cognito")
 
-CORS_HEADERS = {
-    "Access-Control-Allow-Methods": "OPTIONS,POST",
-    "Access-Control-Allow-Headers": "Content-Type,Authorization",
-}
+MAX_PAGE_SIZE = 60  # Cognito's own Limit cap for ListUsers / ListUsersInGroup
+# What Cognito and DynamoDB answer to a pagination token they do not accept.
+INVALID_TOKEN_CODES = {"InvalidParameterException", "ValidationException"}
+
+# Role-annotated directory kept across invocations of a warm container.
+# Invalidated by TTL or when a writer bumps the shared directory version.
+_directory_cache = {}
+
+
+class BadRequest(ApiError):
+    def __init__(self, message):
+        super().__init__(400, {"error": message})
+
+
+def get_all_users():
+    users, token = [], None
+    while True:
+        kwargs = {"UserPoolId": USER_POOL_ID}
+        if token:
+            kwargs["PaginationToken"] = token
+        page = call_with_backoff(cognito.list_users, **kwargs)
+        users.extend(page["Users"])
+        token = page.get("PaginationToken")
+        if not token:
+            return users
 
 
 def get_users_in_group(group_name):
-    users = set()
-    paginator = cognito.get_paginator("list_users_in_group")
-    for page in paginator.paginate(UserPoolId=USER_POOL_ID, GroupName=group_name):
+    users, token = set(), None
+    while True:
+        kwargs = {"UserPoolId": USER_POOL_ID, "GroupName": group_name}
+        if token:
+            kwargs["NextToken"] = token
+        page = call_with_backoff(cognito.list_users_in_group, **kwargs)
         users.update(u["Username"] for u in page["Users"])
-    return users
+        token = page.get("NextToken")
+        if not token:
+            return users
 
 
-def lambda_handler(event, context):
-    
-    origin = event['headers'].get('origin')
-    CORS_HEADERS.update({"Access-Control-Allow-Origin": origin})
+def resolve_role(username, members):
+    for group in ROLE_GROUPS:
+        if username in members[group]:
+            return group
+    return DEFAULT_ROLE
 
-    if not is_admin(event):
-        logger.warning("Unauthorized access attempt")
-        return {"statusCode": 403, "headers": CORS_HEADERS, "body": json.dumps({"message": "Forbidden: Admins only"})}
 
-    try:
+def to_user_record(user, role):
+    attributes = {a["Name"]: a["Value"] for a in user["Attributes"]}
+    return user_record(user["Username"], attributes, role)
+
+
+def _cache_lookup(key, version):
+    cached = _directory_cache.get(key)
+    if cached and cached["expires_at"] > time.monotonic():
+        # An unreadable version (None) leaves only the TTL to bound staleness.
+        if version is None or version == cached["version"]:
+            return cached["value"]
+    return None
+
+
+def _cache_store(key, version, value):
+    _directory_cache[key] = {
+        "version": version,
+        "expires_at": time.monotonic() + DIRECTORY_CACHE_TTL,
+        "value": value,
+    }
+
+
+def fetch_group_members(pool):
+    futures = {g: pool.submit(get_users_in_group, g) for g in ROLE_GROUPS}
+    return {g: f.result() for g, f in futures.items()}
+
+
+def get_group_members(version):
+    """Return {group: usernames} for every role group, cached like the directory."""
+    members = _cache_lookup("groups", version)
+    if members is None:
+        with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as pool:
+            members = fetch_group_members(pool)
+        _cache_store("groups", version, members)
+    return members
+
+
+def build_directory(version):
+    # The user scan and every group scan are independent paginations, so they
+    # run side by side; the pool size caps how many Cognito calls are in flight.
+    members = _cache_lookup("groups", version)
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as pool:
+        users_future = pool.submit(get_all_users)
+        if members is None:
+            members = fetch_group_members(pool)
+            _cache_store("groups", version, members)
+        all_users = users_future.result()
+
+    # Counters & data prep
+    users_data = []
+    counts = {"total_users": len(all_users), **{count_key(r): 0 for r in ROLES}}
+
+    for user in all_users:
+        role = resolve_role(user["Username"], members)
+        counts[count_key(role)] += 1
+        users_data.append(to_user_record(user, role))
+
+    return users_data, counts
+
+
+def build_directory_from_index(counts):
+    users_data, token = [], None
+    while True:
+        records, token = query_users(next_token=token)
+        users_data.extend(records)
+        if not token:
+            return users_data, counts
+
+
+def index_counts():
+    """Return the precomputed counts when the directory index is in use and built."""
+    if DIRECTORY_SOURCE != "index":
+        return None
+    return get_counts()
+
+
+def get_directory():
+    """Return (users_data, counts), served from the warm-container cache when still valid."""
+    version = get_directory_version()
+    cached = _cache_lookup("directory", version)
+    if cached is not None:
+        logger.info("Serving user directory from cache")
+        metrics.count("DirectoryCacheHits")
+        return cached
+    metrics.count("DirectoryCacheMisses")
+
+    counts = index_counts()
+    if counts is not None:
+        logger.info("Reading users from the directory index")
+        users_data, counts = build_directory_from_index(counts)
+    else:
         logger.info("Fetching all users from Cognito User Pool")
-        
-        all_users = []
-        paginator = cognito.get_paginator("list_users")
-        for page in paginator.paginate(UserPoolId=USER_POOL_ID):
-            all_users.extend(page["Users"])
-
-        # Fetch group memberships in bulk
-        admins = get_users_in_group("Admin")
-        city_officials = get_users_in_group("CityOfficial")
-
-        # Counters & data prep
-        users_data, admin_count, city_official_count, citizens_count = [], 0, 0, 0
-
-        for user in all_users:
-            attributes = {a["Name"]: a["Value"] for a in user["Attributes"]}
-            username = user["Username"]
-
-            if username in admins:
-                role = "Admin"
-                admin_count += 1
-            elif username in city_officials:
-                role = "CityOfficial"
-                city_official_count += 1
-            else:
-                role = "Citizen"
-                citizens_count += 1
-
-            users_data.append({
-                "user_id": username,
-                "name": attributes.get("name"),
-                "email": attributes.get("email"),
-                # "phone_number": attributes.get("phone_number"),
-                "region": attributes.get("custom:region"),
-                "city": attributes.get("custom:city"),
-                "role": role,
-            })
+        users_data, counts = build_directory(version)
 
+    if len(users_data) <= DIRECTORY_CACHE_MAX_USERS:
+        _cache_store("directory", version, (users_data, counts))
+    else:
+        _directory_cache.pop("directory", None)
+    return users_data, counts
+
+
+def parse_query(params):
+    limit = params.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            raise BadRequest(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+        limit = int(limit)
+
+    role = params.get("role")
+    if role is not None and role not in ROLES:
+        raise BadRequest(f"'role' must be one of {', '.join(ROLES)}")
+
+    fields = None
+    if params.get("fields"):
+        fields = [f.strip() for f in params["fields"].split(",") if f.strip()]
+        unknown = set(fields) - set(USER_FIELDS)
+        if unknown:
+            raise BadRequest(f"Unknown fields: {', '.join(sorted(unknown))}")
+        if "user_id" not in fields:
+            fields.insert(0, "user_id")
+
+    return {
+        "limit": limit,
+        "next_token": params.get("nextToken"),
+        "role": role,
+        "region": params.get("region"),
+        "city": params.get("city"),
+        "email": params.get("email"),
+        "fields": fields,
+    }
+
+
+def matches(record, query):
+    """Filters Cognito cannot apply server side (custom attributes, role on ListUsers)."""
+    if query["role"] and record["role"] != query["role"]:
+        return False
+    if query["region"] and record["region"] != query["region"]:
+        return False
+    if query["city"] and record["city"] != query["city"]:
+        return False
+    if query["email"] and not (record["email"] or "").startswith(query["email"]):
+        return False
+    return True
+
+
+def project(records, fields):
+    if not fields:
+        return records
+    return [{f: r[f] for f in fields} for r in records]
+
+
+def get_index_page(query):
+    return query_users(
+        role=query["role"],
+        region=query["region"],
+        city=query["city"],
+        email=query["email"],
+        limit=query["limit"] or MAX_PAGE_SIZE,
+        next_token=query["next_token"],
+    )
+
+
+def get_users_page(query):
+    """Fetch a single Cognito page and return (records, next_token).
+
+    Role groups are listed straight from the group; everything
+    else goes through ListUsers, where only standard attributes such as email
+    can be pushed down as a Filter. custom:region and custom:city are not
+    filterable in Cognito, so they are applied to the page, which may then
+    come back shorter than 'limit' while still carrying a nextToken.
+    """
+    limit = query["limit"] or MAX_PAGE_SIZE
+
+    if query["role"] in ROLE_GROUPS:
+        kwargs = {"UserPoolId": USER_POOL_ID, "GroupName": query["role"], "Limit": limit}
+        if query["next_token"]:
+            kwargs["NextToken"] = query["next_token"]
+        page = call_with_backoff(cognito.list_users_in_group, **kwargs)
+        records = [to_user_record(u, query["role"]) for u in page["Users"]]
+        next_token = page.get("NextToken")
+    else:
+        kwargs = {"UserPoolId": USER_POOL_ID, "Limit": limit}
+        if query["next_token"]:
+            kwargs["PaginationToken"] = query["next_token"]
+        if query["email"]:
+            kwargs["Filter"] = 'email ^= "{}"'.format(query["email"].replace('"', '\\"'))
+        page = call_with_backoff(cognito.list_users, **kwargs)
+        members = get_group_members(get_directory_version())
+        records = [to_user_record(u, resolve_role(u["Username"], members)) for u in page["Users"]]
+        next_token = page.get("PaginationToken")
+
+    return [r for r in records if matches(r, query)], next_token
+
+
+def get_page(query):
+    """One page from the index or from Cognito; a nextToken neither accepts is a bad request."""
+    try:
+        if index_counts() is not None:
+            return get_index_page(query)
+        return get_users_page(query)
+    except ValueError:
+        if query["next_token"]:
+            raise BadRequest("invalid nextToken")
+        raise
+    except ClientError as e:
+        if query["next_token"] and e.response.get("Error", {}).get("Code") in INVALID_TOKEN_CODES:
+            raise BadRequest("invalid nextToken")
+        raise
+
+
+@metrics.metered
+@api_handler(methods="OPTIONS,GET")
+def lambda_handler(request, context):
+    query = parse_query(request.query)
+
+    if query["limit"] or query["next_token"]:
+        users_data, next_token = get_page(query)
         response_body = {
-            "counts": {
-                "total_users": len(all_users),
-                "admin": admin_count,
-                "city_official": city_official_count,
-                "citizens": citizens_count,
-            },
-            "users": users_data,
+            "users": project(users_data, query["fields"]),
+            "nextToken": next_token,
         }
-        logger.info(("Successfully retrieved user data"))
-
-        return {"statusCode": 200, "headers": CORS_HEADERS, "body": json.dumps(response_body)}
+    else:
+        users_data, counts = get_directory()
+        response_body = {
+            "counts": counts,
+            "users": project([u for u in users_data if matches(u, query)], query["fields"]),
+        }
+    logger.info(("Successfully retrieved user data"))
 
-    except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        
-        return {"statusCode": 500, "headers": CORS_HEADERS, "body": json.dumps({"error": str(e)})}
+    return 200, response_body
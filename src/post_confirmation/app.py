@@ -0,0 +1,20 @@
+import logging
+import metrics
+from user_directory import DEFAULT_ROLE, put_user
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Add self sign-ups to the user directory index once they confirm."""
+    if event.get("triggerSource") == "PostConfirmation_ConfirmSignUp":
+        try:
+            put_user(event["userName"], event["request"].get("userAttributes", {}), DEFAULT_ROLE)
+            logger.info(f"Indexed new user {event['userName']}")
+        except Exception as e:
+            # Never block a sign-up on the index; the nightly sync repairs it.
+            logger.error(f"Failed to index user {event.get('userName')}: {str(e)}")
+
+    return event
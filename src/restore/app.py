@@ -1,15 +1,59 @@
-import boto3, os, logging, secrets, string
+import os, json, logging, secrets, string, threading
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from aws_clients import cognito_for
+from chunked_job import continue_async, lease_until, out_of_time
+from throttle import RateLimiter, call_with_backoff
+import metrics
+from backup_store import (
+    backup_table,
+    claim_run,
+    clear_checkpoint,
+    finish_snapshots,
+    handoff,
+    is_home,
+    latest_snapshot,
+    load_checkpoint,
+    now_iso,
+    reduce_snapshots,
+    save_checkpoint,
+    save_report,
+    save_run_report,
+    select_pools,
+)
+from snapshot_io import read_manifest, read_records
+from user_directory import bump_directory_version, put_user, role_from_groups
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-cognito = boto3.client("cognito-idp")
-dynamodb = boto3.resource("dynamodb")
+# Small pages keep a single page's restore well inside the chunk's time reserve.
+RESTORE_PAGE_SIZE = int(os.environ.get("RESTORE_PAGE_SIZE", "100"))
+RESTORE_SEGMENTS = int(os.environ.get("RESTORE_SEGMENTS", "4"))
+# Worker threads per pool; up to RESTORE_POOL_CONCURRENCY pools are restored at once.
+RESTORE_WORKERS = int(os.environ.get("RESTORE_WORKERS", "10"))
+RESTORE_POOL_CONCURRENCY = int(os.environ.get("RESTORE_POOL_CONCURRENCY", "4"))
+# A username-scoped restore keeps its names in the checkpoint item.
+RESTORE_MAX_USERNAMES = int(os.environ.get("RESTORE_MAX_USERNAMES", "1000"))
 
-USER_POOL_ID = os.environ["USER_POOL_ID"]
-BACKUP_TABLE = os.environ["BACKUP_TABLE"]
-table = dynamodb.Table(BACKUP_TABLE)
+# Requests per second per Cognito API and pool, sized to its quota category:
+# AdminCreateUser is UserCreation, the rest are UserUpdate.
+CREATE_RPS = float(os.environ.get("RESTORE_CREATE_RPS", "40"))
+UPDATE_RPS = float(os.environ.get("RESTORE_UPDATE_RPS", "20"))
+UPDATE_OPERATIONS = (
+    "admin_set_user_password",
+    "admin_disable_user",
+    "admin_add_user_to_group",
+    "admin_remove_user_from_group",
+    "admin_update_user_attributes",
+    "admin_enable_user",
+)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Cognito assigns these itself and rejects them on create.
+READ_ONLY_ATTRIBUTES = {"sub"}
+MAX_REPORTED_FAILURES = 100
 
 
 def generate_temp_password(length=16):
@@ -18,59 +62,566 @@ def generate_temp_password(length=16):
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
-def lambda_handler(event, context):
-    """Restore Cognito users from DynamoDB backup."""
+def limiters(pool_id):
+    """The pool's own rate limiters; Cognito's quotas are per pool."""
+    with _limiters_lock:
+        if pool_id not in _limiters:
+            update = RateLimiter(UPDATE_RPS)
+            _limiters[pool_id] = {
+                "admin_create_user": RateLimiter(CREATE_RPS),
+                **{operation: update for operation in UPDATE_OPERATIONS},
+            }
+        return _limiters[pool_id]
+
+
+def cognito_call(operation, **kwargs):
+    """Call Cognito under the operation's rate limit, backing off on throttles."""
+    limiter = limiters(kwargs["UserPoolId"])[operation]
+    cognito = cognito_for(kwargs["UserPoolId"])
+
+    def attempt(**kw):
+        limiter.acquire()
+        return getattr(cognito, operation)(**kw)
+
+    return call_with_backoff(attempt, **kwargs)
+
+
+def live_pool(pool_id, workers):
+    """Return ({username: {"attributes", "enabled"}}, {username: {group, ...}}) for the pool."""
+    cognito = cognito_for(pool_id)
+    users, kwargs = {}, {"UserPoolId": pool_id}
+    while True:
+        page = call_with_backoff(cognito.list_users, **kwargs)
+        for user in page["Users"]:
+            users[user["Username"]] = {
+                "attributes": {a["Name"]: a["Value"] for a in user.get("Attributes", [])},
+                "enabled": user["Enabled"],
+            }
+        if not page.get("PaginationToken"):
+            break
+        kwargs["PaginationToken"] = page["PaginationToken"]
+
+    groups, kwargs = [], {"UserPoolId": pool_id}
+    while True:
+        page = call_with_backoff(cognito.list_groups, **kwargs)
+        groups.extend(g["GroupName"] for g in page["Groups"])
+        if not page.get("NextToken"):
+            break
+        kwargs["NextToken"] = page["NextToken"]
+
+    def members(group):
+        usernames, kwargs = [], {"UserPoolId": pool_id, "GroupName": group}
+        while True:
+            page = call_with_backoff(cognito.list_users_in_group, **kwargs)
+            usernames.extend(u["Username"] for u in page["Users"])
+            if not page.get("NextToken"):
+                return group, usernames
+            kwargs["NextToken"] = page["NextToken"]
+
+    memberships = {}
+    for group, usernames in workers.map(members, groups):
+        for username in usernames:
+            memberships.setdefault(username, set()).add(group)
+    return users, memberships
+
+
+def live_named(pool_id, usernames, workers):
+    """live_pool's result for only the named users, looked up one by one."""
+    cognito = cognito_for(pool_id)
+
+    def lookup(username):
+        try:
+            user = call_with_backoff(cognito.admin_get_user, UserPoolId=pool_id, Username=username)
+        except cognito.exceptions.UserNotFoundException:
+            return username, None, set()
+        groups, kwargs = set(), {"UserPoolId": pool_id, "Username": username}
+        while True:
+            page = call_with_backoff(cognito.admin_list_groups_for_user, **kwargs)
+            groups.update(g["GroupName"] for g in page["Groups"])
+            if not page.get("NextToken"):
+                break
+            kwargs["NextToken"] = page["NextToken"]
+        live = {
+            "attributes": {a["Name"]: a["Value"] for a in user.get("UserAttributes", [])},
+            "enabled": user["Enabled"],
+        }
+        return username, live, groups
+
+    users, memberships = {}, {}
+    for username, live, groups in workers.map(lookup, usernames):
+        if live is not None:
+            users[username] = live
+        if groups:
+            memberships[username] = groups
+    return users, memberships
+
+
+def plan_user(item, live_users, memberships):
+    """The smallest list of actions that brings the live user back to its snapshot."""
+    username = item["userId"]
+    live = live_users.get(username)
+    if live is None:
+        return [{"action": "create"}]
+
+    actions = []
+    changed = {
+        k: v for k, v in item.get("attributes", {}).items()
+        if k not in READ_ONLY_ATTRIBUTES and live["attributes"].get(k) != v
+    }
+    if changed:
+        actions.append({"action": "update_attributes", "attributes": changed})
+    wanted, current = set(item.get("groups", [])), memberships.get(username, set())
+    actions += [{"action": "add_group", "group": g} for g in sorted(wanted - current)]
+    actions += [{"action": "remove_group", "group": g} for g in sorted(current - wanted)]
+    if item.get("enabled", True) != live["enabled"]:
+        actions.append({"action": "enable" if item.get("enabled", True) else "disable"})
+    return actions
+
+
+def describe(actions):
+    return ",".join(
+        a["action"] + (f":{a['group']}" if "group" in a else "") for a in actions
+    ) or "none"
+
+
+def create_user(pool_id, item):
+    """Recreate one user from its snapshot; returns False if it already exists."""
+    username = item["userId"]
+    attributes = [
+        {"Name": k, "Value": v}
+        for k, v in item.get("attributes", {}).items()
+        if k not in READ_ONLY_ATTRIBUTES
+    ]
+    groups = item.get("groups", [])
+
     try:
-        response = table.scan()
-        for item in response.get("Items", []):
-            username = item["username"]
-            attributes = [
-                {"Name": k, "Value": v} for k, v in item.get("attributes", {}).items()
-            ]
-            groups = item.get("groups", [])
-            enabled = item.get("enabled", True)
-
-            try:
-                # create user
-                cognito.admin_create_user(
-                    UserPoolId=USER_POOL_ID,
-                    Username=username,
-                    UserAttributes=attributes,
-                    TemporaryPassword=generate_temp_password(),
-                    MessageAction="SUPPRESS",  # don't send invitation email
-                )
-
-                # reset password to force user update on login
-                cognito.admin_set_user_password(
-                    UserPoolId=USER_POOL_ID,
-                    Username=username,
-                    Password=generate_temp_password(),
-                    Permanent=False  # force reset on next login
-                )
-
-                # restore enabled/disabled state
-                if not enabled:
-                    cognito.admin_disable_user(
-                        UserPoolId=USER_POOL_ID, Username=username
-                    )
-
-                # restore groups
-                for group in groups:
-                    cognito.admin_add_user_to_group(
-                        UserPoolId=USER_POOL_ID,
-                        Username=username,
-                        GroupName=group,
-                    )
-
-                logger.info(f"✅ Restored user {username}")
-
-            except cognito.exceptions.UsernameExistsException:
-                logger.info(f"ℹ️ User already exists: {username}")
+        # create user
+        cognito_call(
+            "admin_create_user",
+            UserPoolId=pool_id,
+            Username=username,
+            UserAttributes=attributes,
+            TemporaryPassword=generate_temp_password(),
+            MessageAction="SUPPRESS",  # don't send invitation email
+        )
+    except cognito_for(pool_id).exceptions.UsernameExistsException:
+        return False
+
+    # reset password to force user update on login
+    cognito_call(
+        "admin_set_user_password",
+        UserPoolId=pool_id,
+        Username=username,
+        Password=generate_temp_password(),
+        Permanent=False  # force reset on next login
+    )
+
+    # restore enabled/disabled state
+    if not item.get("enabled", True):
+        cognito_call("admin_disable_user", UserPoolId=pool_id, Username=username)
+
+    # restore groups
+    for group in groups:
+        cognito_call(
+            "admin_add_user_to_group",
+            UserPoolId=pool_id,
+            Username=username,
+            GroupName=group,
+        )
+    return True
+
+
+def apply_action(pool_id, username, action):
+    kind = action["action"]
+    if kind == "update_attributes":
+        cognito_call(
+            "admin_update_user_attributes",
+            UserPoolId=pool_id,
+            Username=username,
+            UserAttributes=[{"Name": k, "Value": v} for k, v in action["attributes"].items()],
+        )
+    elif kind == "add_group":
+        cognito_call("admin_add_user_to_group", UserPoolId=pool_id, Username=username, GroupName=action["group"])
+    elif kind == "remove_group":
+        cognito_call("admin_remove_user_from_group", UserPoolId=pool_id, Username=username, GroupName=action["group"])
+    elif kind == "enable":
+        cognito_call("admin_enable_user", UserPoolId=pool_id, Username=username)
+    elif kind == "disable":
+        cognito_call("admin_disable_user", UserPoolId=pool_id, Username=username)
+
+
+def restore_user(pool_id, item, live_users, memberships, dry_run=False):
+    """Plan, and unless dry_run apply, one user's restore.
+
+    Returns (outcome, plan) where outcome is "created", "updated" or "unchanged".
+    Only the home pool is mirrored in the user directory.
+    """
+    username = item["userId"]
+    actions = plan_user(item, live_users, memberships)
+    outcome = "unchanged" if not actions else "created" if actions[0]["action"] == "create" else "updated"
+    if dry_run or not actions:
+        return outcome, describe(actions)
+
+    if outcome == "created":
+        if not create_user(pool_id, item):
+            return "unchanged", "exists"
+        attributes = item.get("attributes", {})
+    else:
+        for action in actions:
+            apply_action(pool_id, username, action)
+        attributes = {**live_users[username]["attributes"], **item.get("attributes", {})}
+
+    if is_home(pool_id):
+        put_user(username, attributes, role_from_groups(item.get("groups", [])), invalidate=False)
+    return outcome, describe(actions)
+
+
+OUTCOMES = ("created", "updated", "unchanged", "failed")
+
+
+def start_job(pool_id, run):
+    job = {
+        "job_id": run["run_id"],
+        "pool_id": pool_id,
+        "as_of": run["as_of"],
+        "usernames": run.get("usernames"),
+        "dry_run": run["dry_run"],
+        "status": "RUNNING",
+        "segments": [
+            {"scan_key": None, "pending": None, "pages": 0, "done": False}
+            for _ in range(RESTORE_SEGMENTS)
+        ],
+        "chunks": 0,
+        **{outcome: 0 for outcome in OUTCOMES},
+        "failures": [],
+    }
+    usernames = run.get("usernames")
+    if usernames:
+        # Restore only the named users: one query per user instead of a scan.
+        job["segments"] = [
+            {"usernames": usernames[i::RESTORE_SEGMENTS], "position": 0, "pages": 0, "done": False}
+            for i in range(min(RESTORE_SEGMENTS, len(usernames)))
+        ]
+    snapshot = run["snapshots"].get(pool_id)
+    if snapshot:
+        # Restore from an exported snapshot: one segment per data object.
+        manifest = read_manifest(snapshot)
+        job.update(
+            snapshot=snapshot,
+            as_of=manifest["as_of"],
+            compression=manifest["compression"],
+            segments=[{**entry, "position": 0, "pages": 0, "done": False} for entry in manifest["files"]],
+        )
+    return job
+
+
+def resume_job(item):
+    """A checkpoint read back from DynamoDB, with its Decimals turned back into ints."""
+    job = dict(item)
+    for key in ("chunks",) + OUTCOMES:
+        job[key] = int(job[key])
+    for segment in job["segments"]:
+        for key in ("pages", "position", "records", "bytes"):
+            if key in segment:
+                segment[key] = int(segment[key])
+    return job
+
+
+class RestoreRun:
+    """One invocation's share of a restore job.
+
+    The live pool is listed once up front, or for a username-scoped restore
+    only the named users are looked up. Every scan segment is then read by
+    its own thread, diffed against that listing, and the resulting plans are
+    carried out by a shared worker pool; the job checkpoint is written after
+    each page.
+    """
+
+    def __init__(self, job, context, workers):
+        self.job = job
+        self.pool_id = job["pool_id"]
+        self.context = context
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.closing = set()
+        if job.get("usernames"):
+            self.live_users, self.memberships = live_named(self.pool_id, job["usernames"], workers)
+        else:
+            self.live_users, self.memberships = live_pool(self.pool_id, workers)
+
+    def restore(self, item):
+        try:
+            outcome, plan = restore_user(self.pool_id, item, self.live_users, self.memberships, self.job["dry_run"])
+            return item["userId"], outcome, plan, None
+        except ClientError as e:
+            return item["userId"], "failed", None, str(e)
+
+    def finish_page(self, index, ready, missing=(), **progress):
+        """Restore one page of users and checkpoint the segment's new position.
+
+        Named users in `missing` have no snapshot to restore and count as failed.
+        """
+        segment = self.job["segments"][index]
+        results = list(self.workers.map(self.restore, ready))
+        results += [(u, "failed", None, "No snapshot at or before as_of") for u in missing]
+        if results:
+            save_report("restore", self.job["job_id"], f"{index:02d}#{segment['pages']:06d}",
+                        {u: error or f"{outcome}:{plan}" for u, outcome, plan, error in results}, self.pool_id)
+
+        for outcome in OUTCOMES:
+            metrics.count("UsersRestored", sum(r[1] == outcome for r in results), Outcome=outcome)
+        with self.lock:
+            for username, outcome, _, error in results:
+                self.job[outcome] += 1
+                if error and len(self.job["failures"]) < MAX_REPORTED_FAILURES:
+                    self.job["failures"].append({"username": username, "error": error})
+            segment.update(pages=segment["pages"] + 1, **progress)
+            save_checkpoint("restore", self.job, self.pool_id)
+
+    def scan_segment(self, index):
+        segment = self.job["segments"][index]
+        total = len(self.job["segments"])
+        while not segment["done"] and not out_of_time(self.context):
+            kwargs = {"Limit": RESTORE_PAGE_SIZE, "Segment": index, "TotalSegments": total}
+            if segment["scan_key"]:
+                kwargs["ExclusiveStartKey"] = segment["scan_key"]
+            response = call_with_backoff(backup_table().scan, **kwargs)
+
+            ready, pending = reduce_snapshots(
+                response.get("Items", []), self.job["as_of"], segment["pending"], self.pool_id
+            )
+            done = "LastEvaluatedKey" not in response
+            if done:
+                ready.extend(finish_snapshots(pending))
+                pending = None
+            self.finish_page(index, ready, scan_key=response.get("LastEvaluatedKey"), pending=pending, done=done)
+
+    def named_segment(self, index):
+        """Restore the segment's named users, each from its newest snapshot at or before as_of."""
+        segment = self.job["segments"][index]
+        while not segment["done"] and not out_of_time(self.context):
+            start = segment["position"]
+            names = segment["usernames"][start:start + RESTORE_PAGE_SIZE]
+            ready, missing = [], []
+            for username in names:
+                found = call_with_backoff(latest_snapshot, username, self.job["as_of"], self.pool_id)
+                ready.extend(found)
+                if not found:
+                    missing.append(username)
+            position = start + len(names)
+            self.finish_page(index, ready, missing, position=position, done=position >= len(segment["usernames"]))
+
+    def stream_segment(self, index):
+        """Restore one exported snapshot object, reading it as a stream.
+
+        A compressed stream cannot be seeked, so a resumed segment re-reads
+        the records it already restored and skips them.
+        """
+        segment = self.job["segments"][index]
+        if segment["done"]:
+            return
+        wanted = set(self.job.get("usernames") or ())
+        seen = set(segment.get("seen", []))
+        page, position = [], 0
+        for position, record in enumerate(read_records(segment, self.job["compression"]), start=1):
+            if position <= segment["position"] or (wanted and record["userId"] not in wanted):
                 continue
+            page.append(record)
+            if wanted:
+                seen.add(record["userId"])
+            if len(page) == RESTORE_PAGE_SIZE:
+                self.finish_page(index, page, position=position, seen=sorted(seen))
+                page = []
+                if out_of_time(self.context):
+                    return
+        missing = self.unseen(index, seen, wanted) if wanted else ()
+        self.finish_page(index, page, missing, position=position, seen=sorted(seen), done=True)
+
+    def unseen(self, index, seen, wanted):
+        """Named users no segment of the snapshot holds, reported by the last segment to finish."""
+        with self.lock:
+            self.job["segments"][index]["seen"] = sorted(seen)
+            self.closing.add(index)
+            segments = self.job["segments"]
+            if not all(s["done"] or i in self.closing for i, s in enumerate(segments)):
+                return ()
+            found = set().union(*(s.get("seen", []) for s in segments))
+        return sorted(wanted - found)
+
+    def run(self):
+        if self.job.get("snapshot"):
+            read = self.stream_segment
+        elif self.job.get("usernames"):
+            read = self.named_segment
+        else:
+            read = self.scan_segment
+        with ThreadPoolExecutor(max_workers=len(self.job["segments"])) as scanners:
+            for future in [scanners.submit(read, i) for i in range(len(self.job["segments"]))]:
+                future.result()
+        return all(segment["done"] for segment in self.job["segments"])
+
+
+def restore_pool(pool_id, run, context):
+    """Run one chunk of a pool's restore job; returns the pool's result for the run report."""
+    try:
+        job = load_checkpoint("restore", pool_id)
+        if job:
+            job = resume_job({"pool_id": pool_id, **job})
+            logger.info(f"Resuming restore {job['job_id']} of {pool_id}")
+        else:
+            job = start_job(pool_id, run)
+            logger.info(f"Starting {'dry-run ' if job['dry_run'] else ''}restore {job['job_id']} of {pool_id} "
+                        f"over {len(job['segments'])} segments")
+
+        job["chunks"] += 1
+        job["lease_until"] = lease_until(context)
+        save_checkpoint("restore", job, pool_id)
+
+        with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as workers:
+            finished = RestoreRun(job, context, workers).run()
+
+        report = {
+            "job_id": job["job_id"],
+            "dry_run": job["dry_run"],
+            **{outcome: job[outcome] for outcome in OUTCOMES},
+            "failures": job["failures"],
+        }
+        if not finished:
+            job["lease_until"] = 0
+            save_checkpoint("restore", job, pool_id)
+            return {"status": "IN_PROGRESS", "report": report}
+
+        if is_home(pool_id) and not job["dry_run"] and (job["created"] or job["updated"]):
+            bump_directory_version()
+        clear_checkpoint("restore", pool_id)
+        logger.info(f"🎉 Restore of {pool_id} completed: {report}")
+        return {"status": "SUCCESS" if not job["failed"] else "PARTIAL", "report": report}
+
+    except (ClientError, ValueError) as e:
+        logger.error(f"❌ Restore of {pool_id} failed: {str(e)}")
+        return {"status": "ERROR", "details": str(e)}
+
+
+def start_run(event):
+    """A restore over the requested pools, or over the pools of the given exported snapshots."""
+    prefixes = event.get("snapshots") or ([event["snapshot"]] if event.get("snapshot") else [])
+    usernames = event.get("usernames")
+    if usernames is not None:
+        if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) and u for u in usernames):
+            raise ValueError("usernames must be a non-empty list of usernames")
+        if len(usernames) > RESTORE_MAX_USERNAMES:
+            raise ValueError(f"At most {RESTORE_MAX_USERNAMES} usernames per restore")
+        usernames = list(dict.fromkeys(usernames))
+    snapshots = {read_manifest(prefix)["user_pool_id"]: prefix for prefix in prefixes}
+    return {
+        "run_id": now_iso(),
+        "pools": select_pools(list(snapshots) or event.get("pools")),
+        "snapshots": snapshots,
+        "as_of": event.get("as_of"),
+        "usernames": usernames,
+        "dry_run": bool(event.get("dry_run")),
+        "results": {},
+        "chunks": 0,
+    }
+
+
+def save_run(run, only_if_new=False):
+    return save_checkpoint("restore_run", {**run, "results": json.dumps(run["results"])}, only_if_new=only_if_new)
+
+
+def run_report(run, results):
+    """One report for the whole run: every pool's outcome plus totals over all of them."""
+    reports = [r["report"] for r in results.values() if "report" in r]
+    return {
+        "run_id": run["run_id"],
+        "dry_run": run["dry_run"],
+        "pools": results,
+        **{outcome: sum(r[outcome] for r in reports) for outcome in OUTCOMES},
+    }
+
+
+@metrics.metered
+def lambda_handler(event, context):
+    """Restore Cognito users from DynamoDB backup.
+
+    Uses each user's newest snapshot, or the newest at or before event["as_of"].
+    Without {"usernames": [...]} that applies to every user in the pool: an
+    as_of restore rolls the whole pool back to that time, undoing later
+    changes to users that are still live. To bring back only some users,
+    e.g. those removed by a delete with "backup": true, name them:
+    {"as_of": backup_date, "usernames": [...]}. Their snapshots are then
+    looked up one query each, and a named user without one is reported as
+    failed.
+    The live pool and its group memberships are bulk-listed and diffed against
+    the snapshots, so only missing users are created and only drifted
+    attributes, groups and enabled state are changed; an intact pool costs
+    reads only. With {"dry_run": true} the plan is reported but not applied.
+
+    The backup table is read with a parallel segmented scan and plans are
+    applied by a worker pool held under per-API rate limits. It runs as a
+    chunked job: each segment's LastEvaluatedKey and the progress counts are
+    checkpointed after every page, and the function re-invokes itself with
+    {"resume": run_id, "resume_token": ...} before it runs out of time; a
+    chunk claims the run conditionally, as in backup, so duplicated resume
+    events are skipped. A restore that died part-way resumes from its
+    checkpoint. Per-user outcomes and plans are
+    stored as REPORT items under the restore state key.
+
+    With {"snapshot": prefix} the users come from an exported snapshot in
+    SNAPSHOT_BUCKET instead of the table, streamed and checked against its
+    manifest.
+
+    A run restores every configured pool (USER_POOL_ID and BACKUP_POOL_IDS),
+    the subset given as {"pools": [...]}, or the pools of {"snapshots":
+    [prefix, ...]}. Pools are restored side by side, each with its own
+    RESTORE_WORKERS threads and rate limits, and the run ends with one
+    report over all of them, stored as a RUN item. Only the home pool is
+    mirrored in the user directory.
+    """
+    event = event or {}
+    try:
+        lease = lease_until(context)
+        run = load_checkpoint("restore_run")
+        if run:
+            token = event.get("resume_token") if event.get("resume") == run["run_id"] else None
+            fresh = claim_run("restore_run", lease, token)
+            if fresh is None:
+                logger.info(f"Restore run {run['run_id']} is held by another invocation, skipping this one")
+                return {"status": "SKIPPED", "job_id": run["run_id"]}
+            run = {**run, "chunks": int(run["chunks"]), "results": json.loads(run["results"]), "resume_token": fresh}
+            logger.info(f"Resuming restore run {run['run_id']}")
+        elif event.get("resume"):
+            logger.info(f"Restore run {event['resume']} has already finished, skipping this invocation")
+            return {"status": "SKIPPED", "job_id": event["resume"]}
+        else:
+            run = {**start_run(event), "lease_until": lease}
+            if not save_run(run, only_if_new=True):
+                logger.info("Another restore run started at the same time, skipping this invocation")
+                return {"status": "SKIPPED"}
+            logger.info(f"Starting restore run {run['run_id']} over {len(run['pools'])} pools")
+
+        run["chunks"] += 1
+        run["lease_until"] = lease
+        save_run(run)
+
+        pending = [p for p in run["pools"] if p not in run["results"]]
+        with ThreadPoolExecutor(max_workers=max(1, min(RESTORE_POOL_CONCURRENCY, len(pending)))) as pools:
+            results = dict(zip(pending, pools.map(lambda pool_id: restore_pool(pool_id, run, context), pending)))
+        run["results"].update({p: r for p, r in results.items() if r["status"] != "IN_PROGRESS"})
+
+        if len(run["results"]) < len(run["pools"]):
+            resume = handoff(run)
+            save_run(run)
+            continue_async(context, resume)
+            return {"status": "IN_PROGRESS", "report": run_report(run, {**run["results"], **results})}
 
-        logger.info("🎉 Restore completed successfully")
-        return {"status": "SUCCESS"}
+        report = run_report(run, run["results"])
+        save_run_report("restore", run["run_id"], report)
+        clear_checkpoint("restore_run")
+        logger.info(f"🎉 Restore run {run['run_id']} completed: {report}")
+        statuses = {r["status"] for r in run["results"].values()}
+        return {"status": "SUCCESS" if statuses == {"SUCCESS"} else "PARTIAL", "report": report}
 
-    except ClientError as e:
+    except (ClientError, ValueError) as e:
         logger.error(f"❌ Restore failed: {str(e)}")
         return {"status": "ERROR", "details": str(e)}
@@ -1,41 +1,61 @@
 import os
+import random
+import logging
+from cors import ALLOWED_ORIGINS, CORS_MAX_AGE_SECONDS, MAX_CACHED_ORIGINS, is_allowed
 
-AMPLIFY_PROD_DOMAIN = os.environ["AMPLIFY_PROD_DOMAIN"]
-AMPLIFY_DEV_DOMAIN = os.environ["AMPLIFY_DEV_DOMAIN"]
-AMPLIFY_LOCAL_DOMAIN = os.environ["AMPLIFY_LOCAL_DOMAIN"]
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
-ALLOWED_ORIGINS = [
-	AMPLIFY_LOCAL_DOMAIN,
-	AMPLIFY_DEV_DOMAIN,
-	AMPLIFY_PROD_DOMAIN
-] 
+LOG_SAMPLE_RATE = float(os.environ.get("PREFLIGHT_LOG_SAMPLE_RATE", "0.01"))
 
 CORS_HEADERS = {		
-	"Access-Control-Allow-Headers": "Content-Type,Authorization,X-Amz-Date",
-	"Access-Control-Allow-Methods": "OPTIONS,GET,POST,PUT,DELETE"
+	"Access-Control-Allow-Headers": "Content-Type,Authorization,X-Amz-Date,Idempotency-Key",
+	"Access-Control-Allow-Methods": "OPTIONS,GET,POST,PUT,DELETE",
+	"Access-Control-Max-Age": CORS_MAX_AGE_SECONDS,
+	"Vary": "Origin",
 }
 
+
+def _allowed_response(origin):
+	return {"statusCode": 200, "headers": {**CORS_HEADERS, "Access-Control-Allow-Origin": origin}, "body": ""}
+
+
+# Responses are built once and only ever returned, never modified, so one
+# request's origin cannot leak into another's headers.
+RESPONSES = {origin: _allowed_response(origin) for origin in ALLOWED_ORIGINS}
+# Still return CORS headers to prevent browser from blocking error visibility
+FORBIDDEN = {
+	"statusCode": 403,
+	"headers": {**CORS_HEADERS, "Access-Control-Allow-Origin": "*", "Access-Control-Max-Age": "0"},
+	"body": "Origin not allowed",
+}
+_denied_logged = set()
+
+
+def response_for(origin):
+	response = RESPONSES.get(origin)
+	if response is not None:
+		return response
+	if is_allowed(origin):
+		response = _allowed_response(origin)
+		if len(RESPONSES) < len(ALLOWED_ORIGINS) + MAX_CACHED_ORIGINS:
+			RESPONSES[origin] = response
+		return response
+	return FORBIDDEN
+
+
 def handler(event, context):
-	# Normalize headers to lowercase
-	headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
-	origin = headers.get("origin")
-	
-	print(f"HEADERS: {event.get('headers')}")
-	print(f"Received OPTIONS request from origin: {origin}")
-
-
-	if origin in ALLOWED_ORIGINS:
-		CORS_HEADERS.update({"Access-Control-Allow-Origin": origin})			
-		return {
-			"statusCode": 200,
-			"headers": CORS_HEADERS,
-			"body": ""
-		}
-	else:
-		# Still return CORS headers to prevent browser from blocking error visibility
-		CORS_HEADERS.update({"Access-Control-Allow-Origin": "*"})			
-		return {
-			"statusCode": 403,
-			"headers": CORS_HEADERS,
-			"body": "Origin not allowed"
-		}
\ No newline at end of file
+	headers = event.get("headers") or {}
+	origin = headers.get("origin") or headers.get("Origin")
+	if origin is None:
+		# Normalize headers to lowercase only for unusual casings
+		origin = {k.lower(): v for k, v in headers.items()}.get("origin")
+
+	response = response_for(origin)
+	if response is FORBIDDEN:
+		if origin not in _denied_logged and len(_denied_logged) < MAX_CACHED_ORIGINS:
+			_denied_logged.add(origin)
+			logger.warning(f"Rejected OPTIONS request from origin: {origin}")
+	elif random.random() < LOG_SAMPLE_RATE:
+		logger.info(f"Received OPTIONS request from origin: {origin} (sampled)")
+	return response
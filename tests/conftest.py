@@ -0,0 +1,78 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# Lambda puts the layer's python/ directory on the path; do the same here.
+sys.path.insert(0, os.path.join(ROOT, "src", "layers", "python"))
+# The benchmarks' in-process AWS stand-ins double as test fakes.
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+OPS_TABLE = "ops-state"
+BACKUP_TABLE = "backups"
+
+
+def load_module(path, name):
+    """Import a file as a fresh module of its own, leaving sys.modules alone."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def load_function(monkeypatch):
+    """load_function("delete") imports src/delete/app.py as its own module."""
+    monkeypatch.setenv("USER_POOL_ID", "eu-central-1_test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+
+    def load(directory):
+        path = os.path.join(ROOT, "src", directory)
+        monkeypatch.syspath_prepend(path)
+        return load_module(os.path.join("src", directory, "app.py"), f"test_{directory}_app")
+
+    return load
+
+
+@pytest.fixture
+def faults():
+    from stand_ins import Faults
+
+    return Faults()
+
+
+@pytest.fixture
+def dynamodb(monkeypatch, faults):
+    """Fake ops-state and backup tables behind aws_clients.table()."""
+    import aws_clients
+    from stand_ins import FakeDynamoResource, FakeTable
+
+    tables = {
+        OPS_TABLE: FakeTable(OPS_TABLE, "pk", faults=faults),
+        BACKUP_TABLE: FakeTable(BACKUP_TABLE, "userId", "backupDate", faults=faults),
+    }
+    monkeypatch.setattr(aws_clients, "_tables", {})
+    monkeypatch.setitem(aws_clients._resources, ("dynamodb", None), FakeDynamoResource(tables.values()))
+    return tables
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """fake_client("s3", FakeS3(...)) makes aws_clients.client("s3") return the stand-in."""
+    import aws_clients
+
+    def install(service, stand_in):
+        monkeypatch.setitem(aws_clients._clients, (service, None), stand_in)
+        return stand_in
+
+    return install
+
+
+@pytest.fixture
+def context():
+    from stand_ins import FakeContext
+
+    return FakeContext("test-function")
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from api import Request
+
+
+@pytest.fixture
+def app(load_function):
+    return load_function("admin_invite")
+
+
+def parse(app, body, content_type="application/json"):
+    return app.parse_rows(Request({"body": body, "headers": {"Content-Type": content_type}}))
+
+
+def row(**fields):
+    return {"email": "ana@example.com", "name": "Ana", "region": "North", "city": "City01", "role": "Admin", **fields}
+
+
+def test_single_invite(app):
+    assert parse(app, json.dumps(row())) == ([row()], False)
+
+
+def test_json_array_and_users_list_are_batches(app):
+    assert parse(app, json.dumps([row()])) == ([row()], True)
+    assert parse(app, json.dumps({"users": [row()]})) == ([row()], True)
+
+
+def test_csv_upload(app):
+    text = "﻿Email, Name ,Region,City,Role\nana@example.com, Ana ,North,City01,Admin\n"
+    assert parse(app, text, "text/csv; charset=utf-8") == ([row()], True)
+
+
+def test_csv_in_json(app):
+    body = json.dumps({"csv": "email,name,region,city,role\nana@example.com,Ana,North,City01,Admin\n"})
+    assert parse(app, body) == ([row()], True)
+
+
+def test_short_csv_row_gets_empty_fields(app):
+    rows, _ = parse(app, "email,name,region\nana@example.com\n", "text/csv")
+    assert rows == [{"email": "ana@example.com", "name": "", "region": ""}]
+
+
+@pytest.mark.parametrize("body", ['"ana"', "42", "null", json.dumps({"csv": ["a"]})])
+def test_unusable_body_is_rejected(app, body):
+    with pytest.raises(ValueError):
+        parse(app, body)
+
+
+def test_malformed_json_is_rejected(app):
+    with pytest.raises(ValueError):
+        parse(app, "{not json")
+
+
+def test_valid_rows_have_no_errors(app):
+    assert app.validate_rows([row(), row(email="bo@example.com", role="CityOfficial")]) == []
+
+
+def test_every_bad_row_is_reported(app):
+    rows = [
+        "ana@example.com",
+        row(name=""),
+        row(name=7),
+        row(role="Citizen"),
+        row(email="not-an-email"),
+        row(),
+        row(email="ANA@example.com"),
+    ]
+    assert app.validate_rows(rows) == [
+        {"row": 0, "error": "Row must be an object"},
+        {"row": 1, "error": "Missing name"},
+        {"row": 2, "error": "name must be text"},
+        {"row": 3, "error": "Only Admin or CityOfficial allowed"},
+        {"row": 4, "error": "Invalid email"},
+        {"row": 6, "error": "Duplicate email in batch"},
+    ]
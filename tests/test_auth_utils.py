@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+
+import pytest
+
+import auth_utils
+from auth_utils import InvalidToken, TokenVerifier
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_TEST"
+CLIENT_ID = "test-client"
+
+
+def _is_probable_prime(n, rng, rounds=20):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(rng.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits, rng):
+    while True:
+        candidate = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _is_probable_prime(candidate, rng):
+            return candidate
+
+
+def generate_rsa_key(bits=1024, seed=None):
+    """Return (n, e, d) for a fresh RSA key; small and pure Python, for tests only."""
+    rng = random.Random(seed)
+    e = 65537
+    while True:
+        p, q = _prime(bits // 2, rng), _prime(bits // 2, rng)
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % e:
+            return p * q, e, pow(e, -1, phi)
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64url_int(value):
+    return b64url(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def sign(key, message):
+    n, _, d = key
+    size = (n.bit_length() + 7) // 8
+    digest = auth_utils.SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    encoded = b"\x00\x01" + b"\xff" * (size - len(digest) - 3) + b"\x00" + digest
+    return pow(int.from_bytes(encoded, "big"), d, n).to_bytes(size, "big")
+
+
+def make_token(key, kid="key-1", **overrides):
+    claims = {
+        "iss": ISSUER,
+        "aud": CLIENT_ID,
+        "token_use": "id",
+        "exp": int(time.time()) + 3600,
+        "cognito:groups": ["Admin"],
+    }
+    claims.update(overrides)
+    header = b64url(json.dumps({"alg": "RS256", "kid": kid}).encode())
+    payload = b64url(json.dumps(claims).encode())
+    signature = b64url(sign(key, f"{header}.{payload}".encode()))
+    return f"{header}.{payload}.{signature}"
+
+
+def jwks(key, kid="key-1"):
+    n, e, _ = key
+    return {"keys": [{"kty": "RSA", "kid": kid, "n": b64url_int(n), "e": b64url_int(e)}]}
+
+
+@pytest.fixture(scope="module")
+def key():
+    return generate_rsa_key(seed=1)
+
+
+@pytest.fixture(scope="module")
+def other_key():
+    return generate_rsa_key(seed=2)
+
+
+@pytest.fixture
+def loads():
+    return []
+
+
+@pytest.fixture
+def verifier(key, loads):
+    def loader():
+        loads.append(time.monotonic())
+        return jwks(key)
+
+    return TokenVerifier(ISSUER, [CLIENT_ID], jwks_loader=loader)
+
+
+def test_valid_token_returns_claims(key, verifier):
+    claims = verifier.verify(make_token(key))
+    assert claims["iss"] == ISSUER
+    assert claims["cognito:groups"] == ["Admin"]
+
+
+def test_access_token_checks_client_id(key, verifier):
+    token = make_token(key, token_use="access", aud=None, client_id=CLIENT_ID)
+    assert verifier.verify(token)["client_id"] == CLIENT_ID
+
+
+def test_verified_token_is_cached(key, verifier, loads):
+    token = make_token(key)
+    assert verifier.verify(token) is verifier.verify(token)
+    assert len(loads) == 1
+
+
+def test_expired_token_is_rejected(key, verifier):
+    token = make_token(key, exp=int(time.time()) - auth_utils.JWT_LEEWAY_SECONDS - 10)
+    with pytest.raises(InvalidToken, match="expired"):
+        verifier.verify(token)
+
+
+def test_token_within_leeway_is_accepted(key, verifier):
+    assert verifier.verify(make_token(key, exp=int(time.time()) - 1))
+
+
+def test_wrong_audience_is_rejected(key, verifier):
+    with pytest.raises(InvalidToken, match="another client"):
+        verifier.verify(make_token(key, aud="someone-else"))
+
+
+def test_wrong_issuer_is_rejected(key, verifier):
+    with pytest.raises(InvalidToken, match="issuer"):
+        verifier.verify(make_token(key, iss="https://cognito-idp.eu-west-1.amazonaws.com/other"))
+
+
+def test_unexpected_token_use_is_rejected(key, verifier):
+    with pytest.raises(InvalidToken, match="token_use"):
+        verifier.verify(make_token(key, token_use="refresh"))
+
+
+def test_signature_from_another_key_is_rejected(other_key, verifier):
+    with pytest.raises(InvalidToken, match="signature"):
+        verifier.verify(make_token(other_key))
+
+
+def test_tampered_payload_is_rejected(key, verifier):
+    header, _, signature = make_token(key).split(".")
+    forged = b64url(json.dumps({"iss": ISSUER, "aud": CLIENT_ID, "token_use": "id",
+                                "exp": int(time.time()) + 3600}).encode())
+    with pytest.raises(InvalidToken, match="signature"):
+        verifier.verify(f"{header}.{forged}.{signature}")
+
+
+def test_unsupported_alg_is_rejected(key, verifier):
+    _, payload, signature = make_token(key).split(".")
+    header = b64url(json.dumps({"alg": "none", "kid": "key-1"}).encode())
+    with pytest.raises(InvalidToken, match="alg"):
+        verifier.verify(f"{header}.{payload}.{signature}")
+
+
+def test_malformed_token_is_rejected(verifier):
+    with pytest.raises(InvalidToken, match="Malformed"):
+        verifier.verify("not-a-jwt")
+
+
+def test_unknown_kid_is_rejected_and_refetch_is_rate_limited(key, verifier, loads):
+    verifier.verify(make_token(key))
+    for _ in range(3):
+        with pytest.raises(InvalidToken, match="Unknown signing key"):
+            verifier.verify(make_token(key, kid="rotated"))
+    assert len(loads) == 1
+
+
+def test_unknown_kid_refetches_after_interval(key, verifier, loads):
+    verifier.verify(make_token(key))
+    verifier.keys_loaded_at -= auth_utils.JWKS_REFRESH_INTERVAL_SECONDS
+    with pytest.raises(InvalidToken, match="Unknown signing key"):
+        verifier.verify(make_token(key, kid="rotated"))
+    assert len(loads) == 2
+
+
+def test_jwks_fetch_does_not_hold_cache_lock(key):
+    fetching, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        fetching.set()
+        release.wait(5)
+        return jwks(key)
+
+    verifier = TokenVerifier(ISSUER, [CLIENT_ID], jwks_loader=slow_loader)
+    cached = make_token(key, sub="cached-session")
+    verifier.verified[hashlib.sha256(cached.encode()).digest()] = {"exp": time.time() + 60}
+
+    worker = threading.Thread(target=verifier.verify, args=(make_token(key),))
+    worker.start()
+    try:
+        assert fetching.wait(5)
+        assert verifier.lock.acquire(timeout=1)
+        verifier.lock.release()
+        assert verifier.verify(cached)["exp"]
+    finally:
+        release.set()
+        worker.join(5)
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import backup_store
+from conftest import BACKUP_TABLE
+
+HOME = "eu-central-1_home"
+OTHER = "eu-west-1_other"
+
+
+@pytest.fixture(autouse=True)
+def pools(monkeypatch):
+    monkeypatch.setattr(backup_store, "HOME_POOL_ID", HOME)
+    monkeypatch.setattr(backup_store, "POOL_IDS", [HOME, OTHER])
+
+
+@pytest.fixture
+def checkpoints(monkeypatch, dynamodb):
+    monkeypatch.setattr(backup_store, "BACKUP_TABLE", BACKUP_TABLE)
+    return dynamodb[BACKUP_TABLE]
+
+
+def test_home_pool_keys_are_unprefixed():
+    assert backup_store.user_key("alice", HOME) == "alice"
+    assert backup_store.user_key("alice") == "alice"
+    assert backup_store.split_user_key("alice") == (HOME, "alice")
+
+
+def test_other_pool_keys_round_trip():
+    key = backup_store.user_key("alice", OTHER)
+    assert key == f"{OTHER}#alice"
+    assert backup_store.split_user_key(key) == (OTHER, "alice")
+
+
+def test_home_username_containing_hash_stays_in_home_pool():
+    assert backup_store.split_user_key("john_doe#1@example.com") == (HOME, "john_doe#1@example.com")
+
+
+def test_dropped_pool_is_recognised_by_its_id_shape():
+    assert backup_store.split_user_key("us-east-1_Gone#bob") == ("us-east-1_Gone", "bob")
+
+
+def test_other_pool_username_may_contain_hash():
+    assert backup_store.split_user_key(f"{OTHER}#a#b") == (OTHER, "a#b")
+
+
+def test_reserved_looking_home_username_is_kept_apart_from_bookkeeping():
+    key = backup_store.user_key("__backup_state__")
+    assert key == f"{HOME}#__backup_state__"
+    assert not backup_store.is_reserved(key)
+    assert backup_store.split_user_key(key) == (HOME, "__backup_state__")
+
+
+def test_reserved_looking_home_username_is_restored():
+    items = [
+        backup_store.snapshot_item("__bob", "2024-05-01T00:00:00Z"),
+        {**backup_store.STATE_KEY, "last_full": "2024-05-01T00:00:00Z"},
+    ]
+    ready, pending = backup_store.reduce_snapshots(items)
+    assert [i["userId"] for i in ready + backup_store.finish_snapshots(pending)] == ["__bob"]
+
+
+def test_select_pools_rejects_unconfigured_pool():
+    assert backup_store.select_pools() == [HOME, OTHER]
+    assert backup_store.select_pools([OTHER, OTHER]) == [OTHER]
+    with pytest.raises(ValueError):
+        backup_store.select_pools(["eu-west-1_unknown"])
+
+
+def test_new_run_is_only_started_once(checkpoints):
+    assert backup_store.save_checkpoint("backup", {"run_id": "a"}, only_if_new=True)
+    assert not backup_store.save_checkpoint("backup", {"run_id": "b"}, only_if_new=True)
+    assert backup_store.load_checkpoint("backup")["run_id"] == "a"
+
+
+def test_claim_needs_a_checkpoint(checkpoints):
+    assert backup_store.claim_run("backup", int(time.time()) + 60) is None
+
+
+def test_handed_off_run_is_claimed_only_with_its_token(checkpoints):
+    run = {"run_id": "a"}
+    resume = backup_store.handoff(run)
+    backup_store.save_checkpoint("backup", run)
+    lease = int(time.time()) + 60
+
+    assert backup_store.claim_run("backup", lease) is None
+    assert backup_store.claim_run("backup", lease, "stale") is None
+    fresh = backup_store.claim_run("backup", lease, resume["resume_token"])
+    assert fresh not in (None, resume["resume_token"])
+    # The token rotated, so a replay of the same resume event is turned away.
+    assert backup_store.claim_run("backup", lease, resume["resume_token"]) is None
+
+
+def test_lapsed_lease_can_be_claimed_without_token(checkpoints):
+    backup_store.save_checkpoint("backup", {"run_id": "a", "lease_until": int(time.time()) - 1, "resume_token": "t"})
+    assert backup_store.claim_run("backup", int(time.time()) + 60) is not None
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import load_module
+
+
+@pytest.fixture
+def cors(monkeypatch):
+    monkeypatch.setenv("AMPLIFY_LOCAL_DOMAIN", "http://localhost:3000")
+    monkeypatch.setenv("AMPLIFY_DEV_DOMAIN", "")
+    monkeypatch.setenv("AMPLIFY_PROD_DOMAIN", "")
+    monkeypatch.setenv("CORS_EXTRA_ORIGINS", "https://*.example.com, https://app.*.example.org")
+    return load_module("src/layers/python/cors.py", "cors_under_test")
+
+
+@pytest.mark.parametrize("origin", [
+    "http://localhost:3000",
+    "https://app.example.com",
+    "https://pr-12.preview.example.com",
+    "https://app.eu.example.org",
+])
+def test_allowed(cors, origin):
+    assert cors.is_allowed(origin)
+    assert cors.cors_headers(origin, "OPTIONS,GET")["Access-Control-Allow-Origin"] == origin
+
+
+@pytest.mark.parametrize("origin", [
+    None,
+    "",
+    "http://localhost:3001",
+    "https://example.com",
+    "http://app.example.com",
+    "https://app.example.com:8443",
+    "https://app.example.com.evil.net",
+    "https://evil.net/.example.com",
+    "https://app.example.org",
+    "https://app..example.com",
+])
+def test_rejected(cors, origin):
+    assert not cors.is_allowed(origin)
+    assert "Access-Control-Allow-Origin" not in cors.cors_headers(origin, "OPTIONS,GET")
+
+
+def test_verdicts_are_cached_up_to_a_limit(cors, monkeypatch):
+    monkeypatch.setattr(cors, "MAX_CACHED_ORIGINS", 2)
+    for i in range(5):
+        cors.is_allowed(f"https://site{i}.example.com")
+    assert len(cors._pattern_matches) == 2
+    assert cors.is_allowed("https://site4.example.com")
+
+
+def test_headers_vary_on_origin(cors):
+    headers = cors.cors_headers("https://app.example.com", "OPTIONS,POST")
+    assert headers["Vary"] == "Origin"
+    assert headers["Access-Control-Allow-Methods"] == "OPTIONS,POST"
+    assert "Idempotency-Key" in headers["Access-Control-Allow-Headers"]
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import api
+import idempotency
+
+
+@pytest.fixture
+def app(load_function, monkeypatch):
+    monkeypatch.setattr(api, "is_admin", lambda event: True)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_ENABLED", False)
+    return load_function("delete")
+
+
+def test_cutoff_with_z_suffix(app):
+    assert app.parse_cutoff("2024-05-01T12:00:00Z") == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+
+
+def test_cutoff_without_offset_is_utc(app):
+    assert app.parse_cutoff("2024-05-01T12:00:00") == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    assert app.parse_cutoff("2024-05-01") == datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def test_cutoff_offset_is_converted_to_utc(app):
+    cutoff = app.parse_cutoff("2024-05-01T14:00:00+02:00")
+    assert cutoff == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    assert cutoff.utcoffset().total_seconds() == 0
+
+
+@pytest.mark.parametrize("value", [None, 1714564800, "yesterday", "2024-13-01"])
+def test_bad_cutoff_is_rejected(app, value):
+    with pytest.raises(ValueError):
+        app.parse_cutoff(value)
+
+
+@pytest.mark.parametrize("body, message", [
+    ({"filter": "Admin"}, "'filter' needs at least one of"),
+    ({"filter": {}}, "'filter' needs at least one of"),
+    ({"filter": {"role": ""}}, "'filter' needs at least one of"),
+    ({"filter": {"role": "Admin", "team": "x"}}, "Unknown filter fields: team"),
+    ({"filter": {"role": ["Admin"]}}, "Filter fields must be strings: role"),
+    ({"filter": {"last_modified_before": "soon"}}, "'last_modified_before' must be an ISO 8601 timestamp"),
+    ({"usernames": "alice"}, "'usernames' must be a list of usernames"),
+    ({"usernames": ["alice", ""]}, "'usernames' must be a list of usernames"),
+    ({"usernames": ["alice", 7]}, "'usernames' must be a list of usernames"),
+])
+def test_bulk_request_is_validated_before_anything_runs(app, context, body, message):
+    status, response = app.bulk_delete(body, context)
+    assert status == 400
+    assert response["message"].startswith(message)
+
+
+def test_too_many_usernames(app, context, monkeypatch):
+    monkeypatch.setattr(app, "DELETE_MAX_USERNAMES", 2)
+    status, response = app.bulk_delete({"usernames": ["a", "b", "c"]}, context)
+    assert status == 400
+
+
+@pytest.mark.parametrize("body", ["[]", "\"alice\"", "null", "42"])
+def test_body_must_be_an_object(app, context, body):
+    response = app.delete_request({"httpMethod": "DELETE", "body": body}, context)
+    assert response["statusCode"] == 400
+    assert json.loads(response["body"]) == {"message": "Request body must be a JSON object"}
+
+
+def test_username_is_required(app, context):
+    response = app.delete_request({"httpMethod": "DELETE", "body": "{}"}, context)
+    assert response["statusCode"] == 400
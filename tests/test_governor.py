@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+import governor
+from conftest import OPS_TABLE
+
+POOL = "eu-central-1_test"
+
+
+@pytest.fixture(autouse=True)
+def quota(monkeypatch, dynamodb):
+    monkeypatch.setattr(governor, "GOVERNOR_ENABLED", True)
+    monkeypatch.setattr(governor, "OPS_STATE_TABLE", OPS_TABLE)
+    monkeypatch.setattr(governor, "_buckets", {})
+    monkeypatch.setattr(governor, "_priority", governor.INTERACTIVE)
+    return dynamodb[OPS_TABLE]
+
+
+def drain(bucket):
+    taken = 0
+    while bucket.take():
+        taken += 1
+    return taken
+
+
+def test_lease_is_spent_locally():
+    bucket = governor.Bucket(POOL, "UserList")
+    assert not bucket.take()
+    assert bucket.lease(governor.INTERACTIVE) == 0
+    assert drain(bucket) == bucket.lease_size
+
+
+def test_leases_draw_down_the_shared_bucket(quota):
+    first, second = governor.Bucket(POOL, "UserList"), governor.Bucket(POOL, "UserList")
+    first.lease(governor.INTERACTIVE)
+    second.lease(governor.INTERACTIVE)  # starts from what first left in the table
+    item = quota.get_item(Key=first.key)["Item"]
+    assert float(item["tokens"]) == pytest.approx(first.capacity - 2 * first.lease_size, abs=1)
+
+
+def test_stale_view_cannot_overspend(quota):
+    first, second = governor.Bucket(POOL, "UserList"), governor.Bucket(POOL, "UserList")
+    first.lease(governor.INTERACTIVE)
+    time.sleep(0.002)  # the millisecond stamp is what tells the two leases apart
+    second.lease(governor.INTERACTIVE)
+    drain(first)
+    # first still believes half the bucket is left; its conditional update
+    # fails, it rereads the now empty bucket and has to wait.
+    assert first.lease(governor.INTERACTIVE) > 0
+    assert drain(first) == 0
+
+
+def test_batch_cannot_take_the_reserve(quota):
+    bucket = governor.Bucket(POOL, "UserList")
+    reserve = bucket.capacity * governor.BATCH_RESERVE
+    quota.put_item(Item={**bucket.key, "tokens": governor._number(reserve), "stamp": governor._number(time.time())})
+
+    assert governor.Bucket(POOL, "UserList").lease(governor.BATCH) > 0
+    interactive = governor.Bucket(POOL, "UserList")
+    assert interactive.lease(governor.INTERACTIVE) == 0
+    assert drain(interactive) > 0
+
+
+def test_empty_bucket_refills_at_the_rate(quota):
+    bucket = governor.Bucket(POOL, "UserList")
+    quota.put_item(Item={**bucket.key, "tokens": governor._number(0), "stamp": governor._number(time.time())})
+    wait = bucket.lease(governor.INTERACTIVE)
+    assert 0 < wait <= 1 / bucket.rate + 0.01
+
+
+def test_unreachable_bucket_still_holds_the_container_to_the_rate(monkeypatch):
+    bucket = governor.Bucket(POOL, "UserList")
+    monkeypatch.setattr(governor, "OPS_STATE_TABLE", "missing")
+    assert bucket.lease(governor.INTERACTIVE) == 0
+    assert drain(bucket) == bucket.lease_size
+    assert bucket.lease(governor.INTERACTIVE) > 0
+
+
+def test_acquire_records_the_wait_for_this_thread(quota):
+    bucket = governor._bucket(POOL, "UserList")
+    quota.put_item(Item={**bucket.key, "tokens": governor._number(0), "stamp": governor._number(time.time())})
+    before = governor.wait_seconds()
+    governor.acquire(POOL, "ListUsers")
+    assert governor.wait_seconds() - before > 0
+
+
+def test_unknown_operations_are_not_governed(quota):
+    governor.acquire(POOL, "GetUser")
+    governor.acquire(None, "ListUsers")
+    assert not quota.partitions
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+import pytest
+
+import idempotency
+from api import Request
+from conftest import OPS_TABLE
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch, dynamodb):
+    monkeypatch.setattr(idempotency, "OPS_STATE_TABLE", OPS_TABLE)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_ENABLED", True)
+    monkeypatch.setattr(idempotency, "_cache", OrderedDict())
+    return dynamodb[OPS_TABLE]
+
+
+def request(body='{"email": "a@example.com"}', key=None, caller="admin-1", method="POST"):
+    headers = {"Idempotency-Key": key} if key else {}
+    return Request({
+        "httpMethod": method,
+        "path": "/invite",
+        "body": body,
+        "headers": headers,
+        "requestContext": {"authorizer": {"claims": {"sub": caller}}},
+    })
+
+
+def counting(status=201):
+    calls = []
+
+    @idempotency.idempotent("invite")
+    def handler(request, context):
+        calls.append(request)
+        return status, {"call": len(calls)}
+
+    return handler, calls
+
+
+def test_retry_with_key_is_replayed(context):
+    handler, calls = counting()
+    assert handler(request(key="k1"), context) == (201, {"call": 1})
+    assert handler(request(key="k1"), context) == (201, {"call": 1})
+    assert len(calls) == 1
+
+
+def test_replay_survives_a_cold_container(context, monkeypatch):
+    handler, calls = counting()
+    handler(request(key="k1"), context)
+    monkeypatch.setattr(idempotency, "_cache", OrderedDict())
+    assert handler(request(key="k1"), context) == (201, {"call": 1})
+    assert len(calls) == 1
+
+
+def test_key_reused_for_another_request_is_rejected(context):
+    handler, _ = counting()
+    handler(request(key="k1"), context)
+    status, _ = handler(request(body='{"email": "b@example.com"}', key="k1"), context)
+    assert status == 422
+
+
+def test_keys_are_per_caller(context):
+    handler, calls = counting()
+    handler(request(key="k1", caller="admin-1"), context)
+    handler(request(key="k1", caller="admin-2"), context)
+    assert len(calls) == 2
+
+
+def test_same_payload_without_key_runs_again(context):
+    handler, calls = counting()
+    assert handler(request(), context) == (201, {"call": 1})
+    assert handler(request(), context) == (201, {"call": 2})
+
+
+def test_duplicate_while_running_gets_409(context):
+    inner = []
+
+    @idempotency.idempotent("invite")
+    def handler(req, ctx):
+        if not inner:
+            inner.append(handler(request(), ctx))
+        return 201, {}
+
+    assert handler(request(), context) == (201, {})
+    assert inner[0][0] == 409
+
+
+def test_server_errors_are_not_stored(context):
+    handler, calls = counting(status=503)
+    handler(request(key="k1"), context)
+    handler(request(key="k1"), context)
+    assert len(calls) == 2
+
+
+def test_reads_are_not_guarded(context, store):
+    handler, calls = counting(status=200)
+    handler(request(key="k1", method="GET"), context)
+    assert len(calls) == 1
+    assert not store.partitions
+
+
+def test_overlong_key_is_rejected(context):
+    handler, _ = counting()
+    with pytest.raises(idempotency.ApiError) as error:
+        handler(request(key="k" * 256), context)
+    assert error.value.status == 400
@@ -0,0 +1,67 @@
+import pytest
+
+import jobs
+from conftest import OPS_TABLE
+
+
+@pytest.fixture(autouse=True)
+def ops(monkeypatch, dynamodb):
+    monkeypatch.setattr(jobs, "OPS_STATE_TABLE", OPS_TABLE)
+    return dynamodb[OPS_TABLE]
+
+
+def slices(ops, job_id):
+    return [
+        len(item["rows"])
+        for key, item in sorted(ops.partitions.items())
+        if key.startswith(f"JOB#{job_id}#ROWS#")
+        for item in item.values()
+    ]
+
+
+def test_rows_are_stored_in_slices(ops):
+    rows = [f"user{i}" for i in range(450)]
+    job_id = jobs.create_job("delete", len(rows), rows=rows)
+    assert slices(ops, job_id) == [200, 200, 50]
+    assert jobs.job_rows(job_id, 0, 450) == rows
+    assert jobs.job_rows(job_id, 190, 20) == rows[190:210]
+    assert jobs.job_rows(job_id, 400, 200) == rows[400:]
+
+
+def test_appended_rows_fill_the_partial_slice(ops):
+    job_id = jobs.create_job("delete", 0)
+    rows = [f"user{i}" for i in range(530)]
+    jobs.append_rows(job_id, 0, rows[:150])
+    jobs.append_rows(job_id, 150, rows[150:380])
+    jobs.append_rows(job_id, 380, rows[380:])
+    assert slices(ops, job_id) == [200, 200, 130]
+    assert jobs.job_rows(job_id, 0, 530) == rows
+
+
+def test_job_progress_and_finish():
+    job_id = jobs.create_job("invite", 3)
+    assert jobs.get_job(job_id)["status"] == jobs.QUEUED
+    jobs.record_results(job_id, [{"status": "ok"}, {"status": "failed"}], 1, 1)
+    jobs.record_results(job_id, [{"status": "ok"}], 1, 0)
+    job = jobs.get_job(job_id)
+    assert (job["processed"], job["succeeded"], job["failed"], job["result_slices"]) == (3, 2, 1, 2)
+    assert len(jobs.job_results(job_id, job["result_slices"])) == 3
+    assert jobs.finish_if_done(job_id)
+    assert jobs.get_job(job_id)["status"] == jobs.PARTIAL
+
+
+def test_slice_is_recorded_once():
+    job_id = jobs.create_job("invite", 2)
+    assert jobs.record_slice(job_id, 0, [{"status": "ok"}], 1, 0)
+    assert not jobs.record_slice(job_id, 0, [{"status": "ok"}], 1, 0)
+    assert jobs.slice_recorded(job_id, 0)
+    assert jobs.get_job(job_id)["processed"] == 1
+
+
+def test_failed_job_keeps_the_error():
+    job_id = jobs.create_job("export", 0)
+    jobs.fail_job(job_id, RuntimeError("upload refused"))
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "upload refused"
+    assert "finished_at" in job
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "_metrics", {})
+
+
+def flushed(capsys):
+    metrics.flush()
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_buckets_are_about_twelve_percent_wide():
+    assert metrics._bucket(0) == 0.1
+    assert metrics._bucket(100) == 100
+    assert metrics._bucket(110) == 100
+    assert metrics._bucket(115) == 112.2
+
+
+def test_counts_and_timings_share_a_line_per_dimension_set(capsys):
+    metrics.count("Calls")
+    metrics.count("Calls", 2)
+    metrics.observe("Latency", 5)
+    metrics.count("Calls", Operation="ListUsers")
+
+    lines = flushed(capsys)
+    assert len(lines) == 2
+    plain = next(line for line in lines if "Operation" not in line)
+    assert plain["Calls"] == 3
+    assert plain["Latency"] == {"Values": [metrics._bucket(5)], "Counts": [1]}
+    assert plain["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["FunctionName"]]
+
+
+def test_wide_histogram_is_split_across_lines_not_truncated(capsys):
+    samples = [1.13 ** i for i in range(250)]
+    for ms in samples:
+        metrics.observe("Latency", ms)
+    metrics.count("Calls", 7)
+
+    lines = flushed(capsys)
+    assert len(lines) > 1
+    assert all(len(line["Latency"]["Values"]) <= metrics.MAX_HISTOGRAM_VALUES for line in lines)
+    assert sum(sum(line["Latency"]["Counts"]) for line in lines) == len(samples)
+    values = [v for line in lines for v in line["Latency"]["Values"]]
+    assert len(values) == len(set(values))
+    # Counters are written once, or CloudWatch would add them up twice.
+    assert [line.get("Calls") for line in lines] == [7] + [None] * (len(lines) - 1)
+
+
+def test_flush_starts_over(capsys):
+    metrics.count("Calls")
+    assert flushed(capsys)
+    assert flushed(capsys) == []
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import pytest
+
+import snapshot_io
+
+RECORDS = [
+    {"username": f"user{i}", "attributes": {"email": f"user{i}@example.com"}, "groups": {"Admin"}, "n": Decimal(i)}
+    for i in range(500)
+]
+EXPECTED = [{**r, "groups": ["Admin"], "n": i} for i, r in enumerate(RECORDS)]
+
+
+@pytest.fixture(autouse=True)
+def s3(monkeypatch, fake_client, faults):
+    from stand_ins import FakeS3
+
+    # Small chunks make records straddle chunk boundaries on the way back.
+    monkeypatch.setattr(snapshot_io, "READ_CHUNK_SIZE", 64)
+    monkeypatch.setattr(snapshot_io, "SNAPSHOT_BUCKET", "snapshots")
+    return fake_client("s3", FakeS3(faults))
+
+
+def write(compression, records=RECORDS):
+    key = snapshot_io.data_key("snapshots/pool/1", 0, compression)
+    with snapshot_io.SnapshotWriter(key, compression=compression) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.entry
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none", "zstd"])
+def test_round_trip(compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    entry = write(compression)
+    assert entry["records"] == len(RECORDS)
+    assert list(snapshot_io.read_records(entry, compression)) == EXPECTED
+
+
+def test_data_keys_carry_the_codec_extension():
+    assert snapshot_io.data_key("p", 3, "gzip") == "p/part-03.ndjson.gz"
+    assert snapshot_io.data_key("p", 3, "zstd") == "p/part-03.ndjson.zst"
+    assert snapshot_io.data_key("p", 3, "none") == "p/part-03.ndjson"
+    with pytest.raises(ValueError):
+        snapshot_io.data_key("p", 3, "brotli")
+
+
+def test_object_not_matching_its_manifest_is_rejected():
+    entry = write("gzip")
+    with pytest.raises(ValueError):
+        list(snapshot_io.read_records({**entry, "records": entry["records"] + 1}, "gzip"))
+
+
+def test_truncated_object_is_rejected(s3):
+    entry = write("none")
+    s3.objects[entry["key"]] = s3.objects[entry["key"]][:-10]
+    with pytest.raises(ValueError):
+        list(snapshot_io.read_records(entry, "none"))
+
+
+def test_failed_block_leaves_no_object(s3):
+    with pytest.raises(RuntimeError):
+        with snapshot_io.SnapshotWriter("snapshots/pool/1/part-00.ndjson.gz") as writer:
+            writer.write({"username": "a"})
+            raise RuntimeError("listing failed")
+    assert s3.objects == {}
+
+
+def test_suspended_upload_resumes_where_it_stopped(s3):
+    writer = snapshot_io.SnapshotWriter("exports/users.csv", compression="none")
+    writer.write_lines(b"a\n")
+    state = writer.suspend()
+    resumed = snapshot_io.SnapshotWriter.resume("exports/users.csv", state)
+    resumed.write_lines(b"b\n")
+    entry = resumed.close()
+    assert s3.objects == {"exports/users.csv": b"a\nb\n"}
+    assert entry["records"] == 2
+
+
+def test_compressed_upload_cannot_be_suspended():
+    with pytest.raises(ValueError):
+        snapshot_io.SnapshotWriter("k", compression="gzip").suspend()
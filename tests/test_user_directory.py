@@ -0,0 +1,37 @@
+import base64
+import json
+
+import pytest
+
+import user_directory
+
+
+def test_cursor_round_trips():
+    key = {"pk": "USER#alice", "entity": "USER", "role": "Admin"}
+    token = user_directory.encode_cursor(key)
+    assert user_directory.decode_cursor(token) == key
+
+
+def test_no_last_key_means_no_cursor():
+    assert user_directory.encode_cursor(None) is None
+    assert user_directory.encode_cursor({}) is None
+
+
+@pytest.mark.parametrize("token", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode(json.dumps(["pk"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"pk": 1}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"pk": {"S": "x"}}).encode()).decode(),
+])
+def test_forged_cursor_is_rejected(token):
+    with pytest.raises(ValueError):
+        user_directory.decode_cursor(token)
+
+
+def test_role_comes_from_the_first_role_group(monkeypatch):
+    monkeypatch.setattr(user_directory, "ROLE_GROUPS", ["Admin", "CityOfficial"])
+    assert user_directory.role_from_groups(["CityOfficial", "Admin"]) == "Admin"
+    assert user_directory.role_from_groups(["Other"]) == user_directory.DEFAULT_ROLE
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import jobs
+import write_queue
+from api import Request
+from conftest import OPS_TABLE
+
+
+@pytest.fixture(autouse=True)
+def ops(monkeypatch, dynamodb):
+    monkeypatch.setattr(jobs, "OPS_STATE_TABLE", OPS_TABLE)
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_URL", "https://sqs.test/writes")
+    return dynamodb[OPS_TABLE]
+
+
+@pytest.fixture
+def sqs(fake_client, faults):
+    from stand_ins import FakeSQS
+
+    return fake_client("sqs", FakeSQS(faults))
+
+
+def deliver(sqs, work):
+    event = {"Records": [{**m, "eventSource": "aws:sqs"} for m in sqs.queue]}
+    sqs.queue.clear()
+    return write_queue.consume_slices(event, work)
+
+
+def echo(job, start, rows):
+    return [{"row": start + i, "username": row, "status": "ok"} for i, row in enumerate(rows)]
+
+
+def test_one_message_per_slice_sent_in_batches(sqs, faults):
+    rows = [f"user{i}" for i in range(2050)]
+    job_id = jobs.create_job("delete", len(rows), rows=rows)
+    write_queue.enqueue_job(job_id, len(rows))
+    assert [json.loads(m["body"])["slice"] for m in sqs.queue] == list(range(11))
+    assert faults.calls["sqs.SendMessageBatch"] == 2
+
+
+def test_slices_cover_every_row_once(sqs):
+    rows = [f"user{i}" for i in range(450)]
+    job_id = jobs.create_job("delete", len(rows), rows=rows)
+    write_queue.enqueue_job(job_id, len(rows))
+    assert deliver(sqs, echo) == {"batchItemFailures": []}
+
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.SUCCEEDED
+    results = jobs.job_results(job_id, job["result_slices"])
+    assert sorted(r["row"] for r in results) == list(range(450))
+    assert {r["username"] for r in results} == set(rows)
+
+
+def test_redelivered_slice_is_skipped(sqs):
+    job_id = jobs.create_job("delete", 3, rows=["a", "b", "c"])
+    write_queue.enqueue_job(job_id, 3)
+    message = sqs.queue[0]
+    deliver(sqs, echo)
+    calls = []
+    write_queue.process_slice(json.loads(message["body"]), lambda *args: calls.append(args) or [])
+    assert calls == []
+    assert jobs.get_job(job_id)["processed"] == 3
+
+
+def test_failing_slice_is_reported_back(sqs):
+    job_id = jobs.create_job("delete", 3, rows=["a", "b", "c"])
+    write_queue.enqueue_job(job_id, 3)
+
+    def broken(job, start, rows):
+        raise RuntimeError("boom")
+
+    assert deliver(sqs, broken) == {"batchItemFailures": [{"itemIdentifier": "m-1"}]}
+
+
+def test_rejected_messages_fail_the_job(sqs, monkeypatch):
+    monkeypatch.setattr(sqs, "send_message_batch", lambda **kwargs: {"Failed": [{"Message": "too big"}]})
+    job_id = jobs.create_job("delete", 3, rows=["a", "b", "c"])
+    with pytest.raises(RuntimeError):
+        write_queue.enqueue_job(job_id, 3)
+    assert jobs.get_job(job_id)["status"] == jobs.FAILED
+
+
+def test_prefer_header_asks_for_async(monkeypatch):
+    assert write_queue.wants_async(Request({"headers": {"Prefer": "respond-async"}}))
+    assert not write_queue.wants_async(Request({"headers": {}}))
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_URL", None)
+    assert not write_queue.wants_async(Request({"headers": {"Prefer": "respond-async"}}))